@@ -0,0 +1,236 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from metrics import ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED, ADMISSION_QUEUED, ADMISSION_ACTIVE
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first. Interactive turns beat naming and homework; background jobs go last.
+ENDPOINT_PRIORITIES = {
+    "process_audio": 0,
+    "process_audio_stream": 0,
+    "generate_chat_name": 1,
+    "generate_homework": 2,
+    "job": 3,
+}
+
+def _limits(prefix, defaults):
+    return {name: int(os.getenv(f"{prefix}_{name.upper()}", str(limit))) for name, limit in defaults.items()}
+
+def _timeouts(prefix, defaults):
+    timeouts = {}
+    for name, timeout in defaults.items():
+        value = os.getenv(f"{prefix}_{name.upper()}", "" if timeout is None else str(timeout))
+        timeouts[name] = float(value) if value else None
+    return timeouts
+
+# Requests of each endpoint served at once; 0 means unlimited. Override with ADMISSION_LIMIT_<ENDPOINT>.
+ENDPOINT_LIMITS = _limits("ADMISSION_LIMIT", {
+    "process_audio": 64,
+    "process_audio_stream": 64,
+    "generate_chat_name": 8,
+    "generate_homework": 4,
+    "job": 0,
+})
+# Requests sent to each provider at once, across endpoints. Override with PROVIDER_CONCURRENCY_<PROVIDER>.
+PROVIDER_LIMITS = _limits("PROVIDER_CONCURRENCY", {
+    "groq": 48,
+    "openai": 48,
+    "anthropic": 16,
+})
+# How long a request may wait for a slot before it is shed with a 503; empty means wait
+# indefinitely. Override with ADMISSION_TIMEOUT_<ENDPOINT>.
+QUEUE_TIMEOUTS = _timeouts("ADMISSION_TIMEOUT", {
+    "process_audio": 2.0,
+    "process_audio_stream": 2.0,
+    "generate_chat_name": 5.0,
+    "generate_homework": 10.0,
+    "job": None,
+})
+# Beyond this many waiting requests new ones are rejected without queueing
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Ticket:
+    """
+    A granted slot; hand it back with AdmissionController.release().
+    """
+
+    def __init__(self, endpoint, provider):
+        self.endpoint = endpoint
+        self.provider = provider
+        self.released = False
+
+class _Waiter:
+    def __init__(self, priority, sequence, endpoint, provider, future):
+        self.priority = priority
+        self.sequence = sequence
+        self.endpoint = endpoint
+        self.provider = provider
+        self.future = future
+
+class AdmissionController:
+    """
+    Bounds concurrent work per endpoint and per provider, serving waiters by priority.
+
+    A request takes one slot of its endpoint and one of its provider for as long as it
+    runs. When either is full it waits; whenever slots free up, waiters are granted in
+    priority order (then arrival order), skipping any whose endpoint or provider is still
+    full, so a blocked homework request never holds up a turn on another provider.
+
+    Waiting is bounded: past its endpoint's queue timeout, or when the queue is already
+    `max_queue` long, a request is rejected with AdmissionRejectedError so callers can shed
+    it with a 503 instead of letting it time out later.
+    """
+
+    def __init__(self, endpoint_limits=ENDPOINT_LIMITS, provider_limits=PROVIDER_LIMITS,
+                 queue_timeouts=QUEUE_TIMEOUTS, max_queue=ADMISSION_MAX_QUEUE):
+        self.endpoint_limits = dict(endpoint_limits)
+        self.provider_limits = dict(provider_limits)
+        self.queue_timeouts = dict(queue_timeouts)
+        self.max_queue = max_queue
+        self._active = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    def _has_room(self, endpoint, provider):
+        for resource, limits in ((("endpoint", endpoint), self.endpoint_limits),
+                                 (("provider", provider), self.provider_limits)):
+            limit = limits.get(resource[1], 0)
+            if limit and self._active.get(resource, 0) >= limit:
+                return False
+        return True
+
+    def _take(self, endpoint, provider):
+        for resource in (("endpoint", endpoint), ("provider", provider)):
+            self._active[resource] = self._active.get(resource, 0) + 1
+        ADMISSION_ACTIVE.inc(endpoint=endpoint)
+        self.stats["admitted"] += 1
+        return Ticket(endpoint, provider)
+
+    def _dispatch(self):
+        remaining = []
+        for waiter in self._waiters:
+            if waiter.future.done():
+                continue
+            if self._has_room(waiter.endpoint, waiter.provider):
+                waiter.future.set_result(self._take(waiter.endpoint, waiter.provider))
+            else:
+                remaining.append(waiter)
+        self._waiters = remaining
+
+    def _retry_after(self, endpoint):
+        timeout = self.queue_timeouts.get(endpoint)
+        return max(1, int(timeout + 0.999)) if timeout else 1
+
+    def _reject(self, endpoint, reason, message):
+        self.stats["rejected"] += 1
+        ADMISSION_REJECTED.inc(endpoint=endpoint, reason=reason)
+        logger.warning(f"Shedding {endpoint} request: {message}")
+        raise AdmissionRejectedError(message, self._retry_after(endpoint))
+
+    async def acquire(self, endpoint, provider=""):
+        """
+        Waits for a slot for one request.
+
+        Args:
+        endpoint (str): The endpoint (or "job"), which sets the priority, limit and queue timeout.
+        provider (str, optional): The provider the request will call.
+
+        Returns:
+        Ticket: The granted slot.
+
+        Raises:
+        AdmissionRejectedError: If the queue is full or the wait exceeds the endpoint's timeout.
+        """
+        start = time.perf_counter()
+        if not self._waiters and self._has_room(endpoint, provider):
+            ADMISSION_WAIT_SECONDS.observe(0.0, endpoint=endpoint)
+            return self._take(endpoint, provider)
+        if len(self._waiters) >= self.max_queue:
+            self._reject(endpoint, "queue_full", f"{len(self._waiters)} requests already waiting")
+
+        future = asyncio.get_running_loop().create_future()
+        priority = ENDPOINT_PRIORITIES.get(endpoint, max(ENDPOINT_PRIORITIES.values()))
+        waiter = _Waiter(priority, next(self._sequence), endpoint, provider, future)
+        self._waiters.append(waiter)
+        self._waiters.sort(key=lambda item: (item.priority, item.sequence))
+        self.stats["queued"] += 1
+        ADMISSION_QUEUED.inc(endpoint=endpoint)
+        # A slot may be free for this waiter even though others are queued ahead of it
+        self._dispatch()
+        try:
+            ticket = await asyncio.wait_for(asyncio.shield(future), self.queue_timeouts.get(endpoint))
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted just as the timeout fired; give the slot straight back
+                self.release(future.result())
+            future.cancel()
+            self._reject(endpoint, "timeout", f"no {endpoint} slot within {self.queue_timeouts.get(endpoint)}s")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(future.result())
+            future.cancel()
+            raise
+        finally:
+            ADMISSION_QUEUED.dec(endpoint=endpoint)
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        return ticket
+
+    def release(self, ticket):
+        """
+        Frees a ticket's slots and admits waiters. Releasing a ticket twice is a no-op.
+
+        Args:
+        ticket (Ticket): The ticket returned by acquire().
+        """
+        if ticket is None or ticket.released:
+            return
+        ticket.released = True
+        for resource in (("endpoint", ticket.endpoint), ("provider", ticket.provider)):
+            self._active[resource] -= 1
+        ADMISSION_ACTIVE.dec(endpoint=ticket.endpoint)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, endpoint, provider=""):
+        """
+        Holds a slot for the duration of the block. See acquire().
+        """
+        ticket = await self.acquire(endpoint, provider)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_stats(self):
+        """
+        Returns admission counters, current usage and the configured limits.
+
+        Returns:
+        dict: Admission statistics.
+        """
+        waiting = {}
+        for waiter in self._waiters:
+            if not waiter.future.done():
+                waiting[waiter.endpoint] = waiting.get(waiter.endpoint, 0) + 1
+        return {
+            **self.stats,
+            "active": {f"{kind}:{name}": count for (kind, name), count in self._active.items() if count},
+            "waiting": waiting,
+            "endpoint_limits": self.endpoint_limits,
+            "provider_limits": self.provider_limits,
+            "queue_timeouts": self.queue_timeouts,
+        }
+
+admission_controller = AdmissionController()
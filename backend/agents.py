@@ -1,22 +1,67 @@
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
-from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError
+from typing import Literal
 import logging
 import traceback
 import asyncio
-from prompts import *
-
-load_dotenv()
+import json
+import os
+import re
+from prompt_registry import prompt_registry
+from clients import client_registry
+from context_builder import context_builder
+from hedging import hedger
+from model_router import model_router
+from provider_health import ProviderUnavailableError
 
 logger = logging.getLogger(__name__)
 
+# "split" runs the three tutor prompts in parallel; "structured" asks for all three fields in one call
+TUTOR_MODE = os.getenv("TUTOR_MODE", "split")
+
+INTERVENTION_LEVELS = ("no", "low", "medium", "high")
+# Used when the model names no level: better to stay quiet than to interrupt on a guess
+DEFAULT_INTERVENTION_LEVEL = "no"
+
+# Returned by generate_chat_name when the model call fails
+FALLBACK_CHAT_NAME = "Empty Chat"
+
+class TutorFeedback(BaseModel):
+    comments: str
+    correction: str
+    intervene: Literal["no", "low", "medium", "high"]
+
+def parse_intervention_level(text):
+    """
+    Extracts the intervention level from a model reply such as '"Medium."'.
+
+    A reply that is just a level wins; otherwise the last level mentioned is taken, so
+    "no, rather high" reads as "high". A reply without any level (for instance one in
+    the tutor's language) falls back to DEFAULT_INTERVENTION_LEVEL rather than failing
+    the turn.
+
+    Args:
+    text (str): The raw model output.
+
+    Returns:
+    str: One of "no", "low", "medium" or "high".
+    """
+    words = re.findall(r'[a-z]+', text.lower())
+    if len(words) == 1 and words[0] in INTERVENTION_LEVELS:
+        return words[0]
+    levels = [word for word in words if word in INTERVENTION_LEVELS]
+    if levels:
+        return levels[-1]
+    logger.warning(f"No intervention level in model output: {text!r}; using {DEFAULT_INTERVENTION_LEVEL!r}")
+    return DEFAULT_INTERVENTION_LEVEL
+
 def get_llm(provider, model_name, api_key):
     """
-    Creates and returns a language model instance based on the specified provider.
-    
+    Returns a language model instance based on the specified provider.
+
+    Instances are long-lived and shared through the client registry, so repeated calls with
+    the same (provider, model, api_key) reuse the same client and its open connections.
+
     Args:
     provider (str): The provider of the language model (groq, openai, or anthropic).
     model_name (str): The name of the specific model to use.
@@ -28,38 +73,31 @@ def get_llm(provider, model_name, api_key):
     Raises:
     ValueError: If an unsupported provider is specified.
     """
-    if provider == "groq":
-        return ChatGroq(
-            model=model_name,
-            temperature=0,
-            api_key=api_key,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-        )
-    elif provider == "openai":
-        return ChatOpenAI(
-            model=model_name,
-            temperature=0,
-            api_key=api_key,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-        )
-    elif provider == "anthropic":
-        return ChatAnthropic(
-            model=model_name,
-            temperature=0,
-            api_key=api_key,
-            timeout=None,
-            max_retries=2,
-        )
-    else:
-        raise ValueError(f"Unsupported provider: {provider}")
+    return client_registry.get_llm(provider, model_name, api_key)
 
-async def partner_chat(learning_language, chat_history, api_key, provider="groq", last_summary=""):
+def get_task_llm(task, provider, api_key):
     """
-    Generates a response from the AI partner in the specified learning language.
+    Returns the language model the routing table (model_router.py) assigns to a task.
+
+    Args:
+    task (str): The task name, as in prompt_registry.
+    provider (str): The provider of the language model (groq, openai, or anthropic).
+    api_key (str): The API key for authentication.
+
+    Returns:
+    An instance of the routed language model, with the route's max_tokens and timeout.
+
+    Raises:
+    ValueError: If the task has no route for the provider.
+    """
+    route = model_router.route(task, provider)
+    return client_registry.get_llm(provider, route.model, api_key, max_tokens=route.max_tokens, timeout=route.timeout)
+
+def build_partner_chain(learning_language, chat_history, api_key, provider="groq", last_summary=""):
+    """
+    Builds the partner prompt chain and its inputs.
+
+    Shared by partner_chat and stream_partner_chat so both use the same model, prompt and context.
 
     Args:
     learning_language (str): The language being learned.
@@ -69,45 +107,85 @@ async def partner_chat(learning_language, chat_history, api_key, provider="groq"
     last_summary (str, optional): The last summary of the conversation. Defaults to "".
 
     Returns:
-    tuple: A tuple containing the AI's response and the updated chat history.
+    tuple: The runnable chain and the input dict to call it with.
 
     Raises:
     ValueError: If an unsupported provider is specified.
     """
-    if provider == "groq":
-        model = "llama3-70b-8192"
-    elif provider == "openai":
-        model = "gpt-4o-mini"
-    elif provider == "anthropic":
-        model = "claude-3-5-sonnet-20240620"
-    else:
-        raise ValueError(f"Unsupported provider: {provider}")
-    
-    llm = get_llm(provider, model, api_key)
+    llm = get_task_llm("partner", provider, api_key)
 
-    recent_chat_history = chat_history[-8:]
+    context = context_builder.build("partner", chat_history, summary=last_summary)
 
-    system_template = get_partner_prompt(learning_language, last_summary)
+    partner_template = prompt_registry.get("partner", learning_language)
 
-    partner_template = ChatPromptTemplate.from_messages([
-        ("system", system_template), 
-        MessagesPlaceholder(variable_name="chat_history")
-    ])
+    chain = (partner_template | llm).with_config(prompt_registry.config("partner"))
 
-    chain = partner_template | llm
+    inputs = {
+        "last_summary": context.summary,
+        "chat_history": context.items
+    }
 
-    response = chain.invoke(
-        {
-            "learning_language": learning_language,
-            "chat_history": recent_chat_history
-        }
-    )
+    return chain, inputs
+
+async def partner_chat(learning_language, chat_history, api_key, provider="groq", last_summary=""):
+    """
+    Generates a response from the AI partner in the specified learning language.
+
+    Args:
+    learning_language (str): The language being learned.
+    chat_history (list): The history of the conversation.
+    api_key (str): The API key for authentication.
+    provider (str, optional): The AI provider to use. Defaults to "groq".
+    last_summary (str, optional): The last summary of the conversation. Defaults to "".
+
+    Returns:
+    tuple: A tuple containing the AI's response and the updated chat history.
+
+    Raises:
+    ValueError: If an unsupported provider is specified.
+    """
+    async def run(provider, api_key):
+        chain, inputs = build_partner_chain(learning_language, chat_history, api_key, provider, last_summary)
+        return await chain.ainvoke(inputs)
+
+    # A slow reply may be hedged on a secondary provider or key (see hedging.py)
+    response = await hedger.call("partner", provider, api_key, run)
 
     wrapped_response = AIMessage(content=response.content)
     new_chat_history = chat_history + [wrapped_response]
 
     return response, new_chat_history
 
+async def stream_partner_chat(learning_language, chat_history, api_key, provider="groq", last_summary=""):
+    """
+    Streams the AI partner's response token by token.
+
+    Same prompt and context as partner_chat, but yields the reply as it is generated so the
+    caller can start text-to-speech on the first sentence before the reply is complete.
+
+    Args:
+    learning_language (str): The language being learned.
+    chat_history (list): The history of the conversation.
+    api_key (str): The API key for authentication.
+    provider (str, optional): The AI provider to use. Defaults to "groq".
+    last_summary (str, optional): The last summary of the conversation. Defaults to "".
+
+    Yields:
+    str: Chunks of the partner's reply, in order.
+
+    Raises:
+    ValueError: If an unsupported provider is specified.
+    """
+    async def open_stream(provider, api_key):
+        chain, inputs = build_partner_chain(learning_language, chat_history, api_key, provider, last_summary)
+        async for chunk in chain.astream(inputs):
+            if chunk.content:
+                yield chunk.content
+
+    # Hedged on the time to the first chunk; the reply continues from whichever stream starts first
+    async for chunk in hedger.stream("partner_stream", provider, api_key, open_stream):
+        yield chunk
+
 async def tutor_chat(tutoring_language, tutors_language, chat_history, tutor_history, provider="groq", api_key=None):
     """
     Generates tutor feedback based on the conversation history.
@@ -134,85 +212,48 @@ async def tutor_chat(tutoring_language, tutors_language, chat_history, tutor_his
         if last_human_message is None:
             raise ValueError("No human message found in chat history")
 
-        async def get_tutors_comment():
+        async def get_tutors_comment(provider, api_key):
             """
             Generates the tutor's comment on the last human message.
             """
-            if provider == "groq":
-                model = "llama3-70b-8192"
-            elif provider == "openai":
-                model = "gpt-4o-mini"
-            elif provider == "anthropic":
-                model = "claude-3-5-sonnet-20240620"
-            else:
-                raise ValueError(f"Unsupported provider: {provider}")
-        
-            llm = get_llm(provider, model, api_key)
-            comment_template = get_tutor_comment_prompt(tutoring_language, tutors_language)
-            
-            comment_prompt = ChatPromptTemplate.from_messages([
-                ("system", comment_template),
-                ("human", last_human_message.content)
-            ])
-            comment_chain = comment_prompt | llm
-            response = await comment_chain.ainvoke({"tutors_language": tutors_language, "tutoring_language": tutoring_language})
+            llm = get_task_llm("tutor_comment", provider, api_key)
+            comment_prompt = prompt_registry.get("tutor_comment", tutoring_language, tutors_language)
+            comment_chain = (comment_prompt | llm).with_config(prompt_registry.config("tutor_comment"))
+            response = await comment_chain.ainvoke({"utterance": last_human_message.content})
             return response.content
 
-        async def get_intervention_level():
+        async def get_intervention_level(provider, api_key):
             """
             Determines the level of intervention needed based on recent tutor comments.
             """
-            if provider == "groq":
-                model = "llama3-70b-8192"
-            elif provider == "openai":
-                model = "gpt-4o-mini"
-            elif provider == "anthropic":
-                model = "claude-3-5-sonnet-20240620"
-            else:
-                raise ValueError(f"Unsupported provider: {provider}")
-        
-            llm = get_llm(provider, model, api_key)
+            llm = get_task_llm("intervention_level", provider, api_key)
             
-            tutor_comments = [comment for comment in tutor_history if comment.startswith("Comment:")][-4:]
-            tutor_comments_str = ' '.join(tutor_comments)
+            tutor_comments = [comment for comment in tutor_history if comment.startswith("Comment:")]
+            tutor_comments_str = ' '.join(context_builder.build("tutor_comments", tutor_comments).items)
             
-            level_template = get_intervention_level_prompt(tutoring_language, last_human_message.content, tutor_comments_str)
-            
-            level_prompt = ChatPromptTemplate.from_messages([
-                ("human", level_template)
-            ])
-            level_chain = level_prompt | llm
-            response = await level_chain.ainvoke({})
-            return response.content
-
-        async def get_best_expression():
+            level_prompt = prompt_registry.get("intervention_level", tutoring_language)
+            level_chain = (level_prompt | llm).with_config(prompt_registry.config("intervention_level"))
+            response = await level_chain.ainvoke({
+                "tutor_comments": tutor_comments_str,
+                "last_human_message": last_human_message.content
+            })
+            return parse_intervention_level(response.content)
+
+        async def get_best_expression(provider, api_key):
             """
             Generates the best expression or correction for the last human message.
             """
-            if provider == "groq":
-                model = "llama3-70b-8192"
-            elif provider == "openai":
-                model = "gpt-4o-mini"
-            elif provider == "anthropic":
-                model = "claude-3-5-sonnet-20240620"
-            else:
-                raise ValueError(f"Unsupported provider: {provider}")
-        
-            llm = get_llm(provider, model, api_key)
+            llm = get_task_llm("best_expression", provider, api_key)
                 
-            expression_template = get_best_expression_prompt(tutoring_language)
-            expression_prompt = ChatPromptTemplate.from_messages([
-                ("system", expression_template),
-                ("human", last_human_message.content)
-            ])
-            expression_chain = expression_prompt | llm
-            response = await expression_chain.ainvoke({"tutoring_language": tutoring_language})
+            expression_prompt = prompt_registry.get("best_expression", tutoring_language)
+            expression_chain = (expression_prompt | llm).with_config(prompt_registry.config("best_expression"))
+            response = await expression_chain.ainvoke({"utterance": last_human_message.content})
             return response.content
 
         tutors_comment, intervention_level, best_expression = await asyncio.gather(
-            get_tutors_comment(),
-            get_intervention_level(),
-            get_best_expression()
+            hedger.call("tutor_comment", provider, api_key, get_tutors_comment),
+            hedger.call("intervention_level", provider, api_key, get_intervention_level),
+            hedger.call("best_expression", provider, api_key, get_best_expression)
         )
 
         tutor_feedback = {
@@ -227,6 +268,80 @@ async def tutor_chat(tutoring_language, tutors_language, chat_history, tutor_his
         logger.error(traceback.format_exc())
         raise
 
+async def tutor_chat_structured(tutoring_language, tutors_language, chat_history, tutor_history, provider="groq", api_key=None):
+    """
+    Generates tutor feedback with a single structured-output call.
+
+    Asks for the comment, correction and intervention level as one JSON object instead of
+    three separate prompts, so the shared context is sent once and the turn waits on one call.
+    Falls back to the three-call tutor_chat if the reply isn't valid JSON of the right shape.
+
+    Args:
+    tutoring_language (str): The language being tutored.
+    tutors_language (str): The language the tutor uses for explanations.
+    chat_history (list): The history of the conversation.
+    tutor_history (list): The history of tutor comments.
+    provider (str, optional): The AI provider to use. Defaults to "groq".
+    api_key (str, optional): The API key for authentication. Defaults to None.
+
+    Returns:
+    dict: A dictionary containing tutor feedback, including comments, corrections, and intervention level.
+
+    Raises:
+    ValueError: If chat history is empty or no human message is found.
+    """
+    if not isinstance(chat_history, list) or len(chat_history) == 0:
+        raise ValueError("Chat history must be a non-empty list")
+
+    last_human_message = next((msg for msg in reversed(chat_history) if isinstance(msg, HumanMessage)), None)
+    if last_human_message is None:
+        raise ValueError("No human message found in chat history")
+
+    tutor_comments = [comment for comment in tutor_history if comment.startswith("Comment:")]
+    tutor_comments_str = ' '.join(context_builder.build("tutor_comments", tutor_comments).items)
+    structured_prompt = prompt_registry.get("structured_tutor", tutoring_language, tutors_language)
+
+    async def run(provider, api_key):
+        llm = get_task_llm("structured_tutor", provider, api_key)
+        structured_chain = (structured_prompt | llm).with_config(prompt_registry.config("structured_tutor"))
+        return await structured_chain.ainvoke({
+            "tutor_comments": tutor_comments_str,
+            "utterance": last_human_message.content
+        })
+
+    response = await hedger.call("structured_tutor", provider, api_key, run)
+
+    try:
+        # Tolerate models that wrap the object in code fences or add a preamble
+        match = re.search(r'\{.*\}', response.content, re.DOTALL)
+        if match is None:
+            raise ValueError("No JSON object in model output")
+        feedback = TutorFeedback.model_validate(json.loads(match.group(0)))
+        return feedback.model_dump()
+    except (ValueError, ValidationError) as e:
+        logger.warning(f"Structured tutor output unusable ({str(e)}); falling back to three-call tutor_chat")
+        return await tutor_chat(tutoring_language, tutors_language, chat_history, tutor_history, provider=provider, api_key=api_key)
+
+async def run_tutor(tutoring_language, tutors_language, chat_history, tutor_history, provider="groq", api_key=None, mode=None):
+    """
+    Runs the tutor in the configured mode.
+
+    Args:
+    tutoring_language (str): The language being tutored.
+    tutors_language (str): The language the tutor uses for explanations.
+    chat_history (list): The history of the conversation.
+    tutor_history (list): The history of tutor comments.
+    provider (str, optional): The AI provider to use. Defaults to "groq".
+    api_key (str, optional): The API key for authentication. Defaults to None.
+    mode (str, optional): "split" or "structured". Defaults to TUTOR_MODE.
+
+    Returns:
+    dict: A dictionary containing tutor feedback, including comments, corrections, and intervention level.
+    """
+    if (mode or TUTOR_MODE) == "structured":
+        return await tutor_chat_structured(tutoring_language, tutors_language, chat_history, tutor_history, provider=provider, api_key=api_key)
+    return await tutor_chat(tutoring_language, tutors_language, chat_history, tutor_history, provider=provider, api_key=api_key)
+
 async def summarize_conversation(tutoring_language, chat_history, previous_summary, provider="groq", api_key=None):
     """
     Summarizes the conversation based on the chat history and previous summary.
@@ -243,39 +358,29 @@ async def summarize_conversation(tutoring_language, chat_history, previous_summa
 
     Raises:
     ValueError: If an unsupported provider is specified.
+    Exception: Any error from the model call is logged and re-raised.
     """
     logger.info(f"Summarizing conversation. Provider: {provider}, Tutoring language: {tutoring_language}")
     logger.info(f"Previous summary: {previous_summary}")
     logger.info(f"Chat history length: {len(chat_history)}")
 
-    if provider == "groq":
-        model = "llama3-70b-8192"
-    elif provider == "openai":
-        model = "gpt-4o-mini"
-    elif provider == "anthropic":
-        model = "claude-3-5-sonnet-20240620"
-    else:
-        raise ValueError(f"Unsupported provider: {provider}")
-
-    llm = get_llm(provider, model, api_key)
+    llm = get_task_llm("summary", provider, api_key)
 
-    last_messages = chat_history[-5:] if len(chat_history) > 5 else chat_history
+    context = context_builder.build("summary", chat_history, summary=previous_summary)
+    last_messages = context.items
     logger.debug(f"Last messages to summarize: {last_messages}")
     
     chat_history_str = str("\n".join([f"{msg.type}: {msg.content}" for msg in last_messages]))
-    system_template = get_summarizer_prompt(tutoring_language, previous_summary, chat_history_str)
-    logger.debug(f"System template: {system_template}")
+    summarizer_template = prompt_registry.get("summary", tutoring_language)
 
-    summarizer_template = ChatPromptTemplate.from_messages([
-        ("system", system_template),
-        ("human","Please proceed:")
-    ])
-
-    chain = summarizer_template | llm
+    chain = (summarizer_template | llm).with_config(prompt_registry.config("summary"))
 
 
     try:
-        response = await chain.ainvoke({})
+        response = await chain.ainvoke({
+            "previous_summary": context.summary,
+            "chat_history": chat_history_str
+        })
         logger.info(f"Raw response from LLM: {response}")
 
         updated_summary = response.content
@@ -286,9 +391,10 @@ async def summarize_conversation(tutoring_language, chat_history, previous_summa
 
         return updated_summary
     except Exception as e:
+        # Callers decide what a failed summary means; an empty one would replace the stored summary
         logger.error(f"Error in summarize_conversation: {str(e)}")
         logger.error(traceback.format_exc())
-        return ""
+        raise
 
 async def generate_homework(tutoring_language, full_context, provider="groq", api_key=None):
     """
@@ -307,36 +413,19 @@ async def generate_homework(tutoring_language, full_context, provider="groq", ap
     ValueError: If an unsupported provider is specified.
     """
     try:
-        if provider == "groq":
-            model = "llama3-70b-8192"
-        elif provider == "openai":
-            model = "gpt-4o-2024-08-06"
-        elif provider == "anthropic":
-            model = "claude-3-5-sonnet-20240620"
-        else:
-            raise ValueError(f"Unsupported provider: {provider}")
-        
-        llm = get_llm(provider, model, api_key)
+        grammar_llm = get_task_llm("grammar", provider, api_key)
+        vocabulary_llm = get_task_llm("vocabulary", provider, api_key)
 
         # Call the grammar and vocabulary prompts in parallel
-        grammar_template = get_grammar_prompt(tutoring_language, full_context)
-        vocabulary_template = get_vocabulary_prompt(tutoring_language, full_context)
+        grammar_prompt = prompt_registry.get("grammar", tutoring_language)
+        vocabulary_prompt = prompt_registry.get("vocabulary", tutoring_language)
 
-        grammar_prompt = ChatPromptTemplate.from_messages([
-            ("system", grammar_template),
-             ("human","Please proceed:")
-        ])
-        vocabulary_prompt = ChatPromptTemplate.from_messages([
-            ("system", vocabulary_template),
-             ("human","Please proceed:")
-        ])
-
-        grammar_chain = grammar_prompt | llm
-        vocabulary_chain = vocabulary_prompt | llm
+        grammar_chain = (grammar_prompt | grammar_llm).with_config(prompt_registry.config("grammar"))
+        vocabulary_chain = (vocabulary_prompt | vocabulary_llm).with_config(prompt_registry.config("vocabulary"))
 
         grammar_response, vocabulary_response = await asyncio.gather(
-            grammar_chain.ainvoke({}),
-            vocabulary_chain.ainvoke({})
+            grammar_chain.ainvoke({"chat_history": full_context}),
+            vocabulary_chain.ainvoke({"chat_history": full_context})
         )
 
         # Format and combine responses
@@ -373,37 +462,26 @@ async def generate_chat_name(summary, provider="groq", api_key=None):
     str: A generated name for the chat.
 
     Raises:
-    Exception: If an error occurs during the chat name generation process.
+    ProviderUnavailableError: If the provider's circuit is open. Other errors return FALLBACK_CHAT_NAME.
     """
     try:
         if not summary:
             return "New Chat"
 
-        if provider == "groq":
-            model = "llama3-70b-8192"
-        elif provider == "openai":
-            model = "gpt-4o-2024-08-06"
-        elif provider == "anthropic":
-            model = "claude-3-5-sonnet-20240620"
-        else:
-            raise ValueError(f"Unsupported provider: {provider}")
-        
-        llm = get_llm(provider, model, api_key)
-
-        chat_name_template = get_chat_name_prompt(summary)
+        llm = get_task_llm("chat_name", provider, api_key)
 
-        chat_name_prompt = ChatPromptTemplate.from_messages([
-            ("system", chat_name_template),
-             ("human","Please proceed:")
-        ])
+        chat_name_prompt = prompt_registry.get("chat_name")
 
-        chat_name_chain = chat_name_prompt | llm
+        chat_name_chain = (chat_name_prompt | llm).with_config(prompt_registry.config("chat_name"))
 
-        response = await chat_name_chain.ainvoke({})
+        response = await chat_name_chain.ainvoke({"summary": summary})
 
         return response.content.strip()
 
+    except (ProviderUnavailableError, asyncio.CancelledError):
+        # Left to the caller: a 503 with Retry-After, or the request going away
+        raise
     except Exception as e:
         logger.error(f"An error occurred in generate_chat_name: {str(e)}")
         logger.error(traceback.format_exc())
-        return "Empty Chat"  # Fallback name in case of any error
+        return FALLBACK_CHAT_NAME  # Fallback name in case of any error
@@ -0,0 +1,78 @@
+"""
+Measures how long the backend takes to import, and which modules the time goes to.
+
+Imports the app in fresh interpreters under `python -X importtime` and reports, per run,
+the wall time of the import, then (from the median run) the slowest top-level packages by
+self time summed over their submodules and the slowest modules by cumulative time.
+`--eager-providers` also imports the provider SDKs the app otherwise loads on first use,
+to show what the lazy loading saves on a cold start.
+
+Usage (from backend/):
+    python -m benchmarks.startup --runs 5 --top 15
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROVIDER_MODULES = ["langchain_groq", "langchain_openai", "langchain_anthropic", "openai"]
+
+def parse_importtime(stderr):
+    """
+    Parses `-X importtime` output into (module, self_us, cumulative_us) rows.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def measure(module, eager_providers):
+    statements = [f"import {module}"]
+    if eager_providers:
+        statements = [f"import {name}" for name in PROVIDER_MODULES] + statements
+    code = "; ".join(["import time", "start = time.perf_counter()", *statements,
+                      "print(time.perf_counter() - start)"])
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="module to import")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--eager-providers", action="store_true",
+                        help="also import the provider SDKs, as the app did before they were loaded lazily")
+    args = parser.parse_args()
+
+    runs = [measure(args.module, args.eager_providers) for _ in range(args.runs)]
+    wall_times = [wall for wall, _ in runs]
+    print(f"import {args.module}: median {statistics.median(wall_times) * 1000:.0f} ms, "
+          f"min {min(wall_times) * 1000:.0f} ms, max {max(wall_times) * 1000:.0f} ms over {args.runs} runs")
+
+    _, rows = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+    packages = defaultdict(int)
+    for name, self_us, _ in rows:
+        packages[name.split(".")[0]] += self_us
+
+    print(f"\n{'package':<40}{'self ms':>10}")
+    for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<40}{self_us / 1000:>10.1f}")
+
+    print(f"\n{'module':<40}{'cumulative ms':>14}")
+    for name, _, cumulative_us in sorted(rows, key=lambda row: -row[2])[:args.top]:
+        print(f"{name:<40}{cumulative_us / 1000:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compares the old sentence-count splitter with tts_chunker for partner replies.
+
+Every reply in tts_samples.json is chunked both ways. The chunks are synthesized in
+parallel, so a turn waits for its longest chunk, and the first chunk decides when audio
+can start. By default TTS time is estimated per chunk as --overhead seconds plus its
+weighted length over --chars-per-second; with --live every chunk is synthesized with the
+real TTS API, in parallel as the server does, and timed.
+
+Reports, per strategy, chunks per reply, the longest and the first chunk (in weighted
+characters), and p50/p95 of turn TTS time and time to first audio.
+
+Usage (from backend/):
+    python -m benchmarks.tts_chunking
+    python -m benchmarks.tts_chunking --live --runs 3
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+# Load environment variables before the backend modules read their settings
+load_dotenv()
+
+from utils import generate_tts, language_to_code
+from tts_chunker import chunk_for_tts, CHAR_WEIGHTS
+
+SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "tts_samples.json")
+
+def split_text(text, max_sentences=4):
+    # The splitter main.py used before tts_chunker: every four Latin-punctuated sentences
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    parts = []
+    current_part = []
+    for sentence in sentences:
+        current_part.append(sentence)
+        if len(current_part) == max_sentences:
+            parts.append(' '.join(current_part))
+            current_part = []
+    if current_part:
+        parts.append(' '.join(current_part))
+    return parts
+
+STRATEGIES = {
+    "split_text": lambda text, language: split_text(text),
+    "tts_chunker": chunk_for_tts,
+}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def weighted_length(chunk, language):
+    return len(chunk) * CHAR_WEIGHTS.get(language, 1.0)
+
+def estimate_turn(chunks, language, overhead, chars_per_second):
+    seconds = [overhead + weighted_length(chunk, language) / chars_per_second for chunk in chunks]
+    return max(seconds), seconds[0]
+
+async def measure_turn(chunks, api_key, voice):
+    start = time.perf_counter()
+    first_audio = None
+
+    async def synthesize(index, chunk):
+        nonlocal first_audio
+        await asyncio.to_thread(generate_tts, chunk, api_key, voice)
+        if index == 0:
+            first_audio = time.perf_counter() - start
+
+    await asyncio.gather(*(synthesize(index, chunk) for index, chunk in enumerate(chunks)))
+    return time.perf_counter() - start, first_audio
+
+async def benchmark(name, samples, args, api_key):
+    chunk_counts, longest, firsts, turns, first_audios = [], [], [], [], []
+    for sample in samples:
+        language = language_to_code(sample["language"])
+        chunks = STRATEGIES[name](sample["text"], language)
+        chunk_counts.append(len(chunks))
+        longest.append(max(weighted_length(chunk, language) for chunk in chunks))
+        firsts.append(weighted_length(chunks[0], language))
+        for _ in range(args.runs if args.live else 1):
+            if args.live:
+                turn, first_audio = await measure_turn(chunks, api_key, args.voice)
+            else:
+                turn, first_audio = estimate_turn(chunks, language, args.overhead, args.chars_per_second)
+            turns.append(turn)
+            first_audios.append(first_audio)
+    return {
+        "strategy": name,
+        "chunks": sum(chunk_counts) / len(chunk_counts),
+        "longest": sum(longest) / len(longest),
+        "first": sum(firsts) / len(firsts),
+        "p50_ms": percentile(turns, 0.5) * 1000,
+        "p95_ms": percentile(turns, 0.95) * 1000,
+        "first_p50_ms": percentile(first_audios, 0.5) * 1000,
+        "first_p95_ms": percentile(first_audios, 0.95) * 1000,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="Synthesize with the real TTS API instead of estimating")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--voice", default="alloy")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--overhead", type=float, default=0.35, help="Estimated seconds per TTS call before any audio")
+    parser.add_argument("--chars-per-second", type=float, default=60.0, help="Estimated synthesis speed")
+    parser.add_argument("--samples", default=SAMPLES_PATH)
+    parser.add_argument("--show-chunks", action="store_true")
+    args = parser.parse_args()
+
+    api_key = args.api_key or os.getenv("OPENAI_API_KEY")
+    if args.live and not api_key:
+        parser.error("No OpenAI API key; pass --api-key or set OPENAI_API_KEY in .env")
+
+    with open(args.samples, encoding="utf-8") as f:
+        samples = json.load(f)
+
+    if args.show_chunks:
+        for sample in samples:
+            language = language_to_code(sample["language"])
+            for name, strategy in STRATEGIES.items():
+                print(f"{sample['language']} / {name}: {[len(chunk) for chunk in strategy(sample['text'], language)]}")
+        print()
+
+    print(f"{'strategy':<13}{'chunks':>8}{'longest':>9}{'first':>7}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'first p50':>11}{'first p95':>11}")
+    for name in STRATEGIES:
+        report = await benchmark(name, samples, args, api_key)
+        print(f"{report['strategy']:<13}{report['chunks']:>8.1f}{report['longest']:>9.0f}{report['first']:>7.0f}"
+              f"{report['p50_ms']:>9.0f}{report['p95_ms']:>9.0f}"
+              f"{report['first_p50_ms']:>11.0f}{report['first_p95_ms']:>11.0f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""
+Compares the three-call and single-call structured tutor modes.
+
+Runs every sample in tutor_samples.json through both modes against the real provider and
+reports, per mode, total tokens, p50/p95 latency, how often the intervention level matches
+the expected label, and how close the correction is to the reference.
+
+Usage (from backend/):
+    python -m benchmarks.tutor_modes --provider groq --runs 3
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import difflib
+import statistics
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+# Load environment variables before the backend modules read their settings
+load_dotenv()
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+from langchain_core.tracers.context import register_configure_hook
+from agents import run_tutor
+from key_scheduler import total_tokens
+
+SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "tutor_samples.json")
+
+class TokenCounter(BaseCallbackHandler):
+    run_inline = True
+
+    def __init__(self):
+        self.tokens = 0
+        self.calls = 0
+
+    def on_llm_end(self, response, **kwargs):
+        self.calls += 1
+        self.tokens += total_tokens(response)
+
+# Attaches the active counter to every chat model call made inside the measured block
+token_counter_var = ContextVar("token_counter", default=None)
+register_configure_hook(token_counter_var, inheritable=True)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run_sample(sample, mode, provider, api_key):
+    counter = TokenCounter()
+    token = token_counter_var.set(counter)
+    try:
+        start = time.perf_counter()
+        feedback = await run_tutor(
+            sample["tutoring_language"],
+            sample["tutors_language"],
+            [HumanMessage(content=sample["utterance"])],
+            [],
+            provider=provider,
+            api_key=api_key,
+            mode=mode,
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        token_counter_var.reset(token)
+    return {
+        "latency": elapsed,
+        "tokens": counter.tokens,
+        "calls": counter.calls,
+        "intervene_match": feedback["intervene"] == sample["expected_intervene"],
+        "correction_similarity": difflib.SequenceMatcher(
+            None, feedback["correction"].strip(), sample["expected_correction"]
+        ).ratio(),
+    }
+
+async def benchmark(mode, samples, provider, api_key, runs):
+    results = []
+    for _ in range(runs):
+        for sample in samples:
+            results.append(await run_sample(sample, mode, provider, api_key))
+    latencies = [result["latency"] for result in results]
+    return {
+        "mode": mode,
+        "turns": len(results),
+        "calls_per_turn": statistics.mean(result["calls"] for result in results),
+        "tokens_per_turn": statistics.mean(result["tokens"] for result in results),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "intervene_accuracy": statistics.mean(result["intervene_match"] for result in results),
+        "correction_similarity": statistics.mean(result["correction_similarity"] for result in results),
+    }
+
+def default_api_key(provider):
+    if provider == "groq":
+        keys = json.loads(os.getenv("GROQ_API_KEYs", "[]"))
+        return keys[0] if keys else None
+    if provider == "openai":
+        return os.getenv("OPENAI_API_KEY")
+    return os.getenv("ANTHROPIC_API_KEY")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", default="groq", choices=["groq", "openai", "anthropic"])
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--samples", default=SAMPLES_PATH)
+    args = parser.parse_args()
+
+    api_key = args.api_key or default_api_key(args.provider)
+    if not api_key:
+        parser.error(f"No API key for {args.provider}; pass --api-key or set it in .env")
+
+    with open(args.samples, encoding="utf-8") as f:
+        samples = json.load(f)
+
+    print(f"{'mode':<12}{'calls':>7}{'tokens':>9}{'p50 ms':>9}{'p95 ms':>9}{'level acc':>11}{'corr sim':>10}")
+    for mode in ("split", "structured"):
+        report = await benchmark(mode, samples, args.provider, api_key, args.runs)
+        print(f"{report['mode']:<12}{report['calls_per_turn']:>7.1f}{report['tokens_per_turn']:>9.0f}"
+              f"{report['p50_ms']:>9.0f}{report['p95_ms']:>9.0f}"
+              f"{report['intervene_accuracy']:>11.0%}{report['correction_similarity']:>10.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
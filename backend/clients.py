@@ -0,0 +1,286 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+import httpx
+from metrics import record_request, record_response, arecord_request, arecord_response
+from provider_health import provider_health
+
+logger = logging.getLogger(__name__)
+
+CLIENT_CACHE_SIZE = int(os.getenv("CLIENT_CACHE_SIZE", "128"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+# Per-attempt ceiling for LLM calls; request deadlines (deadlines.py) usually cut them shorter
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# Provider endpoints, overridable to point the backend at the local stand-ins in loadtest/.
+# Each is the base URL its SDK expects: OpenAI's includes /v1, Groq's and Anthropic's are
+# the host root (their SDKs add /openai/v1 and /v1).
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com").rstrip("/")
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/")
+
+# OpenAI-compatible API roots, for the endpoints we call without an SDK
+OPENAI_API_ROOTS = {
+    "openai": OPENAI_BASE_URL,
+    "groq": f"{GROQ_BASE_URL}/openai/v1",
+}
+
+# Cheap authenticated GETs used to open a TLS connection to each provider at startup.
+# They run in the background, so a slow provider only loses its warm connection
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "2"))
+WARMUP_URLS = {
+    provider: f"{root}/models" for provider, root in OPENAI_API_ROOTS.items()
+}
+# Authenticated GETs that tell a valid API key from an invalid one without spending tokens
+KEY_CHECK_URLS = {
+    **WARMUP_URLS,
+    "anthropic": f"{ANTHROPIC_BASE_URL}/v1/models",
+}
+
+class ClientRegistry:
+    """
+    Long-lived LLM and speech clients keyed by (provider, model, api_key).
+
+    Every client shares one keep-alive HTTP pool (sync and async), so a turn reuses already
+    open TLS connections instead of handshaking for each of its LLM and TTS calls. Clients
+    for the server's own keys are pinned; clients for user-supplied keys are evicted in LRU
+    order once more than `max_size` of them are cached.
+
+    The provider SDKs are imported on the first client for that provider rather than at
+    module load: together they take most of the backend's import time, and a process often
+    only ever serves one provider.
+    """
+
+    def __init__(self, max_size=CLIENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.pinned_keys = set()
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._async_http_client = None
+        self._key_schedulers = {}
+
+    def register_key_scheduler(self, provider, scheduler):
+        """
+        Routes usage of `provider` clients built on scheduler-managed keys back to the scheduler.
+
+        Args:
+        provider (str): The provider name.
+        scheduler (KeyScheduler): The scheduler owning the provider's server keys.
+        """
+        self._key_schedulers[provider] = scheduler
+
+    def _observe_rate_limits(self, response):
+        # Every response on a scheduled key reports the key's remaining budget, including
+        # the 429s the SDKs retry internally before a callback would ever see them
+        authorization = response.request.headers.get("authorization", "")
+        if not authorization.startswith("Bearer "):
+            return
+        api_key = authorization[len("Bearer "):]
+        for scheduler in self._key_schedulers.values():
+            if api_key in scheduler:
+                if response.status_code == 429:
+                    scheduler.record_rate_limited(api_key, response.headers)
+                else:
+                    scheduler.record_headers(api_key, response.headers)
+                return
+
+    async def _aobserve_rate_limits(self, response):
+        self._observe_rate_limits(response)
+
+    def _callbacks_for(self, provider, model_name, api_key):
+        callbacks = [provider_health.callback_for(provider, model_name)]
+        scheduler = self._key_schedulers.get(provider)
+        if scheduler is not None and api_key in scheduler:
+            callbacks.append(scheduler.callback_for(api_key))
+        return callbacks
+
+    def pin_keys(self, api_keys):
+        """
+        Marks API keys whose clients are never evicted (the server's own keys).
+
+        Args:
+        api_keys (iterable): The API keys to pin.
+        """
+        self.pinned_keys.update(key for key in api_keys if key)
+
+    @property
+    def http_client(self):
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                timeout=HTTP_TIMEOUT,
+                event_hooks={"request": [record_request], "response": [record_response, self._observe_rate_limits]},
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._http_client
+
+    @property
+    def async_http_client(self):
+        if self._async_http_client is None:
+            self._async_http_client = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT,
+                event_hooks={"request": [arecord_request], "response": [arecord_response, self._aobserve_rate_limits]},
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._async_http_client
+
+    def _get_or_create(self, cache_key, factory):
+        with self._lock:
+            client = self._clients.get(cache_key)
+            if client is not None:
+                self._clients.move_to_end(cache_key)
+                return client
+
+            client = factory()
+            self._clients[cache_key] = client
+            self._evict()
+            return client
+
+    def _evict(self):
+        unpinned = [key for key in self._clients if key[-1] not in self.pinned_keys]
+        while len(unpinned) > self.max_size:
+            evicted = unpinned.pop(0)
+            del self._clients[evicted]
+            logger.debug(f"Evicted client for {evicted[0]}/{evicted[1]}")
+
+    def get_llm(self, provider, model_name, api_key, max_tokens=None, timeout=None):
+        """
+        Returns a cached chat model for (provider, model_name, limits, api_key), creating it on first use.
+
+        Every call the model makes is reported to provider_health, and while the provider's
+        circuit breaker is open no model is handed out at all.
+
+        Args:
+        provider (str): The provider of the language model (groq, openai, or anthropic).
+        model_name (str): The name of the specific model to use.
+        api_key (str): The API key for authentication.
+        max_tokens (int, optional): Cap on the reply length. Defaults to the provider's default.
+        timeout (float, optional): Per-attempt timeout in seconds. Defaults to LLM_TIMEOUT.
+
+        Returns:
+        An instance of the specified language model.
+
+        Raises:
+        ValueError: If an unsupported provider is specified.
+        ProviderUnavailableError: If the provider is failing and its circuit breaker is open.
+        """
+        if provider == "groq":
+            from langchain_groq import ChatGroq
+            factory = lambda: ChatGroq(
+                model=model_name,
+                temperature=0,
+                api_key=api_key,
+                max_tokens=max_tokens,
+                timeout=timeout or LLM_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                base_url=GROQ_BASE_URL,
+                http_client=self.http_client,
+                http_async_client=self.async_http_client,
+                callbacks=self._callbacks_for(provider, model_name, api_key),
+            )
+        elif provider == "openai":
+            from langchain_openai import ChatOpenAI
+            factory = lambda: ChatOpenAI(
+                model=model_name,
+                temperature=0,
+                api_key=api_key,
+                max_tokens=max_tokens,
+                timeout=timeout or LLM_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                base_url=OPENAI_BASE_URL,
+                http_client=self.http_client,
+                http_async_client=self.async_http_client,
+                callbacks=self._callbacks_for(provider, model_name, api_key),
+            )
+        elif provider == "anthropic":
+            # ChatAnthropic manages its own HTTP client; caching the instance keeps it alive.
+            from langchain_anthropic import ChatAnthropic
+            factory = lambda: ChatAnthropic(
+                model=model_name,
+                temperature=0,
+                api_key=api_key,
+                timeout=timeout or LLM_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                base_url=ANTHROPIC_BASE_URL,
+                # ChatAnthropic requires a max_tokens, so it keeps its own default unless one is set
+                **({"max_tokens": max_tokens} if max_tokens else {}),
+                callbacks=self._callbacks_for(provider, model_name, api_key),
+            )
+        else:
+            raise ValueError(f"Unsupported provider: {provider}")
+
+        provider_health.check(provider)
+        return self._get_or_create((provider, model_name, max_tokens, timeout, api_key), factory)
+
+    def get_openai_client(self, api_key):
+        """
+        Returns a cached OpenAI SDK client (used for TTS) on the shared HTTP pool.
+
+        Args:
+        api_key (str): The OpenAI API key.
+
+        Returns:
+        OpenAI: The client.
+        """
+        from openai import OpenAI
+        return self._get_or_create(
+            ("openai", "sdk", api_key),
+            lambda: OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, http_client=self.http_client)
+        )
+
+    async def warm_up(self, api_keys):
+        """
+        Opens keep-alive connections to each provider so the first turns skip the TLS handshake.
+
+        Args:
+        api_keys (dict): Maps provider name to the API key to authenticate the warm-up call with.
+        """
+        async def warm(provider, url, api_key):
+            headers = {"Authorization": f"Bearer {api_key}"}
+            # Tagged so the provider response metrics only count real traffic
+            options = {"headers": headers, "timeout": WARMUP_TIMEOUT, "extensions": {"warm_up": True}}
+            try:
+                # The sync pool serves TTS, the async pool serves the LLM calls.
+                await asyncio.gather(
+                    self.async_http_client.get(url, **options),
+                    asyncio.to_thread(self.http_client.get, url, **options),
+                )
+                logger.info(f"Warmed up connections to {provider}")
+            except httpx.HTTPError as e:
+                logger.warning(f"Connection warm-up for {provider} failed: {str(e)}")
+
+        # Building the pools loads the CA bundle, which would otherwise stall the loop
+        await asyncio.to_thread(lambda: (self.http_client, self.async_http_client))
+        await asyncio.gather(*[
+            warm(provider, WARMUP_URLS[provider], api_key)
+            for provider, api_key in api_keys.items()
+            if api_key and provider in WARMUP_URLS
+        ])
+
+    async def close(self):
+        """
+        Drops all cached clients and closes the shared HTTP pools.
+        """
+        with self._lock:
+            self._clients.clear()
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+            self._async_http_client = None
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+
+client_registry = ClientRegistry()
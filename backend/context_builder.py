@@ -0,0 +1,200 @@
+import os
+import re
+import math
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The tokenizer is loaded on the first estimate rather than at import: on a cold container
+# tiktoken downloads its BPE file, which startup shouldn't wait for
+_ENCODING = None
+_ENCODING_LOADED = False
+_ENCODING_LOCK = threading.Lock()
+
+def _encoding():
+    global _ENCODING, _ENCODING_LOADED
+    if not _ENCODING_LOADED:
+        with _ENCODING_LOCK:
+            if not _ENCODING_LOADED:
+                try:
+                    import tiktoken
+                    _ENCODING = tiktoken.get_encoding("cl100k_base")
+                except Exception:  # tiktoken is optional; fall back to the character heuristic
+                    _ENCODING = None
+                _ENCODING_LOADED = True
+    return _ENCODING
+
+# Token budgets for the variable part of each task's prompt (summary plus history). The
+# fixed instructions are not counted. Override per task with CONTEXT_BUDGET_<TASK>.
+DEFAULT_CONTEXT_BUDGETS = {
+    "partner": 1500,
+    "summary": 1500,
+    "tutor_comments": 200,
+    "homework": 6000,
+}
+CONTEXT_BUDGETS = {
+    task: int(os.getenv(f"CONTEXT_BUDGET_{task.upper()}", str(budget)))
+    for task, budget in DEFAULT_CONTEXT_BUDGETS.items()
+}
+
+# Per-message framing (role markers, separators) added by chat templates
+MESSAGE_OVERHEAD_TOKENS = 4
+
+CJK_RE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens in a text without calling the provider.
+
+    Uses tiktoken's cl100k_base encoding when it is installed. Otherwise ASCII text is
+    counted at ~4 characters per token, other alphabets (Cyrillic, Arabic, Devanagari, ...)
+    at ~2, and CJK characters at one token each, which is close enough for budgeting.
+
+    Args:
+    text (str): The text to measure.
+
+    Returns:
+    int: The estimated token count.
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(CJK_RE.findall(text))
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    other = len(text) - cjk - ascii_chars
+    return cjk + math.ceil(ascii_chars / 4) + math.ceil(other / 2)
+
+def truncate_to_tokens(text, max_tokens, keep="end"):
+    """
+    Cuts a text down to roughly `max_tokens`, on a word boundary where possible.
+
+    Args:
+    text (str): The text to cut.
+    max_tokens (int): The token budget.
+    keep (str, optional): "end" keeps the tail of the text, "start" keeps the head. Defaults to "end".
+
+    Returns:
+    str: The text, shortened if it was over budget.
+    """
+    if max_tokens <= 0:
+        return ""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    length = max(1, int(len(text) * max_tokens / tokens))
+    if keep == "start":
+        cut = text[:length]
+        return cut.rsplit(" ", 1)[0] if " " in cut else cut
+    cut = text[-length:]
+    return cut.split(" ", 1)[1] if " " in cut else cut
+
+class ContextWindow:
+    """
+    The part of a conversation selected for one prompt.
+
+    Attributes:
+    items (list): The selected messages or text entries, in chronological order.
+    summary (str): The summary, possibly shortened to fit.
+    tokens (int): Estimated tokens used by the summary and the items.
+    budget (int): The budget the window was built against.
+    dropped (int): How many older items did not fit.
+    """
+
+    def __init__(self, items, summary, tokens, budget, dropped):
+        self.items = items
+        self.summary = summary
+        self.tokens = tokens
+        self.budget = budget
+        self.dropped = dropped
+
+def _item_text(item):
+    return item if isinstance(item, str) else item.content
+
+def _item_with_text(item, text):
+    if isinstance(item, str):
+        return text
+    return item.__class__(content=text)
+
+class ContextBuilder:
+    """
+    Fits conversation history into a per-task token budget.
+
+    Replaces fixed message counts: the window is filled with the summary first, then the
+    most recent item, then older items going backwards until the next one no longer fits.
+    Long utterances therefore take the room of several short ones instead of blowing up the
+    prompt, and short conversations get their whole history.
+    """
+
+    def __init__(self, budgets=CONTEXT_BUDGETS):
+        self.budgets = dict(budgets)
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def build(self, task, items, summary=""):
+        """
+        Selects the summary and the items that fit the task's budget.
+
+        Args:
+        task (str): The task name, used to look up the budget and in the stats.
+        items (list): BaseMessages or strings, oldest first.
+        summary (str, optional): The conversation summary. Defaults to "".
+
+        Returns:
+        ContextWindow: The selected context.
+        """
+        budget = self.budgets[task]
+
+        # The summary is capped at half the budget so there is always room for the latest turn
+        summary = truncate_to_tokens(summary or "", budget // 2, keep="start")
+        used = estimate_tokens(summary)
+
+        selected = []
+        for index, item in enumerate(reversed(items)):
+            cost = estimate_tokens(_item_text(item)) + MESSAGE_OVERHEAD_TOKENS
+            if used + cost > budget:
+                if index == 0:
+                    # The latest item is always sent, cut down to the remaining budget
+                    remaining = max(0, budget - used - MESSAGE_OVERHEAD_TOKENS)
+                    text = truncate_to_tokens(_item_text(item), remaining)
+                    selected.append(_item_with_text(item, text))
+                    used += estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+                break
+            selected.append(item)
+            used += cost
+        selected.reverse()
+
+        window = ContextWindow(selected, summary, used, budget, len(items) - len(selected))
+        self._record(task, window)
+        logger.info(f"Context for {task}: {window.tokens}/{budget} tokens, "
+                    f"{len(selected)} of {len(items)} items")
+        return window
+
+    def _record(self, task, window):
+        with self._lock:
+            stats = self.stats.setdefault(task, {"calls": 0, "tokens": 0, "max_tokens": 0, "dropped_items": 0})
+            stats["calls"] += 1
+            stats["tokens"] += window.tokens
+            stats["max_tokens"] = max(stats["max_tokens"], window.tokens)
+            stats["dropped_items"] += window.dropped
+
+    def get_stats(self):
+        """
+        Returns the estimated prompt context tokens used per task.
+
+        Returns:
+        dict: Per-task call count, total, mean and max context tokens, and the budget.
+        """
+        with self._lock:
+            return {
+                task: {
+                    **stats,
+                    "mean_tokens": stats["tokens"] / stats["calls"] if stats["calls"] else 0,
+                    "budget": self.budgets[task],
+                }
+                for task, stats in self.stats.items()
+            }
+
+context_builder = ContextBuilder()
@@ -0,0 +1,113 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from metrics import DEADLINE_EXCEEDED
+
+logger = logging.getLogger(__name__)
+
+# Total time each endpoint may spend on a request, from arrival to the last byte of work.
+# Override with DEADLINE_<ENDPOINT>; clients can ask for less with the X-Request-Timeout header.
+REQUEST_DEADLINES = {
+    endpoint: float(os.getenv(f"DEADLINE_{endpoint.upper()}", str(seconds)))
+    for endpoint, seconds in {
+        "process_audio": 30.0,
+        "process_audio_stream": 30.0,
+        "generate_chat_name": 15.0,
+        "generate_homework": 90.0,
+    }.items()
+}
+
+class DeadlineExceededError(Exception):
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+# Absolute time.monotonic() by which the current request must finish. Tasks spawned by the
+# request copy the context, so every sub-call sees the same deadline.
+current_deadline = ContextVar("current_deadline", default=None)
+
+def request_deadline(endpoint, requested=None):
+    """
+    Returns the time budget for a request.
+
+    Args:
+    endpoint (str): The endpoint name.
+    requested (str, optional): The client's X-Request-Timeout header, in seconds.
+
+    Returns:
+    float: The budget in seconds, or None if the endpoint has none.
+    """
+    budget = REQUEST_DEADLINES.get(endpoint)
+    if requested:
+        try:
+            requested = float(requested)
+        except ValueError:
+            logger.warning(f"Ignoring invalid X-Request-Timeout: {requested}")
+        else:
+            if requested > 0:
+                budget = min(budget, requested) if budget else requested
+    return budget
+
+@contextmanager
+def deadline_scope(seconds):
+    """
+    Sets the deadline for the work started inside the block, keeping an earlier one if set.
+
+    Args:
+    seconds (float): The budget from now, or None for no deadline.
+    """
+    deadline = current_deadline.get()
+    if seconds is not None:
+        new_deadline = time.monotonic() + seconds
+        deadline = new_deadline if deadline is None else min(deadline, new_deadline)
+    token = current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+def time_left():
+    """
+    Returns the seconds left before the current request's deadline, or None without one.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+async def within_deadline(awaitable, stage):
+    """
+    Awaits a stage with whatever remains of the request's budget.
+
+    Args:
+    awaitable: The coroutine or task running the stage.
+    stage (str): The stage name, for the error and the metrics.
+
+    Returns:
+    The stage's result.
+
+    Raises:
+    DeadlineExceededError: If the budget runs out first; the stage is cancelled.
+    """
+    remaining = time_left()
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        else:
+            asyncio.ensure_future(awaitable).cancel()
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceededError(stage)
+    try:
+        async with asyncio.timeout(remaining) as scope:
+            return await awaitable
+    except TimeoutError:
+        if not scope.expired():
+            raise
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        logger.warning(f"Deadline exceeded during {stage}")
+        raise DeadlineExceededError(stage) from None
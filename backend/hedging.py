@@ -0,0 +1,360 @@
+import os
+import time
+import asyncio
+import inspect
+import logging
+from collections import deque
+from provider_health import ProviderUnavailableError, is_provider_failure
+from model_router import model_router, CallUsage, call_usage
+from metrics import HEDGED_CALLS, HEDGE_WASTED_SECONDS, HEDGE_WASTED_TOKENS, HEDGE_WASTED_COST_USD
+
+logger = logging.getLogger(__name__)
+
+# Hedging spends extra provider calls (on the server's keys) to cut tail latency, so it is opt-in.
+# Only calls made on the server's own keys are hedged.
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").lower() == "true"
+# The latency-critical calls that may be hedged
+HEDGE_TASKS = set(os.getenv(
+    "HEDGE_TASKS", "partner,partner_stream,tutor_comment,intervention_level,best_expression,structured_tutor"
+).split(","))
+# A call is hedged once it has run longer than this percentile of its recent latencies...
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# ...measured over the last HEDGE_SAMPLE_SIZE calls; until HEDGE_MIN_SAMPLES of them have
+# finished, HEDGE_DEFAULT_DELAY is used instead
+HEDGE_SAMPLE_SIZE = int(os.getenv("HEDGE_SAMPLE_SIZE", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.25"))
+
+def parse_fallbacks(value):
+    """
+    Parses "groq:openai,openai:groq" into {"groq": "openai", "openai": "groq"}.
+
+    A provider mapped to itself is hedged with another of the server's keys for it.
+    """
+    fallbacks = {}
+    for pair in value.split(","):
+        if ":" in pair:
+            primary, secondary = pair.split(":", 1)
+            fallbacks[primary.strip()] = secondary.strip()
+    return fallbacks
+
+# Where each provider's hedges and failovers go
+HEDGE_FALLBACKS = parse_fallbacks(os.getenv("HEDGE_FALLBACKS", "groq:openai,openai:groq,anthropic:openai"))
+
+class Hedger:
+    """
+    Hedges slow LLM calls with a duplicate on a secondary provider or key.
+
+    call() starts the primary request and waits up to the task's hedge delay: the
+    HEDGE_PERCENTILE latency of its recent primary calls on that provider. If the primary
+    hasn't answered by then, the same request goes to the provider's fallback (or to
+    another server key for the same provider) and whichever answers first wins; the other
+    is cancelled. A primary that fails with a provider error before the delay is failed
+    over to the fallback straight away.
+
+    Hedges use the server's keys for the fallback provider, registered with
+    register_key_source(), so only calls made on one of the server's own keys are hedged;
+    a request on the user's key is never sent anywhere on the operator's account. Every
+    hedged call is counted by outcome, and the losing request is reported as the hedge's
+    extra cost: the time it ran before it was cancelled, its estimated tokens and their
+    price in the model router's table.
+    """
+
+    def __init__(self, enabled=HEDGING_ENABLED, tasks=HEDGE_TASKS, fallbacks=HEDGE_FALLBACKS,
+                 percentile=HEDGE_PERCENTILE, sample_size=HEDGE_SAMPLE_SIZE, min_samples=HEDGE_MIN_SAMPLES,
+                 default_delay=HEDGE_DEFAULT_DELAY, min_delay=HEDGE_MIN_DELAY):
+        self.enabled = enabled
+        self.tasks = set(tasks)
+        self.fallbacks = dict(fallbacks)
+        self.percentile = percentile
+        self.sample_size = sample_size
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self._key_sources = {}
+        self._server_keys = {}
+        self._latencies = {}
+        self.stats = {}
+
+    def register_key_source(self, provider, get_key, server_keys=()):
+        """
+        Registers where hedges to `provider` get their API key.
+
+        Args:
+        provider (str): The provider name.
+        get_key (callable): Returns one of the server's keys for the provider (or an awaitable
+        of one), or None.
+        server_keys (list, optional): All of the server's keys for the provider. Only calls
+        made with one of these are hedged.
+        """
+        self._key_sources[provider] = get_key
+        self._server_keys[provider] = {key for key in server_keys if key}
+
+    def _hedgeable(self, task, provider, api_key):
+        return self.enabled and task in self.tasks and api_key in self._server_keys.get(provider, ())
+
+    def _count(self, task, outcome):
+        stats = self.stats.setdefault(task, {"calls": 0, "hedged": 0, "hedge_won": 0, "failover": 0,
+                                             "wasted_seconds": 0.0, "wasted_tokens": 0, "wasted_cost_usd": 0.0})
+        stats["calls"] += 1
+        if outcome in ("primary_won", "hedge_won"):
+            stats["hedged"] += 1
+        if outcome in stats:
+            stats[outcome] += 1
+        HEDGED_CALLS.inc(task=task, outcome=outcome)
+
+    def _count_waste(self, task, provider, seconds, loser, winner, output_share):
+        """
+        Counts what the losing request of a hedged call cost.
+
+        Its input tokens are the prompt it sent. Unless the provider reported its output,
+        that is taken as the winner's output scaled by how long the loser ran compared to
+        the winner, as it was cancelled partway.
+        """
+        input_tokens = loser.input_tokens or loser.prompt_tokens
+        output_tokens = loser.output_tokens or round(winner.output_tokens * min(1.0, output_share))
+        cost = model_router.cost(loser.model, input_tokens, output_tokens) if loser.model else 0.0
+        stats = self.stats[task]
+        stats["wasted_seconds"] += seconds
+        stats["wasted_tokens"] += input_tokens + output_tokens
+        stats["wasted_cost_usd"] += cost
+        HEDGE_WASTED_SECONDS.inc(seconds, task=task, provider=provider)
+        HEDGE_WASTED_TOKENS.inc(input_tokens, task=task, provider=provider, kind="input")
+        HEDGE_WASTED_TOKENS.inc(output_tokens, task=task, provider=provider, kind="output")
+        HEDGE_WASTED_COST_USD.inc(cost, task=task, provider=provider)
+
+    async def _tracked(self, run, provider, api_key, usage):
+        # Runs as its own task, so the usage collected is this request's alone
+        call_usage.set(usage)
+        return await run(provider, api_key)
+
+    def _observe(self, task, provider, seconds):
+        samples = self._latencies.get((task, provider))
+        if samples is None:
+            samples = self._latencies[(task, provider)] = deque(maxlen=self.sample_size)
+        samples.append(seconds)
+
+    def hedge_delay(self, task, provider):
+        """
+        Returns how long a primary call may run before it is hedged.
+
+        Args:
+        task (str): The task name.
+        provider (str): The primary provider.
+
+        Returns:
+        float: The delay in seconds.
+        """
+        samples = self._latencies.get((task, provider))
+        if not samples or len(samples) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(samples)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))])
+
+    async def _secondary(self, provider, api_key):
+        secondary = self.fallbacks.get(provider)
+        get_key = self._key_sources.get(secondary)
+        if secondary is None or get_key is None:
+            return None
+        try:
+            key = get_key()
+            if inspect.isawaitable(key):
+                key = await key
+        except ValueError:
+            return None
+        if not key or (secondary == provider and key == api_key):
+            # Hedging on the very same key would only compete with ourselves
+            return None
+        return secondary, key
+
+    def _should_fail_over(self, error):
+        return isinstance(error, ProviderUnavailableError) or is_provider_failure(error)
+
+    async def call(self, task, provider, api_key, run):
+        """
+        Runs one LLM request, hedging or failing it over if it is slow or its provider fails.
+
+        Requests made with the user's own key are run as they are.
+
+        Args:
+        task (str): The task name, which decides whether the call is hedged.
+        provider (str): The primary provider.
+        api_key (str): The API key for the primary provider.
+        run (callable): run(provider, api_key) returns a coroutine making the request.
+
+        Returns:
+        The result of whichever request answered first.
+        """
+        if not self._hedgeable(task, provider, api_key):
+            return await run(provider, api_key)
+
+        start = time.perf_counter()
+        primary_usage = CallUsage()
+        primary = asyncio.ensure_future(self._tracked(run, provider, api_key, primary_usage))
+        hedge = None
+        secondary = None
+        try:
+            await asyncio.wait({primary}, timeout=self.hedge_delay(task, provider))
+            if primary.done() and not primary.cancelled() and primary.exception() is None:
+                self._observe(task, provider, time.perf_counter() - start)
+                self._count(task, "not_hedged")
+                return primary.result()
+            if primary.done() and not self._should_fail_over(primary.exception()):
+                return primary.result()
+
+            secondary = await self._secondary(provider, api_key)
+            if secondary is None:
+                result = await primary
+                self._observe(task, provider, time.perf_counter() - start)
+                self._count(task, "not_hedged")
+                return result
+
+            failover = primary.done()
+            if failover:
+                logger.warning(f"{task} on {provider} failed ({str(primary.exception())}); failing over to {secondary[0]}")
+            hedge_start = time.perf_counter()
+            hedge_usage = CallUsage()
+            hedge = asyncio.ensure_future(self._tracked(run, *secondary, hedge_usage))
+            if failover:
+                result = await hedge
+                self._count(task, "failover")
+                return result
+
+            pending = {primary, hedge}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((request for request in (primary, hedge) if request in done and request.exception() is None), None)
+                if winner is not None or not pending:
+                    break
+            if winner is None:
+                # Both failed; the primary's error is the one the caller expects
+                return primary.result()
+
+            now = time.perf_counter()
+            # The primary's latency is only known to be at least this long if the hedge won
+            self._observe(task, provider, now - start)
+            if winner is primary:
+                self._count(task, "primary_won")
+                self._count_waste(task, secondary[0], now - hedge_start, hedge_usage, primary_usage,
+                                  (now - hedge_start) / (now - start))
+            else:
+                self._count(task, "hedge_won")
+                self._count_waste(task, provider, now - start, primary_usage, hedge_usage, 1.0)
+            return winner.result()
+        finally:
+            for request in (primary, hedge):
+                if request is not None and not request.done():
+                    request.cancel()
+
+    async def stream(self, task, provider, api_key, open_stream):
+        """
+        Streams an LLM reply, hedging on the time to its first chunk.
+
+        Same policy as call(), applied to the first chunk: once one stream has produced it,
+        the other is cancelled and the reply continues from the winner.
+
+        Args:
+        task (str): The task name.
+        provider (str): The primary provider.
+        api_key (str): The API key for the primary provider.
+        open_stream (callable): open_stream(provider, api_key) returns an async iterator of chunks.
+
+        Yields:
+        The chunks of whichever stream started answering first.
+        """
+        if not self._hedgeable(task, provider, api_key):
+            async for chunk in open_stream(provider, api_key):
+                yield chunk
+            return
+
+        streams = {}
+        usages = {}
+
+        def start_stream(target_provider, target_key):
+            stream = open_stream(target_provider, target_key)
+            # The first chunk's task (and so the request) collects its own usage
+            usage = CallUsage()
+            token = call_usage.set(usage)
+            try:
+                first = asyncio.ensure_future(anext(stream, None))
+            finally:
+                call_usage.reset(token)
+            streams[first] = stream
+            usages[first] = usage
+            return first
+
+        start = time.perf_counter()
+        primary = start_stream(provider, api_key)
+        hedge = None
+        winner = None
+        try:
+            await asyncio.wait({primary}, timeout=self.hedge_delay(task, provider))
+            outcome = "not_hedged"
+            if primary.done() and primary.exception() is None:
+                winner = primary
+            elif primary.done() and not self._should_fail_over(primary.exception()):
+                winner = primary
+            else:
+                secondary = await self._secondary(provider, api_key)
+                if secondary is None:
+                    await asyncio.wait({primary})
+                    winner = primary
+                elif primary.done():
+                    logger.warning(f"{task} on {provider} failed ({str(primary.exception())}); failing over to {secondary[0]}")
+                    hedge = start_stream(*secondary)
+                    await asyncio.wait({hedge})
+                    winner, outcome = hedge, "failover"
+                else:
+                    hedge_start = time.perf_counter()
+                    hedge = start_stream(*secondary)
+                    pending = {primary, hedge}
+                    while pending and winner is None:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        winner = next((first for first in (primary, hedge) if first in done and first.exception() is None), None)
+                    if winner is None:
+                        # Both failed; the primary's error is the one the caller expects
+                        winner = primary
+                    else:
+                        outcome = "primary_won" if winner is primary else "hedge_won"
+
+            if winner is primary and not primary.exception():
+                self._observe(task, provider, time.perf_counter() - start)
+            self._count(task, outcome)
+            # The loser never sent a chunk, so what it cost is its prompt
+            if outcome == "primary_won":
+                self._count_waste(task, secondary[0], time.perf_counter() - hedge_start, usages[hedge], usages[primary], 0.0)
+            elif outcome == "hedge_won":
+                self._observe(task, provider, time.perf_counter() - start)
+                self._count_waste(task, provider, time.perf_counter() - start, usages[primary], usages[hedge], 0.0)
+
+            stream = streams[winner]
+            chunk = winner.result()
+            while chunk is not None:
+                yield chunk
+                chunk = await anext(stream, None)
+        finally:
+            for first, stream in streams.items():
+                if not first.done():
+                    first.cancel()
+                    await asyncio.gather(first, return_exceptions=True)
+                await stream.aclose()
+
+    def get_stats(self):
+        """
+        Returns per-task hedge counts, hedge rates, wasted time, tokens and cost, and current hedge delays.
+
+        Returns:
+        dict: Hedging statistics.
+        """
+        tasks = {}
+        for task, stats in self.stats.items():
+            tasks[task] = {**stats, "hedge_rate": (stats["hedged"] + stats["failover"]) / stats["calls"]}
+        return {
+            "enabled": self.enabled,
+            "fallbacks": self.fallbacks,
+            "tasks": tasks,
+            "delays": {f"{task}/{provider}": self.hedge_delay(task, provider) for task, provider in self._latencies},
+        }
+
+hedger = Hedger()
@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+import traceback
+from metrics import ERRORS, RETRIES
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "1000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+# A worker process that hasn't heartbeated for this long is presumed dead and its jobs are taken over
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+# Jobs that ran out of attempts are kept this long for inspection, then deleted
+JOB_FAILED_RETENTION_SECONDS = float(os.getenv("JOB_FAILED_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+class JobQueueFullError(Exception):
+    pass
+
+class JobQueue:
+    """
+    In-process background job queue for work that doesn't belong on a turn's critical path.
+
+    Jobs are persisted in SQLite before they are queued, so pending work (and work that was
+    running when the process stopped) is picked up again on the next start. At most
+    `concurrency` jobs run at once and at most `max_size` wait. A job enqueued with a
+    `dedupe_key` that matches a job still waiting replaces that job's payload instead of
+    queueing a second one, so a burst of turns produces one summary, not one per turn.
+
+    API keys are never written to disk: a job's key is held in memory only, and a job
+    recovered after a restart runs with api_key=None (handlers fall back to server keys).
+
+    Several worker processes can share the database. Each job is owned by the worker that
+    queued it and claimed with a conditional update, so it runs once. Workers heartbeat
+    while running and take over the jobs of any worker whose heartbeat lapses for longer
+    than `lease` seconds; a worker that stops cleanly hands its jobs over right away.
+    Failed jobs are deleted by the heartbeat once they are older than `failed_retention`.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, concurrency=JOB_CONCURRENCY, max_size=JOB_QUEUE_SIZE,
+                 max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY, lease=JOB_LEASE_SECONDS,
+                 failed_retention=JOB_FAILED_RETENTION_SECONDS):
+        self.path = path
+        self.concurrency = concurrency
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.failed_retention = failed_retention
+        self.worker_id = uuid.uuid4().hex
+        self._heartbeat = None
+        self._handlers = {}
+        self._secrets = {}
+        self._queue = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._conn = None
+        self._open_lock = threading.Lock()
+        self.stats = {"enqueued": 0, "coalesced": 0, "succeeded": 0, "retried": 0, "failed": 0, "rejected": 0}
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # Databases created before jobs had owners
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "owner" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            )
+        """)
+        conn.commit()
+        return conn
+
+    @property
+    def _db(self):
+        # start() is the first user; the import never touches the file
+        if self._conn is None:
+            with self._open_lock:
+                if self._conn is None:
+                    self._conn = self._open()
+        return self._conn
+
+    def register(self, kind, handler):
+        """
+        Registers the coroutine function that runs jobs of `kind`.
+
+        Args:
+        kind (str): The job kind.
+        handler (callable): Called as `await handler(payload, api_key)`.
+        """
+        self._handlers[kind] = handler
+
+    def _adopt(self):
+        """
+        Heartbeats this worker and takes over the unfinished jobs of workers that are gone.
+
+        Returns:
+        list: The ids of the adopted jobs, oldest first.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO job_workers (worker_id, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT (worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.worker_id, now)
+            )
+            self._db.execute("DELETE FROM job_workers WHERE heartbeat < ?", (now - self.lease,))
+            rows = self._db.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('pending', 'running') "
+                "AND (owner IS NULL OR owner NOT IN (SELECT worker_id FROM job_workers)) "
+                "ORDER BY created_at"
+            ).fetchall()
+            job_ids = [row[0] for row in rows]
+            self._db.executemany(
+                "UPDATE jobs SET status = 'pending', owner = ? WHERE job_id = ?",
+                [(self.worker_id, job_id) for job_id in job_ids]
+            )
+            self._db.commit()
+        return job_ids
+
+    def _retire(self):
+        with self._lock:
+            self._db.execute("DELETE FROM job_workers WHERE worker_id = ?", (self.worker_id,))
+            self._db.commit()
+
+    def _trim_failed(self):
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status = 'failed' AND updated_at < ?", (time.time() - self.failed_retention,)
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def _insert(self, kind, payload, dedupe_key):
+        now = time.time()
+        with self._lock:
+            if dedupe_key is not None:
+                row = self._db.execute(
+                    "SELECT job_id FROM jobs WHERE dedupe_key = ? AND status = 'pending'", (dedupe_key,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET payload = ?, updated_at = ? WHERE job_id = ?",
+                        (json.dumps(payload), now, row[0])
+                    )
+                    self._db.commit()
+                    return row[0], False
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO jobs (job_id, kind, payload, dedupe_key, status, owner, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), dedupe_key, self.worker_id, now, now)
+            )
+            self._db.commit()
+        return job_id, True
+
+    def _claim(self, job_id):
+        with self._lock:
+            # The status check in the UPDATE makes the claim atomic across worker processes
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, updated_at = ? "
+                "WHERE job_id = ? AND status = 'pending'",
+                (self.worker_id, time.time(), job_id)
+            )
+            if cursor.rowcount == 0:
+                self._db.commit()
+                return None
+            row = self._db.execute(
+                "SELECT kind, payload, attempts FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            self._db.commit()
+        return row[0], json.loads(row[1]), row[2]
+
+    def _finish(self, job_id, status, error=None):
+        with self._lock:
+            if status == "done":
+                self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                    (status, error, time.time(), job_id)
+                )
+            self._db.commit()
+
+    def _count(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    @property
+    def running(self):
+        return bool(self._workers)
+
+    async def _adopt_and_queue(self):
+        adopted = await asyncio.to_thread(self._adopt)
+        for job_id in adopted:
+            self._queue.put_nowait(job_id)
+        if adopted:
+            logger.info(f"Recovered {len(adopted)} background jobs")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._adopt_and_queue()
+                trimmed = await asyncio.to_thread(self._trim_failed)
+                if trimmed:
+                    logger.info(f"Deleted {trimmed} failed jobs past retention")
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue heartbeat failed: {str(e)}")
+
+    async def start(self):
+        """
+        Re-queues persisted jobs and starts the workers. Call from the app's startup hook.
+        """
+        self._queue = asyncio.Queue()
+        await self._adopt_and_queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        """
+        Stops the workers. Jobs that were running stay persisted and are taken over by another
+        worker process, or retried on the next start.
+        """
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+        await asyncio.to_thread(self._retire)
+
+    async def enqueue(self, kind, payload, dedupe_key=None, api_key=None):
+        """
+        Persists a job and queues it for the workers.
+
+        Args:
+        kind (str): The job kind; a handler must be registered for it.
+        payload (dict): JSON-serializable job arguments.
+        dedupe_key (str, optional): Coalesces with a still-pending job carrying the same key.
+        api_key (str, optional): Key to run the job with; kept in memory only.
+
+        Returns:
+        str: The job id.
+
+        Raises:
+        JobQueueFullError: If `max_size` jobs are already waiting.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+        if self._queue is not None and self._queue.qsize() >= self.max_size:
+            self.stats["rejected"] += 1
+            raise JobQueueFullError(f"{self._queue.qsize()} background jobs already waiting")
+
+        job_id, created = await asyncio.to_thread(self._insert, kind, payload, dedupe_key)
+        if api_key:
+            self._secrets[job_id] = api_key
+        if created:
+            self.stats["enqueued"] += 1
+            if self._queue is not None:
+                self._queue.put_nowait(job_id)
+        else:
+            self.stats["coalesced"] += 1
+        return job_id
+
+    async def _retry_later(self, job_id):
+        await asyncio.sleep(self.retry_delay)
+        self._queue.put_nowait(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                claimed = await asyncio.to_thread(self._claim, job_id)
+                if claimed is None:
+                    continue
+                kind, payload, attempts = claimed
+                try:
+                    await self._handlers[kind](payload, self._secrets.get(job_id))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if attempts < self.max_attempts:
+                        logger.warning(f"Background job {kind} {job_id} failed (attempt {attempts}): {str(e)}")
+                        self.stats["retried"] += 1
+                        RETRIES.inc(component="jobs")
+                        await asyncio.to_thread(self._finish, job_id, "pending", str(e))
+                        asyncio.create_task(self._retry_later(job_id))
+                    else:
+                        logger.error(f"Background job {kind} {job_id} failed permanently: {str(e)}")
+                        logger.error(traceback.format_exc())
+                        self.stats["failed"] += 1
+                        ERRORS.inc(stage=f"job_{kind}", provider=payload.get("provider", ""))
+                        self._secrets.pop(job_id, None)
+                        await asyncio.to_thread(self._finish, job_id, "failed", str(e))
+                    continue
+                self.stats["succeeded"] += 1
+                self._secrets.pop(job_id, None)
+                await asyncio.to_thread(self._finish, job_id, "done")
+            finally:
+                self._queue.task_done()
+
+    async def get_stats(self):
+        """
+        Returns queue counters and the number of persisted jobs per status.
+
+        Returns:
+        dict: Job queue statistics.
+        """
+        return {
+            **self.stats,
+            "waiting": self._queue.qsize() if self._queue is not None else 0,
+            "persisted": await asyncio.to_thread(self._count),
+        }
+
+job_queue = JobQueue()
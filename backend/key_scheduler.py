@@ -0,0 +1,320 @@
+import os
+import re
+import time
+import queue
+import asyncio
+import hashlib
+import logging
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+GROQ_RPM_LIMIT = int(os.getenv("GROQ_RPM_LIMIT", "30"))
+GROQ_TPM_LIMIT = int(os.getenv("GROQ_TPM_LIMIT", "6000"))
+RATE_LIMIT_COOLDOWN = float(os.getenv("RATE_LIMIT_COOLDOWN", "10"))
+# A key's x-ratelimit-* budget is used for ranking until its reset time, but never for longer
+# than this; after that the key is ranked by the local counters against the limits above
+RATE_LIMIT_HEADERS_MAX_AGE = float(os.getenv("RATE_LIMIT_HEADERS_MAX_AGE", "30"))
+
+def parse_reset_duration(value):
+    """
+    Parses a rate-limit reset header such as "2m59.56s", "7.66s", "120ms" or "30".
+
+    Args:
+    value (str): The header value.
+
+    Returns:
+    float: The duration in seconds, or None if it can't be parsed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+def mask_key(api_key):
+    return f"{api_key[:5]}...{api_key[-4:]}" if len(api_key) > 12 else "***"
+
+def optional_int(value):
+    return None if value is None else int(value)
+
+def key_id(api_key):
+    # Shared state is keyed by a digest so API keys never leave the process
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+class KeyScheduler:
+    """
+    Hands out the least-loaded healthy API key from a pool.
+
+    Keys are ranked by the share of their budget already used. While the provider's last
+    rate-limit headers for a key are fresh (not past their reset time nor older than
+    RATE_LIMIT_HEADERS_MAX_AGE), that share comes from the reported remaining and limit
+    values; otherwise from requests and tokens counted per key over a sliding one-minute
+    window against rpm_limit and tpm_limit. A key goes on cooldown after a 429 (for
+    Retry-After seconds when the provider sends it) or when its budget runs out. Requests and tokens are fed back
+    through the LangChain callback returned by callback_for(); rate-limit headers and 429s
+    come from every HTTP response on the key (see ClientRegistry), so the remaining budget
+    is known before the first 429.
+
+    Windows, cooldowns and totals live in the shared-state backend, so every worker process
+    sees the whole pool's usage and the limits hold for the server as a whole. Only the
+    in-flight count is per process: it is short-lived and must not outlive a crashed worker.
+
+    Shared state may be a network hop away, so none of it is touched on the event loop:
+    acquire() reads every key's windows in one batched read in a worker thread, and usage
+    updates are queued to a writer thread that applies them in order.
+    """
+
+    def __init__(self, api_keys, rpm_limit=GROQ_RPM_LIMIT, tpm_limit=GROQ_TPM_LIMIT, window=60.0,
+                 state=shared_state, name="groq", headers_max_age=RATE_LIMIT_HEADERS_MAX_AGE):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.window = window
+        self.headers_max_age = headers_max_age
+        self.state = state
+        self._lock = threading.Lock()
+        self._ids = {key: f"keys:{name}:{key_id(key)}" for key in api_keys}
+        self._in_flight = {key: 0 for key in api_keys}
+        # This process's own assignments, which its queued writes may not have stored yet
+        self._assigned = {key: 0.0 for key in api_keys}
+        self._writes = queue.Queue()
+        self._writer = None
+
+    def __contains__(self, api_key):
+        return api_key in self._ids
+
+    def _snapshot(self, now):
+        # (requests, tokens, fields) for every key, in one read
+        keys = list(self._ids)
+        window_keys = [f"{self._ids[key]}:{kind}" for key in keys for kind in ("requests", "tokens")]
+        sums, hashes = self.state.snapshot(window_keys, now - self.window, [self._ids[key] for key in keys])
+        return {key: (sums[2 * index][0], sums[2 * index + 1][1], hashes[index]) for index, key in enumerate(keys)}
+
+    def _submit(self, operation, *args):
+        # Shared-state writes run on the writer thread, off the event loop
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="key-usage-writer", daemon=True)
+                self._writer.start()
+        self._writes.put((operation, args))
+
+    def _write_loop(self):
+        while True:
+            operation, args = self._writes.get()
+            try:
+                operation(*args)
+            except Exception as e:
+                logger.error(f"Failed to record key usage: {str(e)}")
+            finally:
+                self._writes.task_done()
+
+    def flush(self):
+        """
+        Blocks until every queued usage update has been written.
+        """
+        self._writes.join()
+
+    def _reported_load(self, fields, kind, now, pending=0):
+        # The used share of the budget the provider last reported, or None if there is no fresh report
+        remaining = fields.get(f"remaining_{kind}")
+        limit = fields.get(f"limit_{kind}")
+        if remaining is None or not limit:
+            return None
+        if now - fields.get("reported_at", 0.0) > self.headers_max_age or now >= fields.get(f"reset_{kind}_at", float("inf")):
+            return None
+        if remaining <= 0:
+            return float("inf")
+        return 1 - (remaining - pending) / limit
+
+    def _load(self, api_key, requests, tokens, fields, now):
+        in_flight = self._in_flight[api_key]
+        request_load = self._reported_load(fields, "requests", now, in_flight)
+        if request_load is None:
+            request_load = (requests + in_flight) / self.rpm_limit
+        token_load = self._reported_load(fields, "tokens", now)
+        if token_load is None:
+            token_load = tokens / self.tpm_limit
+        return max(request_load, token_load)
+
+    async def acquire(self):
+        """
+        Returns the key with the most headroom that isn't cooling down.
+
+        If every key is cooling down, the one whose cooldown ends first is returned rather
+        than failing the turn outright.
+
+        Returns:
+        str: An API key.
+
+        Raises:
+        ValueError: If the pool is empty.
+        """
+        if not self._ids:
+            raise ValueError("No GROQ API keys available")
+
+        now = time.time()
+        snapshot = await asyncio.to_thread(self._snapshot, now)
+        with self._lock:
+            candidates = []
+            for key, (requests, tokens, fields) in snapshot.items():
+                candidates.append((key, fields.get("cooldown_until", 0.0),
+                                   self._load(key, requests, tokens, fields, now),
+                                   max(fields.get("last_assigned", 0.0), self._assigned[key])))
+            healthy = [candidate for candidate in candidates if candidate[1] <= now]
+            if healthy:
+                key = min(healthy, key=lambda candidate: (candidate[2], candidate[3]))[0]
+            else:
+                key = min(candidates, key=lambda candidate: candidate[1])[0]
+                logger.warning(f"All GROQ keys are cooling down; using {mask_key(key)}")
+            self._assigned[key] = now
+        self._submit(self.state.hset, self._ids[key], {"last_assigned": now})
+        return key
+
+    def record_start(self, api_key):
+        state_key = self._ids[api_key]
+        self._submit(self.state.window_add, f"{state_key}:requests", 1, time.time(), self.window)
+        self._submit(self.state.incr, state_key, "total_requests")
+        with self._lock:
+            self._in_flight[api_key] += 1
+
+    def record_end(self, api_key, tokens=0):
+        with self._lock:
+            self._in_flight[api_key] = max(0, self._in_flight[api_key] - 1)
+        if tokens:
+            state_key = self._ids[api_key]
+            self._submit(self.state.window_add, f"{state_key}:tokens", tokens, time.time(), self.window)
+            self._submit(self.state.incr, state_key, "total_tokens", tokens)
+
+    def record_headers(self, api_key, headers):
+        """
+        Records a key's budget from x-ratelimit-* response headers.
+
+        The remaining and limit values are stored with their reset times and the time of
+        the report, and rank the key until they go stale (see _reported_load).
+
+        Args:
+        api_key (str): The key the response belongs to.
+        headers (Mapping): The response headers.
+        """
+        now = time.time()
+        reported = {}
+        for kind in ("requests", "tokens"):
+            for field in (f"remaining_{kind}", f"limit_{kind}"):
+                try:
+                    reported[field] = optional_int(headers.get(f"x-ratelimit-{field.replace('_', '-')}"))
+                except ValueError:
+                    reported[field] = None
+            reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            reported[f"reset_{kind}_at"] = None if reset is None else now + reset
+        if reported["remaining_requests"] is None and reported["remaining_tokens"] is None:
+            return
+        reported["reported_at"] = now
+
+        state_key = self._ids[api_key]
+        # An exhausted budget cools the key down until the provider says it resets
+        exhausted = [kind for kind in ("requests", "tokens") if reported[f"remaining_{kind}"] == 0]
+        if exhausted:
+            resets = [reported[f"reset_{kind}_at"] for kind in exhausted if reported[f"reset_{kind}_at"] is not None]
+            self._submit(self.state.hmax, state_key, "cooldown_until", max(resets) if resets else now + RATE_LIMIT_COOLDOWN)
+        # Fields missing from this response are cleared, so an old value never looks fresh
+        self._submit(self.state.hset, state_key, reported)
+
+    def record_rate_limited(self, api_key, headers=None):
+        """
+        Puts a key on cooldown after a 429.
+
+        Args:
+        api_key (str): The key that was rate limited.
+        headers (Mapping, optional): The 429 response headers, used for Retry-After.
+        """
+        headers = headers or {}
+        cooldown = parse_reset_duration(headers.get("retry-after")) or RATE_LIMIT_COOLDOWN
+        logger.warning(f"GROQ key {mask_key(api_key)} rate limited; cooling down for {cooldown:.1f}s")
+        self.record_headers(api_key, headers)
+        state_key = self._ids[api_key]
+        self._submit(self.state.incr, state_key, "rate_limited")
+        self._submit(self.state.hmax, state_key, "cooldown_until", time.time() + cooldown)
+
+    def callback_for(self, api_key):
+        return KeyUsageCallback(self, api_key)
+
+    def get_stats(self):
+        """
+        Returns per-key utilization across all workers, with keys masked.
+
+        Returns:
+        dict: Utilization stats keyed by masked key.
+        """
+        now = time.time()
+        stats = {}
+        for key, (requests, tokens, fields) in self._snapshot(now).items():
+            stats[mask_key(key)] = {
+                "requests_last_minute": requests,
+                "tokens_last_minute": int(tokens),
+                "request_utilization": requests / self.rpm_limit,
+                "token_utilization": tokens / self.tpm_limit,
+                "in_flight": self._in_flight[key],
+                "cooling_down_for": max(0.0, fields.get("cooldown_until", 0.0) - now),
+                "remaining_requests": optional_int(fields.get("remaining_requests")),
+                "remaining_tokens": optional_int(fields.get("remaining_tokens")),
+                "budget_source": "provider" if any(self._reported_load(fields, kind, now) is not None
+                                                   for kind in ("requests", "tokens")) else "local",
+                "total_requests": int(fields.get("total_requests", 0)),
+                "total_tokens": int(fields.get("total_tokens", 0)),
+                "rate_limited": int(fields.get("rate_limited", 0)),
+            }
+        return stats
+
+def total_tokens(response):
+    """
+    Extracts the total token count from an LLMResult.
+
+    Invoked calls report it in llm_output; streamed calls only carry it on the message's
+    usage_metadata.
+
+    Args:
+    response (LLMResult): The result passed to on_llm_end.
+
+    Returns:
+    int: The total tokens, or 0 if the provider didn't report usage.
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return usage["total_tokens"]
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            if metadata.get("total_tokens"):
+                return metadata["total_tokens"]
+    return 0
+
+class KeyUsageCallback(BaseCallbackHandler):
+    """
+    Reports a chat model's requests and token usage back to its KeyScheduler.
+    """
+
+    run_inline = True
+
+    def __init__(self, scheduler, api_key):
+        self.scheduler = scheduler
+        self.api_key = api_key
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.scheduler.record_start(self.api_key)
+
+    def on_llm_end(self, response, **kwargs):
+        self.scheduler.record_end(self.api_key, total_tokens(response))
+
+    def on_llm_error(self, error, **kwargs):
+        # 429s were already recorded from the response itself
+        self.scheduler.record_end(self.api_key)
@@ -0,0 +1,193 @@
+"""
+Replays recorded conversations against a running backend at a target concurrency.
+
+Each virtual user takes the next conversation from conversations.json and plays its
+utterances as /process_audio turns, carrying the chat state forward, then asks for a chat
+name and homework. Audio uploads are a silent WAV with the utterance embedded after an
+"UTTERANCE:" marker, which mock_providers.py transcribes back verbatim.
+
+Reports throughput, p50/p95/p99 latency per endpoint and per turn stage (from the
+backend's Server-Timing header) and error counts by endpoint and status.
+
+Usage (from backend/, with the backend pointed at mock_providers.py):
+    python -m loadtest.loadgen --url http://localhost:8080 --concurrency 20 --duration 60
+"""
+import io
+import os
+import json
+import time
+import wave
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+import httpx
+
+CONVERSATIONS_PATH = os.path.join(os.path.dirname(__file__), "conversations.json")
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def fake_audio(utterance, seconds=1.0, rate=16000):
+    """
+    Builds a silent mono WAV followed by the utterance text for the mock transcriber.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\0\0" * int(seconds * rate))
+    return buffer.getvalue() + b"UTTERANCE:" + utterance.encode("utf-8")
+
+def parse_server_timing(header):
+    """
+    Parses a Server-Timing header into (name, seconds) pairs.
+    """
+    timings = []
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and value:
+                timings.append((name, float(value) / 1000))
+    return timings
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.stages = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+
+    def record(self, endpoint, elapsed, response):
+        if response is None or response.status_code >= 400:
+            status = "exception" if response is None else response.status_code
+            self.errors[(endpoint, status)] += 1
+            return
+        self.latencies[endpoint].append(elapsed)
+        for stage, seconds in parse_server_timing(response.headers.get("server-timing", "")):
+            if stage != "total":
+                self.stages[stage].append(seconds)
+
+    def report(self):
+        duration = time.perf_counter() - self.started
+        completed = sum(len(values) for values in self.latencies.values())
+        print(f"\n{completed} requests in {duration:.1f}s, {completed / duration:.1f} req/s, "
+              f"{sum(self.errors.values())} errors\n")
+        self._table("endpoint", self.latencies, duration)
+        if self.stages:
+            print()
+            self._table("stage", self.stages, duration)
+        if self.errors:
+            print("\nerrors")
+            for (endpoint, status), count in sorted(self.errors.items(), key=str):
+                print(f"  {endpoint:<24}{str(status):>10}{count:>8}")
+
+    @staticmethod
+    def _table(title, samples, duration):
+        print(f"{title:<24}{'count':>8}{'per s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for name, values in sorted(samples.items()):
+            print(f"{name:<24}{len(values):>8}{len(values) / duration:>8.1f}"
+                  f"{percentile(values, 0.5) * 1000:>9.0f}{percentile(values, 0.95) * 1000:>9.0f}"
+                  f"{percentile(values, 0.99) * 1000:>9.0f}")
+
+class VirtualUser:
+    def __init__(self, client, args, results):
+        self.client = client
+        self.args = args
+        self.results = results
+
+    async def post(self, endpoint, **kwargs):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.client.post(endpoint, **kwargs)
+        except httpx.HTTPError:
+            pass
+        self.results.record(endpoint.lstrip("/"), time.perf_counter() - start, response)
+        return response if response is not None and response.status_code < 400 else None
+
+    async def play(self, conversation):
+        settings = {
+            "tutoringLanguage": conversation["tutoring_language"],
+            "tutorsLanguage": conversation["tutors_language"],
+            "tutorsVoice": "alloy",
+            "partnersVoice": "nova",
+            "interventionLevel": conversation.get("intervention_level", "medium"),
+            "disableTutor": False,
+            "model": self.args.provider,
+            "api_key": self.args.api_key,
+        }
+        chat_object = {"chat_history": [], "tutors_comments": [], "summary": []}
+        session = {}
+        if self.args.sessions:
+            response = await self.post("/sessions", json=chat_object)
+            if response is None:
+                return
+            session = response.json()
+
+        for utterance in conversation["utterances"]:
+            data = dict(settings)
+            if session:
+                data.update(sessionId=session["sessionId"], revision=session["revision"])
+            else:
+                data["chatObject"] = chat_object
+            response = await self.post(
+                "/process_audio",
+                files={"audio": ("turn.wav", fake_audio(utterance), "audio/wav")},
+                data={"data": json.dumps(data)},
+            )
+            if response is None:
+                return
+            body = response.json()
+            if session:
+                session["revision"] = body["revision"]
+            else:
+                chat_object = body["chatObject"]
+            await asyncio.sleep(random.uniform(0, self.args.think_time))
+
+        name_request = {"model": self.args.provider, "summary": chat_object["summary"]}
+        homework_request = {**settings, "chatObject": None if session else chat_object}
+        if session:
+            name_request["sessionId"] = session["sessionId"]
+            homework_request.update(sessionId=session["sessionId"], revision=session["revision"])
+        await self.post("/generate_chat_name", json=name_request)
+        await self.post("/generate_homework", json=homework_request)
+
+async def run(args):
+    with open(args.conversations, encoding="utf-8") as f:
+        conversations = json.load(f)
+
+    results = Results()
+    deadline = time.perf_counter() + args.duration
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+
+        async def user_loop(index):
+            user = VirtualUser(client, args, results)
+            played = index
+            while time.perf_counter() < deadline:
+                await user.play(conversations[played % len(conversations)])
+                played += args.concurrency
+
+        await asyncio.gather(*(user_loop(index) for index in range(args.concurrency)))
+    results.report()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--concurrency", type=int, default=10, help="virtual users playing conversations at once")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to keep starting conversations")
+    parser.add_argument("--think-time", type=float, default=1.0, help="max seconds between a user's turns")
+    parser.add_argument("--provider", default="groq", choices=["groq", "openai", "anthropic"])
+    parser.add_argument("--api-key", default="mock-key", help="sent as the user's key; the mock accepts any")
+    parser.add_argument("--sessions", action="store_true", help="keep conversations in server sessions")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--conversations", default=CONVERSATIONS_PATH)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
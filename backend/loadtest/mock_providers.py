@@ -0,0 +1,311 @@
+"""
+Local stand-ins for the provider APIs the backend calls, for load testing without API bills.
+
+Serves, on one port:
+- OpenAI (base URL http://HOST:PORT/v1): chat completions (plain and streamed), audio
+  transcriptions, speech and models.
+- Groq (base URL http://HOST:PORT): the same OpenAI-compatible routes under /openai/v1.
+- Anthropic (base URL http://HOST:PORT): messages (plain and streamed).
+
+Latencies are drawn from log-normal distributions given as median,p95 in seconds; a share
+of requests can be failed with 500s or rejected with 429s (with Retry-After and
+x-ratelimit-* headers, as the real providers send them).
+
+Transcription returns the text embedded after the "UTTERANCE:" marker in the uploaded
+audio (loadgen.py writes it there), so recorded conversations replay deterministically;
+other uploads get a canned sentence. Speech returns filler bytes sized like real audio.
+
+Usage (from backend/):
+    python -m loadtest.mock_providers --port 9000 --chat-ttft 0.3,0.9 --rate-limit-rate 0.02
+
+Then start the backend against it:
+    OPENAI_BASE_URL=http://localhost:9000/v1 GROQ_BASE_URL=http://localhost:9000 \\
+    ANTHROPIC_BASE_URL=http://localhost:9000 uvicorn main:app --port 8080
+"""
+import os
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+UTTERANCE_MARKER = b"UTTERANCE:"
+
+CANNED_TRANSCRIPTION = "Ich habe gestern ins Kino gegangen und der Film war sehr gut."
+CANNED_REPLY = ("Das klingt toll! Welchen Film hast du gesehen? Ich gehe auch gern ins Kino, "
+                "besonders am Wochenende. Magst du lieber Komödien oder Actionfilme?")
+CANNED_TUTOR_JSON = json.dumps({
+    "comments": "Use 'bin' instead of 'habe' with 'gegangen'.",
+    "correction": "Ich bin gestern ins Kino gegangen.",
+    "intervene": "medium",
+})
+
+# Roughly 24 kbit/s of mp3 at the speaking rate of TTS voices (~15 characters per second)
+TTS_BYTES_PER_CHAR = 200
+
+class LatencyModel:
+    """
+    Log-normal latency with a given median and 95th percentile.
+    """
+
+    def __init__(self, median, p95):
+        self.median = median
+        self.sigma = math.log(p95 / median) / 1.645 if p95 > median > 0 else 0.0
+
+    @classmethod
+    def parse(cls, value):
+        median, p95 = (float(part) for part in value.split(","))
+        return cls(median, p95)
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+class MockConfig:
+    def __init__(self, args):
+        self.transcription = LatencyModel.parse(args.transcription_latency)
+        self.ttft = LatencyModel.parse(args.chat_ttft)
+        self.tokens_per_second = args.chat_tokens_per_second
+        self.tts = LatencyModel.parse(args.tts_latency)
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.retry_after = args.retry_after
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+def prompt_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+        parts.append(str(content))
+    return "\n".join(parts)
+
+def reply_for(prompt):
+    # The structured tutor mode asks for a JSON object; the intervention prompt for one word
+    if '"intervene"' in prompt:
+        return CANNED_TUTOR_JSON
+    if "Respond with ONLY ONE word" in prompt:
+        return random.choice(["no", "low", "medium", "high"])
+    return CANNED_REPLY
+
+def split_tokens(text):
+    words = text.split(" ")
+    return [word + (" " if index < len(words) - 1 else "") for index, word in enumerate(words)]
+
+def create_app(config):
+    app = FastAPI()
+
+    def injected_failure(provider):
+        """
+        Returns an error response for the share of requests configured to fail, else None.
+        """
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            headers = {
+                "retry-after": str(config.retry_after),
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": f"{config.retry_after}s",
+            }
+            body = {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}}
+            if provider == "anthropic":
+                body = {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limited (mock)"}}
+            return JSONResponse(body, status_code=429, headers=headers)
+        if roll < config.rate_limit_rate + config.error_rate:
+            return JSONResponse({"error": {"message": "Internal error (mock)", "type": "server_error"}}, status_code=500)
+        return None
+
+    def rate_limit_headers():
+        return {
+            "x-ratelimit-remaining-requests": "1000",
+            "x-ratelimit-remaining-tokens": "1000000",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-reset-tokens": "1s",
+        }
+
+    async def chat_completions(request, provider):
+        failure = injected_failure(provider)
+        if failure is not None:
+            return failure
+        body = await request.json()
+        model = body.get("model", "mock")
+        prompt = prompt_text(body.get("messages", []))
+        reply = reply_for(prompt)
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": estimate_tokens(reply),
+            "total_tokens": estimate_tokens(prompt) + estimate_tokens(reply),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        await asyncio.sleep(config.ttft.sample())
+
+        if not body.get("stream"):
+            # Non-streamed replies still take as long as generating every token
+            await asyncio.sleep(estimate_tokens(reply) / config.tokens_per_second)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            }, headers=rate_limit_headers())
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def events():
+            def chunk(delta, finish_reason=None, **extra):
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    **extra,
+                }
+                return f"data: {json.dumps(data)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for token in split_tokens(reply):
+                yield chunk({"content": token})
+                await asyncio.sleep(1 / config.tokens_per_second)
+            # Groq reports usage on the final chunk under x_groq
+            extra = {"x_groq": {"usage": usage}} if provider == "groq" else {}
+            yield chunk({}, "stop", **extra)
+            if include_usage:
+                yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=rate_limit_headers())
+
+    async def transcriptions(request, provider):
+        failure = injected_failure(provider)
+        if failure is not None:
+            return failure
+        form = await request.form()
+        audio = await form["file"].read()
+        marker = audio.find(UTTERANCE_MARKER)
+        if marker >= 0:
+            text = audio[marker + len(UTTERANCE_MARKER):].decode("utf-8", errors="ignore").strip("\0 ")
+        else:
+            text = CANNED_TRANSCRIPTION
+        await asyncio.sleep(config.transcription.sample())
+        if form.get("response_format", "json") == "text":
+            return PlainTextResponse(text + "\n")
+        return JSONResponse({"text": text})
+
+    def models():
+        return JSONResponse({"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        return await chat_completions(request, "openai")
+
+    @app.post("/openai/v1/chat/completions")
+    async def groq_chat(request: Request):
+        return await chat_completions(request, "groq")
+
+    @app.post("/v1/audio/transcriptions")
+    async def openai_transcriptions(request: Request):
+        return await transcriptions(request, "openai")
+
+    @app.post("/openai/v1/audio/transcriptions")
+    async def groq_transcriptions(request: Request):
+        return await transcriptions(request, "groq")
+
+    @app.get("/v1/models")
+    async def openai_models():
+        return models()
+
+    @app.get("/openai/v1/models")
+    async def groq_models():
+        return models()
+
+    @app.post("/v1/audio/speech")
+    async def speech(request: Request):
+        failure = injected_failure("openai")
+        if failure is not None:
+            return failure
+        body = await request.json()
+        await asyncio.sleep(config.tts.sample())
+        size = max(1024, len(body.get("input", "")) * TTS_BYTES_PER_CHAR)
+        media_types = {"mp3": "audio/mpeg", "opus": "audio/ogg", "aac": "audio/aac"}
+        return Response(os.urandom(size), media_type=media_types.get(body.get("response_format", "mp3"), "audio/mpeg"))
+
+    @app.post("/v1/messages")
+    async def anthropic_messages(request: Request):
+        failure = injected_failure("anthropic")
+        if failure is not None:
+            return failure
+        body = await request.json()
+        model = body.get("model", "mock")
+        system = body.get("system", "")
+        if isinstance(system, list):
+            system = " ".join(block.get("text", "") for block in system)
+        prompt = system + "\n" + prompt_text(body.get("messages", []))
+        reply = reply_for(prompt)
+        usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(reply)}
+        message_id = f"msg_{uuid.uuid4().hex[:12]}"
+        await asyncio.sleep(config.ttft.sample())
+
+        if not body.get("stream"):
+            await asyncio.sleep(estimate_tokens(reply) / config.tokens_per_second)
+            return JSONResponse({
+                "id": message_id,
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [{"type": "text", "text": reply}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": usage,
+            })
+
+        async def events():
+            def event(name, data):
+                return f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n"
+
+            yield event("message_start", {"message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+                "stop_reason": None, "stop_sequence": None,
+                "usage": {"input_tokens": usage["input_tokens"], "output_tokens": 0},
+            }})
+            yield event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+            for token in split_tokens(reply):
+                yield event("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": token}})
+                await asyncio.sleep(1 / config.tokens_per_second)
+            yield event("content_block_stop", {"index": 0})
+            yield event("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                          "usage": {"output_tokens": usage["output_tokens"]}})
+            yield event("message_stop", {})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--transcription-latency", default="0.4,1.0", help="median,p95 seconds")
+    parser.add_argument("--chat-ttft", default="0.25,0.8", help="time to first token, median,p95 seconds")
+    parser.add_argument("--chat-tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--tts-latency", default="0.5,1.2", help="median,p95 seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests rejected with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(MockConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
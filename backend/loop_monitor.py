@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+import weakref
+from collections import deque
+from contextvars import ContextVar
+from metrics import LOOP_LAG_SECONDS, LOOP_STALLS, LOOP_STALL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+# How often the loop is sampled, and how long it must be blocked to count as a stall
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.1"))
+# Stall sites and recent stalls kept for /loop/stats
+LOOP_STALL_SITES = int(os.getenv("LOOP_STALL_SITES", "50"))
+LOOP_RECENT_STALLS = int(os.getenv("LOOP_RECENT_STALLS", "20"))
+
+# Stack frames from these files are ours; the innermost one names the stall site
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STACK_LIMIT = 30
+
+# "METHOD /first-path-segment" of the request a task works for, or None outside requests
+current_route = ContextVar("current_route", default=None)
+
+def route_of(scope):
+    """
+    Returns the route label for an ASGI scope, keeping ids in the path out of it.
+    """
+    first_segment = scope["path"].strip("/").split("/", 1)[0]
+    return f"{scope['method']} /{first_segment}"
+
+def stall_site(stack):
+    """
+    Returns where a stall happened: the innermost frame in the app's own code, or the
+    innermost frame at all if the loop was blocked outside it.
+
+    Args:
+    stack (traceback.StackSummary): The loop thread's stack, outermost first.
+
+    Returns:
+    str: "file:line in function".
+    """
+    app_frames = [frame for frame in stack
+                  if frame.filename.startswith(APP_DIR) and os.path.basename(frame.filename) != "loop_monitor.py"]
+    frame = app_frames[-1] if app_frames else stack[-1]
+    return f"{os.path.relpath(frame.filename, APP_DIR) if app_frames else frame.filename}:{frame.lineno} in {frame.name}"
+
+class LoopMonitor:
+    """
+    Watches the event loop for blocking calls.
+
+    A coroutine on the loop sleeps for `interval` and records how late it wakes up as loop
+    lag. A watchdog thread checks the coroutine's heartbeat; once the loop has been blocked
+    for longer than `threshold` it captures the loop thread's stack while the blocking call
+    is still running, along with the route of the task that was running. When the loop
+    resumes, the sampler records the stall with its full duration.
+
+    Stalls are aggregated by site (the innermost frame in our own code) so the blocking
+    calls that cost the most loop time come first in get_stats().
+    """
+
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL, threshold=LOOP_STALL_THRESHOLD,
+                 max_sites=LOOP_STALL_SITES, recent=LOOP_RECENT_STALLS):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_sites = max_sites
+        self.sites = {}
+        self.recent = deque(maxlen=recent)
+        self.stats = {"samples": 0, "stalls": 0, "stall_seconds": 0.0, "max_lag": 0.0}
+        self._routes = weakref.WeakKeyDictionary()
+        self._heartbeat = time.monotonic()
+        self._captured = None
+        self._loop = None
+        self._loop_thread_id = None
+        self._previous_factory = None
+        self._sampler = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self._sampler is not None and not self._sampler.done()
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        # Tasks a request spawns (LLM calls, TTS segments) are attributed to its route
+        route = kwargs["context"].get(current_route) if "context" in kwargs else current_route.get()
+        if route is not None:
+            self._routes[task] = route
+        return task
+
+    def tag(self, task, route):
+        """
+        Attributes stalls in a task (and the tasks it creates) to a route.
+
+        Args:
+        task (asyncio.Task): The task, usually the one serving a request.
+        route (str): The route label.
+        """
+        self._routes[task] = route
+
+    async def start(self):
+        """
+        Starts the sampler and the watchdog thread on the running loop.
+        """
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._previous_factory = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._task_factory)
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._sampler = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Loop monitor started (interval {self.interval}s, stall threshold {self.threshold}s)")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._stopping.set()
+        self._sampler.cancel()
+        try:
+            await self._sampler
+        except asyncio.CancelledError:
+            pass
+        self._loop.set_task_factory(self._previous_factory)
+        await asyncio.to_thread(self._watchdog.join)
+
+    async def _sample(self):
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - scheduled - self.interval)
+            self._heartbeat = now
+            self.stats["samples"] += 1
+            self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            captured, self._captured = self._captured, None
+            if lag >= self.threshold:
+                self._record_stall(lag, captured)
+
+    def _watch(self):
+        # Runs in its own thread: the loop can't report on itself while it is blocked
+        last_captured = None
+        while not self._stopping.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == last_captured:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+            task = asyncio.current_task(self._loop)
+            route = self._routes.get(task) if task is not None else None
+            self._captured = (stack, route)
+            last_captured = heartbeat
+
+    def _record_stall(self, seconds, captured):
+        if captured is None:
+            # Too short for the watchdog to catch in the act; the lag is all we know
+            stack, route, site = None, None, "unknown"
+        else:
+            stack, route = captured
+            site = stall_site(stack)
+        route = route or "background"
+        self.stats["stalls"] += 1
+        self.stats["stall_seconds"] += seconds
+        LOOP_STALLS.inc(route=route)
+        LOOP_STALL_SECONDS.inc(seconds, route=route)
+        logger.warning(f"Event loop blocked for {seconds * 1000:.0f} ms at {site} ({route})")
+
+        entry = self.sites.get(site)
+        if entry is None:
+            if len(self.sites) >= self.max_sites:
+                # Make room by forgetting the site that has cost the least so far
+                del self.sites[min(self.sites, key=lambda name: self.sites[name]["total_seconds"])]
+            entry = self.sites[site] = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0, "routes": {},
+                                        "stack": traceback.format_list(stack) if stack else []}
+        entry["count"] += 1
+        entry["total_seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        entry["routes"][route] = entry["routes"].get(route, 0) + 1
+        self.recent.append({"time": time.time(), "seconds": seconds, "site": site, "route": route})
+
+    def get_stats(self, top=10):
+        """
+        Returns the lag histogram and the stall sites that have blocked the loop the longest.
+
+        Args:
+        top (int, optional): How many stall sites to return. Defaults to 10.
+
+        Returns:
+        dict: Loop monitor statistics.
+        """
+        sites = sorted(self.sites.items(), key=lambda item: -item[1]["total_seconds"])[:top]
+        return {
+            **self.stats,
+            "running": self.running,
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "lag": LOOP_LAG_SECONDS.snapshot(),
+            "top_sites": [{"site": site, **entry} for site, entry in sites],
+            "recent_stalls": list(self.recent),
+        }
+
+class LoopMonitorMiddleware:
+    """
+    ASGI middleware that labels each request's task with its route, so stalls can be
+    traced back to the endpoint that caused them.
+    """
+
+    def __init__(self, app, monitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = route_of(scope)
+        token = current_route.set(route)
+        self.monitor.tag(asyncio.current_task(), route)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_route.reset(token)
+
+loop_monitor = LoopMonitor()
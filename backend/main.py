@@ -1,67 +1,81 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+# Load environment variables once, before the modules below read their settings
+load_dotenv()
+
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from pydantic import BaseModel
 from utils import *
 import base64
-from dotenv import load_dotenv
-from agents import partner_chat, tutor_chat, summarize_conversation, generate_homework, generate_chat_name
-from typing import List, Dict
+from agents import partner_chat, stream_partner_chat, run_tutor, summarize_conversation, generate_homework, generate_chat_name, FALLBACK_CHAT_NAME
+from streaming import SentenceSplitter, sse_event, wants_segment_stream, json_frame, audio_frame_header, SEGMENT_STREAM_MEDIA_TYPE
+from clients import client_registry, KEY_CHECK_URLS
+from provider_health import provider_health, ProviderUnavailableError, ProbeScopeMiddleware
+from hedging import hedger
+from model_router import model_router
+from tts_cache import tts_cache, TTS_CACHE_ENABLED
+from tts_chunker import chunk_for_tts
+from sessions import session_store, SessionNotFoundError, SessionConflictError
+from key_scheduler import KeyScheduler
+from jobs import job_queue, JobQueueFullError
+from admission import admission_controller, AdmissionRejectedError
+from loop_monitor import loop_monitor, LoopMonitorMiddleware, LOOP_MONITOR_ENABLED
+from deadlines import deadline_scope, request_deadline, within_deadline, time_left, DeadlineExceededError
+from context_builder import context_builder
+from prompt_registry import prompt_registry
+from metrics import registry as metrics_registry, ServerTimingMiddleware, stage_timer, record_abandoned, TURN_SECONDS, STAGE_SECONDS, ERRORS, IN_FLIGHT, PROMETHEUS_CONTENT_TYPE
+from typing import List, Dict, Optional, Literal
+from contextlib import asynccontextmanager
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 import uvicorn
 import asyncio
-import random
 import json
 import os
-import re
+import time
 import traceback
 import httpx
-from agents import get_llm
-
-# Load environment variables
-load_dotenv()
 
 app = FastAPI()
 
-from agents import get_llm
-
 @app.post("/verify_api_key")
 async def verify_api_key(api_key: str = Form(...), model: str = Form(...)):
+    """
+    Checks whether the provider accepts an API key.
+
+    Lists the provider's models, which costs no tokens, on the shared connection pool.
+    Accepted and rejected keys are cached by key digest for KEY_VALIDATION_TTL and
+    KEY_REJECTION_TTL seconds, so settings pages re-checking a key don't each go out to
+    the provider. Outages and rate limits say nothing about the key and aren't cached.
+    """
+    provider = model.lower()
+    if provider not in KEY_CHECK_URLS:
+        raise HTTPException(status_code=400, detail="Unsupported model")
+
+    cached = provider_health.cached_validation(provider, api_key)
+    if cached is not None:
+        return {"valid": cached}
+
+    if provider == "anthropic":
+        headers = {"x-api-key": api_key, "anthropic-version": "2023-06-01"}
+    else:
+        headers = {"Authorization": f"Bearer {api_key}"}
     try:
-        if model.lower() == "openai":
-            url = "https://api.openai.com/v1/models"
-            headers = {"Authorization": f"Bearer {api_key}"}
-        elif model.lower() == "anthropic":
-            url = "https://api.anthropic.com/v1/messages"
-            headers = {
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json"
-            }
-            # Anthropic requires a POST request with a minimal payload
-            data = {
-                "model": "claude-3-opus-20240229",
-                "max_tokens": 1,
-                "messages": [{"role": "user", "content": "Hello"}]
-            }
-        elif model.lower() == "groq":
-            url = "https://api.groq.com/openai/v1/models"
-            headers = {"Authorization": f"Bearer {api_key}"}
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported model")
-
-        async with httpx.AsyncClient() as client:
-            if model.lower() == "anthropic":
-                response = await client.post(url, headers=headers, json=data)
-            else:
-                response = await client.get(url, headers=headers)
-
-        return {"valid": response.status_code == 200}
-    except Exception as e:
+        response = await client_registry.async_http_client.get(KEY_CHECK_URLS[provider], headers=headers,
+                                                                timeout=KEY_CHECK_TIMEOUT)
+    except httpx.HTTPError as e:
         logger.error(f"Error verifying API key: {str(e)}")
         return {"valid": False, "error": str(e)}
 
+    if response.status_code in (200, 401, 403):
+        valid = response.status_code == 200
+        provider_health.store_validation(provider, api_key, valid)
+        return {"valid": valid}
+    logger.warning(f"Could not verify {provider} API key: HTTP {response.status_code}")
+    return {"valid": False, "error": f"{provider} responded with HTTP {response.status_code}"}
+
 # Load API keys and add logging
 GROQ_API_KEYS = json.loads(os.getenv("GROQ_API_KEYs", "[]"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -69,33 +83,44 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 logger.info(f"GROQ_API_KEYs loaded: {len(GROQ_API_KEYS)} keys")
 logger.info(f"OPENAI_API_KEY loaded: {'Yes' if OPENAI_API_KEY else 'No'}")
 
-def get_random_groq_api_key():
+# The server's own keys keep their clients for the lifetime of the process
+client_registry.pin_keys(GROQ_API_KEYS + [OPENAI_API_KEY])
+
+groq_key_scheduler = KeyScheduler(GROQ_API_KEYS)
+client_registry.register_key_scheduler("groq", groq_key_scheduler)
+
+# Hedged and failed-over LLM calls run on the server's keys, and only calls on them are hedged
+hedger.register_key_source("groq", lambda: get_groq_api_key() if GROQ_API_KEYS else None, GROQ_API_KEYS)
+hedger.register_key_source("openai", lambda: OPENAI_API_KEY, [OPENAI_API_KEY])
+
+# Serving: worker processes (one per core is a good start) and how long a stopping worker
+# may spend finishing in-flight turns
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+WORKERS = int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+
+KEY_CHECK_TIMEOUT = float(os.getenv("KEY_CHECK_TIMEOUT", "10"))
+
+# Homework pre-generation costs a large-model call per turn, so it is opt-in
+PREGENERATE_HOMEWORK = os.getenv("PREGENERATE_HOMEWORK", "false").lower() == "true"
+CHAT_NAME_REFRESH_TURNS = int(os.getenv("CHAT_NAME_REFRESH_TURNS", "5"))
+
+async def get_groq_api_key():
     if not GROQ_API_KEYS:
         logger.error("No GROQ API keys available")
         raise ValueError("No GROQ API keys available")
-    return random.choice(GROQ_API_KEYS)
+    return await groq_key_scheduler.acquire()
 
+# Missing server keys make /readyz fail instead of crashing the import, so the process
+# still answers liveness probes and the misconfiguration shows up in the probe output
 if not OPENAI_API_KEY:
     logger.error("OPENAI_API_KEY is not set in the environment variables")
-    raise ValueError("OPENAI_API_KEY is not set in the environment variables")
 
 # Ensure .env file is loaded
 logger.info(f"Current working directory: {os.getcwd()}")
 logger.info(f".env file exists: {'Yes' if os.path.exists('.env') else 'No'}")
 
-def split_text(text, max_sentences=4):
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    parts = []
-    current_part = []
-    for sentence in sentences:
-        current_part.append(sentence)
-        if len(current_part) == max_sentences:
-            parts.append(' '.join(current_part))
-            current_part = []
-    if current_part:
-        parts.append(' '.join(current_part))
-    return parts
-
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -103,8 +128,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Per-request stage timings for the load generator (loadtest/) and browser devtools
+app.add_middleware(ServerTimingMiddleware)
+
+# Labels each request's tasks with its route so event-loop stalls can be attributed
+app.add_middleware(LoopMonitorMiddleware, monitor=loop_monitor)
+
+# Lets a request admitted as a circuit-breaker probe make all of its provider calls
+app.add_middleware(ProbeScopeMiddleware)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -140,11 +175,14 @@ class AudioData(BaseModel):
     tutorsVoice: str
     partnersVoice: str
     interventionLevel: str
-    chatObject: ChatObject
+    chatObject: Optional[ChatObject] = None  # Omitted when the conversation lives in a server session
     disableTutor: bool
     accentignore: bool = False  # Make it optional with False as default
     model: str
     api_key: str
+    sessionId: Optional[str] = None
+    revision: Optional[int] = None
+    audioFormat: Literal["mp3", "opus", "aac"] = "mp3"
 
 class FormattedConversation(BaseModel):
     formatted_text: str
@@ -160,10 +198,57 @@ def dict_to_message(message_dict: Dict) -> BaseMessage:
     else:
         raise ValueError(f"Unknown message type: {message_dict['type']}")
 
+@app.on_event("startup")
+async def startup():
+    if LOOP_MONITOR_ENABLED:
+        await loop_monitor.start()
+    await job_queue.start()
+    await session_store.start()
+    # Warming connections is an optimization; readiness doesn't wait for it
+    app.state.warm_up = asyncio.create_task(client_registry.warm_up({
+        "openai": OPENAI_API_KEY,
+        "groq": GROQ_API_KEYS[0] if GROQ_API_KEYS else None,
+    }))
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.warm_up.cancel()
+    await job_queue.stop()
+    await session_store.stop()
+    await client_registry.close()
+    # Write out the key usage still queued, so the other workers see it
+    await asyncio.to_thread(groq_key_scheduler.flush)
+    await loop_monitor.stop()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the audio analysis API"}
 
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness probe: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness probe: the app has started and can serve turns.
+
+    Checks that the background job queue is running, the session database answers and
+    the server's OpenAI key (used for TTS) is configured. Responds 503 with the failed
+    checks otherwise, so the orchestrator holds traffic back without restarting the process.
+    """
+    checks = {
+        "jobs": job_queue.running,
+        "sessions": await session_store.ping(),
+        "openai_key": bool(OPENAI_API_KEY),
+    }
+    ready = all(checks.values())
+    return JSONResponse({"status": "ready" if ready else "not ready", "checks": checks},
+                        status_code=200 if ready else 503)
+
 # Add this mapping at the beginning of your file or in a constants section
 
 INTERVENTION_LEVEL_MAP = {
@@ -173,50 +258,564 @@ INTERVENTION_LEVEL_MAP = {
     "high": 3
 }
 
+async def resolve_api_key(api_key, provider):
+    """
+    Returns the user's API key, or the server's key for providers we host.
+
+    Args:
+    api_key (str): The API key sent by the client (may be empty).
+    provider (str): The lower-cased provider name.
+
+    Returns:
+    str: The API key to use.
+
+    Raises:
+    ValueError: If no key was sent for a provider the server doesn't host.
+    """
+    if api_key.strip():
+        return api_key
+    if provider == "openai":
+        return OPENAI_API_KEY
+    elif provider == "groq":
+        return await get_groq_api_key()
+    else:
+        raise ValueError(f"For this provider use your key: {provider}")
+
+def tutor_enabled(audio_data):
+    """
+    Decides up front whether the tutor can speak this turn at all.
+
+    With the tutor disabled or the intervention level at "no", tutor_should_speak can never
+    be true, so the three tutor LLM calls are skipped instead of run and thrown away.
+
+    Args:
+    audio_data (AudioData): The request settings.
+
+    Returns:
+    bool: True if tutor_chat should run.
+    """
+    return not audio_data.disableTutor and INTERVENTION_LEVEL_MAP[audio_data.interventionLevel] > 0
+
+def format_tutors_comment(tutor_feedback):
+    if tutor_feedback is None:
+        return ""
+    return f"Comment: {tutor_feedback['comments']}\nCorrection: {tutor_feedback['correction']}"
+
+def tutor_should_speak(tutor_feedback, audio_data):
+    """
+    Decides whether the tutor's feedback is voiced for this turn.
+
+    Args:
+    tutor_feedback (dict): The output of tutor_chat, or None if it was skipped.
+    audio_data (AudioData): The request settings.
+
+    Returns:
+    bool: True if the tutor's comment and correction should be sent to TTS.
+    """
+    if tutor_feedback is None:
+        return False
+    tutor_intervention_level = INTERVENTION_LEVEL_MAP[tutor_feedback["intervene"]]
+    required_intervention_level = INTERVENTION_LEVEL_MAP[audio_data.interventionLevel]
+    return not audio_data.disableTutor and (3-tutor_intervention_level) < required_intervention_level
+
+async def generate_audio(text, voice, audio_format="mp3"):
+    logger.info(f"Generating {audio_format} audio for voice: {voice}")
+    # The synthesis thread can't be cancelled, so it gets the turn's remaining time as its HTTP timeout
+    timeout = time_left()
+    with stage_timer("tts", "openai", TTS_MODEL):
+        if not TTS_CACHE_ENABLED:
+            return await asyncio.to_thread(generate_tts, text, OPENAI_API_KEY, voice, audio_format, timeout)
+        return await tts_cache.get_or_generate(
+            TTS_MODEL, voice, text,
+            lambda: asyncio.to_thread(generate_tts, text, OPENAI_API_KEY, voice, audio_format, timeout),
+            audio_format=audio_format
+        )
+
+async def load_chat_object(audio_data):
+    """
+    Returns the conversation a request works on.
+
+    Stateless requests carry the whole chat object. Session requests carry only a session id
+    (and optionally the revision the client last saw), and the chat object is loaded from the
+    session store.
+
+    Args:
+    audio_data (AudioData): The request data.
+
+    A summary produced by the background job queue since the last turn is appended to the
+    session's chat object here, so the turn's prompts see it and it is saved with the turn.
+
+    Returns:
+    tuple: The ChatObject, the session revision it was loaded at (None when stateless), and
+    the background summaries merged into it (empty when stateless).
+
+    Raises:
+    HTTPException: 400 if neither is sent, 404 for an unknown session, 409 for a stale revision.
+    """
+    if not audio_data.sessionId:
+        if audio_data.chatObject is None:
+            raise HTTPException(status_code=400, detail="Either chatObject or sessionId is required")
+        return audio_data.chatObject, None, []
+
+    try:
+        revision, state = await session_store.load(audio_data.sessionId)
+    except SessionNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown session: {audio_data.sessionId}")
+    if audio_data.revision is not None and audio_data.revision != revision:
+        raise HTTPException(status_code=409, detail=f"Session is at revision {revision}, not {audio_data.revision}")
+
+    chat_object = ChatObject.model_validate(state)
+    merged_summaries = []
+    summary = (await session_store.get_artifacts(audio_data.sessionId)).get("summary")
+    if summary and (not chat_object.summary or chat_object.summary[-1] != summary["text"]):
+        chat_object.summary.append(summary["text"])
+        merged_summaries.append(summary["text"])
+    return chat_object, revision, merged_summaries
+
+async def finish_turn(audio_data, chat_object, revision, new_messages, updated_summary, tutors_comment, merged_summaries=()):
+    """
+    Appends a turn to the conversation and builds the chat part of the response.
+
+    Stateless requests get the full updated chat object back. Session requests get the
+    conversation saved server-side and receive only what this turn added; their summary,
+    chat name and homework are then brought up to date by background jobs.
+
+    Args:
+    audio_data (AudioData): The request data.
+    chat_object (ChatObject): The conversation before this turn.
+    revision (int): The session revision the turn was built from, or None when stateless.
+    new_messages (list): The BaseMessages added this turn.
+    updated_summary (str): The new conversation summary, or None if it is left to the background queue.
+    tutors_comment (str): The tutor's comment for this turn.
+    merged_summaries (list, optional): Background summaries load_chat_object merged into chat_object.
+
+    Returns:
+    dict: {"chatObject"} when stateless, {"sessionId", "revision", "delta"} for sessions.
+
+    Raises:
+    HTTPException: 409 if the session changed while the turn was being processed.
+    """
+    new_message_dicts = [MessageDict(**message_to_dict(msg)).model_dump() for msg in new_messages]
+    updated_chat_object = chat_object.model_dump()
+    new_summaries = list(merged_summaries)
+    if updated_summary is not None:
+        new_summaries.append(updated_summary)
+    updated_chat_object['chat_history'].extend(new_message_dicts)
+    if updated_summary is not None:
+        updated_chat_object['summary'].append(updated_summary)
+    updated_chat_object['tutors_comments'].append(tutors_comment)
+
+    if revision is None:
+        return {"chatObject": updated_chat_object}
+
+    try:
+        new_revision = await session_store.save(audio_data.sessionId, revision, updated_chat_object)
+    except SessionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await enqueue_post_turn_jobs(audio_data)
+    return {
+        "sessionId": audio_data.sessionId,
+        "revision": new_revision,
+        "delta": {
+            "chat_history": new_message_dicts,
+            "summary": new_summaries,
+            "tutors_comments": [tutors_comment]
+        }
+    }
+
+def homework_context(chat_object):
+    """
+    Interweaves the chat history with the tutor's comments for the homework prompt.
+
+    Long conversations are cut to the homework token budget, keeping the most recent messages.
+
+    Args:
+    chat_object (ChatObject): The conversation.
+
+    Returns:
+    str: The conversation as text, each message followed by the tutor's comment on it.
+    """
+    interwoven_context = []
+    for i, msg in enumerate(chat_object.chat_history):
+        entry = f"{msg.type}: {msg.content}"
+        
+        if i < len(chat_object.tutors_comments):
+            entry += f"\n\nTutor: {chat_object.tutors_comments[i]}\n"
+        interwoven_context.append(entry)
+
+    return "\n".join(context_builder.build("homework", interwoven_context).items)
+
+async def enqueue_post_turn_jobs(audio_data):
+    """
+    Queues the work that follows a session turn but isn't needed to answer it.
+
+    The summary job chains the chat name job; homework is pre-generated only with
+    PREGENERATE_HOMEWORK. Jobs for the same session coalesce while they are still waiting.
+
+    Args:
+    audio_data (AudioData): The request data of the turn that was just saved.
+    """
+    payload = {
+        "session_id": audio_data.sessionId,
+        "tutoring_language": audio_data.tutoringLanguage,
+        "provider": audio_data.model.lower(),
+    }
+    api_key = audio_data.api_key.strip() or None
+    try:
+        await job_queue.enqueue("summary", payload, dedupe_key=f"summary:{audio_data.sessionId}", api_key=api_key)
+        if PREGENERATE_HOMEWORK:
+            await job_queue.enqueue("homework", payload, dedupe_key=f"homework:{audio_data.sessionId}", api_key=api_key)
+    except JobQueueFullError as e:
+        logger.warning(f"Skipping post-turn jobs for session {audio_data.sessionId}: {str(e)}")
+
+async def admit_request(endpoint, provider):
+    """
+    Waits for an admission slot for a request, shedding it with a 503 if none frees up in time.
+
+    Args:
+    endpoint (str): The endpoint name.
+    provider (str): The provider the request will call.
+
+    Returns:
+    Ticket: The slot; release it with admission_controller.release().
+
+    Raises:
+    HTTPException: 503 with Retry-After when the request is shed.
+    """
+    try:
+        return await admission_controller.acquire(endpoint, provider)
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {str(e)}",
+                            headers={"Retry-After": str(e.retry_after)})
+
+def provider_unavailable(error):
+    """
+    Returns the 503 for a request refused by a provider's circuit breaker.
+
+    Args:
+    error (ProviderUnavailableError): The refusal.
+
+    Returns:
+    HTTPException: A 503 with Retry-After set to when the breaker will let a probe through.
+    """
+    return HTTPException(status_code=503, detail=str(error),
+                         headers={"Retry-After": str(max(1, int(error.retry_after + 0.999)))})
+
+@asynccontextmanager
+async def admitted(endpoint, provider):
+    ticket = await admit_request(endpoint, provider)
+    try:
+        yield
+    finally:
+        admission_controller.release(ticket)
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that gives back its request's admission slot once it has been sent.
+
+    Releasing the slot here rather than in the body generator also covers a client that
+    disconnects before the body starts: the generator then never runs, and its cleanup
+    with it.
+    """
+
+    def __init__(self, content, ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission_controller.release(self.ticket)
+
+async def wait_for_disconnect(request):
+    # The body has already been read, so the next message can only be the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def until_disconnected(request, endpoint, awaitable):
+    """
+    Runs a request's work, cancelling it if the client goes away first.
+
+    Without this an abandoned turn keeps its admission slot and goes on to pay for LLM
+    and TTS calls nobody will hear.
+
+    Args:
+    request (Request): The request, watched for the client disconnecting.
+    endpoint (str): The endpoint name, for the metrics.
+    awaitable: The coroutine doing the work.
+
+    Returns:
+    The work's result.
+
+    Raises:
+    HTTPException: 499 if the client disconnected; nobody receives it.
+    """
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.create_task(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        work.cancel()
+    if not work.done() or work.cancelled():
+        # Let the work's cleanup (admission release, task cancellation) run before returning
+        await asyncio.gather(work, return_exceptions=True)
+        record_abandoned(endpoint, "disconnect")
+        logger.info(f"Client disconnected; cancelled {endpoint} request")
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    return work.result()
+
+async def summarize_or_keep(tutoring_language, chat_history, previous_summary, provider, api_key):
+    """
+    Summarizes a stateless turn, leaving the summary as it was if that fails.
+
+    Returns:
+    str: The updated summary, or None to keep the previous one.
+    """
+    try:
+        summary = await summarize_conversation(
+            tutoring_language,
+            chat_history,
+            previous_summary,
+            provider=provider,
+            api_key=api_key
+        )
+    except Exception as e:
+        logger.warning(f"Keeping the previous summary; summarization failed: {e}")
+        return None
+    return summary if summary.strip() else None
+
+async def run_summary_job(payload, api_key):
+    session_id = payload["session_id"]
+    try:
+        revision, state = await session_store.load(session_id)
+    except SessionNotFoundError:
+        return
+    chat_object = ChatObject.model_validate(state)
+    artifacts = await session_store.get_artifacts(session_id)
+    if "summary" in artifacts:
+        previous_summary = artifacts["summary"]["text"]
+    else:
+        previous_summary = chat_object.summary[-1] if chat_object.summary else ""
+
+    provider = payload["provider"]
+    async with admission_controller.admit("job", provider):
+        summary = await summarize_conversation(
+            payload["tutoring_language"],
+            [dict_to_message(msg.model_dump()) for msg in chat_object.chat_history],
+            previous_summary,
+            provider=provider,
+            api_key=api_key or await resolve_api_key("", provider)
+        )
+    if not summary.strip():
+        # Raising lets the queue retry; storing it would erase the conversation's summary
+        raise ValueError(f"Summarizer returned an empty summary for session {session_id}")
+    if not await session_store.put_artifact(session_id, "summary", {"text": summary, "revision": revision}):
+        # The session was deleted while the summary was being written
+        return
+
+    chat_name = artifacts.get("chat_name")
+    if chat_name is None or revision - chat_name["revision"] >= CHAT_NAME_REFRESH_TURNS:
+        await job_queue.enqueue("chat_name", payload, dedupe_key=f"chat_name:{session_id}", api_key=api_key)
+
+async def run_chat_name_job(payload, api_key):
+    session_id = payload["session_id"]
+    artifacts = await session_store.get_artifacts(session_id)
+    if "summary" not in artifacts:
+        return
+    provider = payload["provider"]
+    async with admission_controller.admit("job", provider):
+        chat_name = await generate_chat_name(
+            artifacts["summary"]["text"],
+            provider=provider,
+            api_key=api_key or await resolve_api_key("", provider)
+        )
+    if not chat_name or chat_name == FALLBACK_CHAT_NAME:
+        # Raising lets the queue retry instead of naming the chat after the failure
+        raise ValueError(f"Chat name generation failed for session {session_id}")
+    await session_store.put_artifact(session_id, "chat_name", {"name": chat_name, "revision": artifacts["summary"]["revision"]})
+
+async def run_homework_job(payload, api_key):
+    session_id = payload["session_id"]
+    try:
+        revision, state = await session_store.load(session_id)
+    except SessionNotFoundError:
+        return
+    provider = payload["provider"]
+    async with admission_controller.admit("job", provider):
+        homework = await generate_homework(
+            payload["tutoring_language"],
+            homework_context(ChatObject.model_validate(state)),
+            provider=provider,
+            api_key=api_key or await resolve_api_key("", provider)
+        )
+    await session_store.put_artifact(session_id, "homework", {"homework": homework, "revision": revision})
+
+job_queue.register("summary", run_summary_job)
+job_queue.register("chat_name", run_chat_name_job)
+job_queue.register("homework", run_homework_job)
+
+@app.post("/sessions")
+async def create_session(chat_object: Optional[ChatObject] = None):
+    """
+    Starts a server-side session, optionally seeded with an existing conversation.
+    """
+    state = chat_object.model_dump() if chat_object else {"chat_history": [], "tutors_comments": [], "summary": []}
+    session_id, revision = await session_store.create(state)
+    return {"sessionId": session_id, "revision": revision}
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    try:
+        revision, state = await session_store.load(session_id)
+    except SessionNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown session: {session_id}")
+    artifacts = await session_store.get_artifacts(session_id)
+    return {"sessionId": session_id, "revision": revision, "chatObject": state, "artifacts": artifacts}
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    await session_store.delete(session_id)
+    return {"deleted": True}
+
+@app.get("/groq_keys/stats")
+async def groq_key_stats():
+    return await asyncio.to_thread(groq_key_scheduler.get_stats)
+
+@app.get("/tts_cache/stats")
+async def tts_cache_stats():
+    return tts_cache.get_stats()
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Serves turn latency histograms, error/retry/rate-limit counters and in-flight gauges
+    in the Prometheus text format.
+    """
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/prompts/stats")
+async def prompt_stats():
+    return prompt_registry.get_stats()
+
+@app.get("/context/stats")
+async def context_stats():
+    return context_builder.get_stats()
+
+@app.get("/providers/health")
+async def providers_health():
+    """
+    Circuit breaker state per provider, rolling latency and error rate per model, and the
+    API key validation cache.
+    """
+    return provider_health.get_stats()
+
+@app.get("/model_routes/stats")
+async def model_route_stats():
+    """
+    The model each task runs on per provider, and per task, provider and model the calls,
+    latency, tokens and estimated cost, for tuning the routing table.
+    """
+    return model_router.get_stats()
+
+@app.post("/model_routes/reload")
+async def reload_model_routes():
+    """
+    Re-reads the routes file now instead of waiting for the change to be noticed.
+    Only the worker serving the request reloads; the others pick the change up within
+    MODEL_ROUTES_CHECK_INTERVAL seconds.
+    """
+    result = await asyncio.to_thread(model_router.reload)
+    if result["error"]:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+@app.get("/hedging/stats")
+async def hedging_stats():
+    return hedger.get_stats()
+
+@app.get("/admission/stats")
+async def admission_stats():
+    return admission_controller.get_stats()
+
+@app.get("/loop/stats")
+async def loop_stats(top: int = 10):
+    """
+    Event-loop lag histogram and the code sites that blocked the loop the longest, with
+    their stacks and the routes they ran under.
+    """
+    return loop_monitor.get_stats(top)
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return await job_queue.get_stats()
+
 @app.post("/process_audio")
 async def process_audio(
+    request: Request,
     audio: UploadFile = File(...),
-    data: str = Form(...)
+    data: str = Form(...),
+    accept: Optional[str] = Header(None),
+    x_request_timeout: Optional[str] = Header(None)
 ):
+    """
+    Processes one conversation turn: transcription, partner reply, tutor feedback and TTS.
+
+    By default the response is JSON with the audio base64-encoded. Clients that send
+    `Accept: application/x-tutor-segments` get the binary segment stream instead (see
+    streaming.py): the chat state as one JSON frame, then each audio segment as raw bytes
+    in the requested audioFormat.
+
+    The turn must finish within DEADLINE_PROCESS_AUDIO seconds (or the client's
+    `X-Request-Timeout`, if shorter); past it the outstanding calls are cancelled and the
+    response is a 504. If the client disconnects, the turn is cancelled at once.
+    """
+    with deadline_scope(request_deadline("process_audio", x_request_timeout)):
+        return await until_disconnected(request, "process_audio", process_turn(audio, data, accept))
+
+async def process_turn(audio, data, accept):
+    turn_start = time.perf_counter()
+    provider = ""
+    ticket = None
+    IN_FLIGHT.inc(endpoint="process_audio")
     try:
         logger.info("Starting process_audio function")
         audio_data = AudioData.model_validate_json(data)
-        
+        # Shed the turn before doing any work if the server can't take it in time
+        ticket = await admit_request("process_audio", audio_data.model.lower())
+        chat_object, session_revision, merged_summaries = await load_chat_object(audio_data)
+
         # Read the audio file
+        audio_filename, audio_content_type = upload_file_info(audio.filename, audio.content_type)
         audio_content = await audio.read()
         learning_language = language_to_code(audio_data.tutoringLanguage)
         logger.info(f"Learning language code: {learning_language}")
         
-        # Use the API key from audio_data if it's not empty, otherwise use the previous method
-        api_key = audio_data.api_key
+        # Use the API key from audio_data if it's not empty, otherwise use the server's key
         provider = audio_data.model.lower()
-        
-        if not api_key.strip():
-            # Use the previous method to get the API key
-            if provider == "openai":
-                api_key = OPENAI_API_KEY
-            elif provider == "groq":
-                api_key = get_random_groq_api_key()
-            else:
-                raise ValueError(f"For this provider use your key: {provider}")
-        
+        api_key = await resolve_api_key(audio_data.api_key, provider)
+
         # Transcribe the audio
         logger.info(f"Starting audio transcription (accentignore: {audio_data.accentignore})")
-        logger.info("Starting transcribe_audio task {api_key}")
-        transcription = transcribe_audio(audio_content, learning_language, OPENAI_API_KEY, new_parameter=audio_data.accentignore, provider="openai")
+        transcription = await within_deadline(
+            transcribe_audio(audio_content, learning_language, OPENAI_API_KEY, new_parameter=audio_data.accentignore, provider="openai",
+                             filename=audio_filename, content_type=audio_content_type),
+            "transcription")
         logger.info(f"Transcription: {transcription}")
         
         # Convert MessageDict objects to BaseMessage objects
         logger.info("Converting chat history")
-        chat_history = [dict_to_message(msg.model_dump()) for msg in audio_data.chatObject.chat_history]
+        chat_history = [dict_to_message(msg.model_dump()) for msg in chat_object.chat_history]
         logger.info(f"Converted chat history: {chat_history}")
+        previous_length = len(chat_history)
         wrapped_transcription = HumanMessage(content=transcription)
         chat_history.append(wrapped_transcription)
-        tutor_history = audio_data.chatObject.tutors_comments
+        tutor_history = chat_object.tutors_comments
 
         # Use the partner_chat function to get a response
         logger.info("Starting partner_chat task")
-        last_summary = audio_data.chatObject.summary[-1] if audio_data.chatObject.summary else ""
+        last_summary = chat_object.summary[-1] if chat_object.summary else ""
         partner_task = asyncio.create_task(partner_chat(
             audio_data.tutoringLanguage,
             chat_history,
@@ -224,161 +823,394 @@ async def process_audio(
             api_key=api_key,
             last_summary=last_summary))
         
-        logger.info("Starting tutor_chat task")
-        tutor_task = asyncio.create_task(tutor_chat(
-            audio_data.tutoringLanguage,
-            audio_data.tutorsLanguage,
-            chat_history,
-            tutor_history,
-            provider=provider,
-            api_key=api_key))
-        
-        (response, updated_chat_history), tutor_feedback = await asyncio.gather(partner_task, tutor_task)
+        if tutor_enabled(audio_data):
+            logger.info("Starting tutor task")
+            tutor_task = asyncio.create_task(run_tutor(
+                audio_data.tutoringLanguage,
+                audio_data.tutorsLanguage,
+                chat_history,
+                tutor_history,
+                provider=provider,
+                api_key=api_key))
+
+            (response, updated_chat_history), tutor_feedback = await within_deadline(
+                asyncio.gather(partner_task, tutor_task), "partner")
+        else:
+            logger.info("Tutor disabled for this turn; skipping tutor_chat")
+            response, updated_chat_history = await within_deadline(partner_task, "partner")
+            tutor_feedback = None
 
         logger.info(f"Partner response: {response.content}")
         logger.info(f"Tutor feedback: {tutor_feedback}")
         
-        async def generate_audio(text, voice):
-            logger.info(f"Generating audio for voice: {voice}")
-            return await asyncio.to_thread(generate_tts, text, OPENAI_API_KEY, voice)
-
         audio_generation_tasks = []
         audio_order = []
 
-        # Convert string levels to numeric values
-        tutor_intervention_level = INTERVENTION_LEVEL_MAP[tutor_feedback["intervene"]]
-        required_intervention_level = INTERVENTION_LEVEL_MAP[audio_data.interventionLevel]
-
         # Prepare tutor feedback string
-        tutors_comments_string = f"Comment: {tutor_feedback['comments']}\nCorrection: {tutor_feedback['correction']}"
+        tutors_comments_string = format_tutors_comment(tutor_feedback)
 
-        if not audio_data.disableTutor and (3-tutor_intervention_level) < required_intervention_level:
+        if tutor_should_speak(tutor_feedback, audio_data):
             logger.info(f"Tutor intervention enabled. Level: {tutor_feedback['intervene']}")
             audio_generation_tasks.extend([
-                generate_audio(tutor_feedback["comments"], audio_data.tutorsVoice),  # TTS: Tutor's comments
-                generate_audio(tutor_feedback["correction"], audio_data.tutorsVoice),  # TTS: Tutor's correction
+                generate_audio(tutor_feedback["comments"], audio_data.tutorsVoice, audio_data.audioFormat),  # TTS: Tutor's comments
+                generate_audio(tutor_feedback["correction"], audio_data.tutorsVoice, audio_data.audioFormat),  # TTS: Tutor's correction
             ])
             audio_order = ["tutor_comments", "tutor_correction"]
+            segment_texts = [tutor_feedback["comments"], tutor_feedback["correction"]]
         else:
-            logger.info(f"Tutor intervention disabled or not needed. Level: {tutor_feedback['intervene']}")
+            logger.info("Tutor intervention disabled or not needed")
             audio_order = []
+            segment_texts = []
 
-        # Split partner's response if it's long
-        response_parts = split_text(response.content)
+        # Split partner's response into balanced chunks that are synthesized in parallel
+        response_parts = chunk_for_tts(response.content, learning_language)
         for i, part in enumerate(response_parts):
-            audio_generation_tasks.append(generate_audio(part, audio_data.partnersVoice))  # TTS: Partner's response part
+            audio_generation_tasks.append(generate_audio(part, audio_data.partnersVoice, audio_data.audioFormat))  # TTS: Partner's response part
             audio_order.append(f"partner_response_{i}")
+            segment_texts.append(part)
 
         logger.info(f"Number of response parts: {len(response_parts)}")
 
-        # Add summarizer task
-        logger.info("Starting summarizer task")
-        previous_summary = audio_data.chatObject.summary[-1] if audio_data.chatObject.summary else ""
-        summarizer_task = summarize_conversation(
-            audio_data.tutoringLanguage,
-            updated_chat_history,
-            previous_summary,
-            provider=provider,
-            api_key=api_key
-        )
-
-        # Gather all tasks
-        logger.info("Gathering all tasks")
-        all_results = await asyncio.gather(*audio_generation_tasks, summarizer_task)
-
-        # Separate audio results and summary
-        audio_results = all_results[:-1]
-        updated_summary = all_results[-1]
-
-        audio_dict = dict(zip(audio_order, audio_results))
+        if session_revision is None:
+            # Add summarizer task
+            logger.info("Starting summarizer task")
+            previous_summary = chat_object.summary[-1] if chat_object.summary else ""
+            summarizer_task = summarize_or_keep(
+                audio_data.tutoringLanguage,
+                updated_chat_history,
+                previous_summary,
+                provider,
+                api_key
+            )
+
+            # Gather all tasks
+            logger.info("Gathering all tasks")
+            all_results = await within_deadline(asyncio.gather(*audio_generation_tasks, summarizer_task), "tts")
+
+            # Separate audio results and summary
+            audio_results = all_results[:-1]
+            updated_summary = all_results[-1]
+
+            logger.info(f"Updated summary: {updated_summary}")
+        else:
+            # Session turns leave the summary to the background job queue
+            logger.info("Gathering audio tasks")
+            audio_results = await within_deadline(asyncio.gather(*audio_generation_tasks), "tts")
+            updated_summary = None
 
-        # Concatenate audio data in the correct order
-        logger.info("Concatenating audio data")
-        audio_data_list = []
-        for key in audio_order:
-            if key.startswith("partner_response_"):
-                audio_data_list.append(audio_dict[key])
-            else:
-                audio_data_list.append(audio_dict[key])
-        concatenated_audio = b''.join(audio_data_list)
-        audio_base64 = base64.b64encode(concatenated_audio).decode('utf-8')
+        # Convert the turn's BaseMessage objects back to MessageDict objects
+        logger.info("Updating chat object")
+        turn_result = await finish_turn(
+            audio_data, chat_object, session_revision,
+            updated_chat_history[previous_length:], updated_summary, tutors_comments_string,
+            merged_summaries)
 
-        logger.info(f"Updated summary: {updated_summary}")
+        if wants_segment_stream(accept):
+            logger.info("Returning binary segment stream")
 
-        # Convert BaseMessage objects back to MessageDict objects
-        logger.info("Updating chat object")
-        updated_chat_object = audio_data.chatObject.model_dump()
-        updated_chat_object['chat_history'] = [
-            MessageDict(**message_to_dict(msg)).model_dump() for msg in updated_chat_history
-        ]
-        updated_chat_object['summary'].append(updated_summary)
-        updated_chat_object['tutors_comments'].append(tutors_comments_string)
+            def frames():
+                yield json_frame("done", turn_result)
+                for index, (key, text, audio_bytes) in enumerate(zip(audio_order, segment_texts, audio_results)):
+                    source = "partner" if key.startswith("partner_response_") else "tutor"
+                    yield json_frame("audio", {"index": index, "source": source, "text": text, "format": audio_data.audioFormat})
+                    yield audio_frame_header(audio_bytes)
+                    yield audio_bytes
 
-        logger.info(f"Tutors comments: {updated_chat_object['tutors_comments']}")
+            TURN_SECONDS.observe(time.perf_counter() - turn_start, endpoint="process_audio", provider=provider)
+            return StreamingResponse(frames(), media_type=SEGMENT_STREAM_MEDIA_TYPE)
 
-        # Single return statement
         logger.info("Returning response")
-        return JSONResponse({
-            "audio_base64": audio_base64,
-            "chatObject": updated_chat_object
-        })
-
+        with stage_timer("serialization", provider):
+            if audio_data.audioFormat == "mp3":
+                # MP3 frames can be concatenated into one playable stream
+                json_response = JSONResponse({
+                    "audio_base64": base64.b64encode(b''.join(audio_results)).decode('utf-8'),
+                    **turn_result
+                })
+            else:
+                # Ogg/AAC segments don't concatenate cleanly, so send them separately
+                json_response = JSONResponse({
+                    "audio_segments_base64": [base64.b64encode(audio_bytes).decode('utf-8') for audio_bytes in audio_results],
+                    **turn_result
+                })
+        TURN_SECONDS.observe(time.perf_counter() - turn_start, endpoint="process_audio", provider=provider)
+        return json_response
+
+    except DeadlineExceededError as e:
+        record_abandoned("process_audio", "deadline")
+        raise HTTPException(status_code=504, detail=str(e))
+    except ProviderUnavailableError as e:
+        ERRORS.inc(stage="turn", provider=provider)
+        raise provider_unavailable(e)
+    except HTTPException:
+        ERRORS.inc(stage="turn", provider=provider)
+        raise
     except Exception as e:
+        ERRORS.inc(stage="turn", provider=provider)
         logger.error(f"An error occurred: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission_controller.release(ticket)
+        IN_FLIGHT.dec(endpoint="process_audio")
+
+@app.post("/process_audio_stream")
+async def process_audio_stream(
+    audio: UploadFile = File(...),
+    data: str = Form(...),
+    accept: Optional[str] = Header(None),
+    x_request_timeout: Optional[str] = Header(None)
+):
+    """
+    Streaming variant of /process_audio.
+
+    Streams events instead of a single body. Partner tokens are cut into sentences as they
+    arrive and each sentence goes to TTS immediately, so the first audio segment is sent
+    while the rest of the reply is still being generated. Events:
+
+    - transcription: {"text"}
+    - audio: {"index", "source", "text", "format"}, sent in playback order
+    - done: the chat part of the response once the summary is ready, as returned by finish_turn
+    - error: {"detail"}
+
+    Sent as Server-Sent Events with the audio base64-encoded in the audio event, or, with
+    `Accept: application/x-tutor-segments`, as the binary segment stream with raw audio frames.
+
+    The turn has the same deadline as /process_audio; when it passes, the outstanding calls
+    are cancelled and the stream ends with an error event. A client disconnect cancels the
+    stream, and with it every pending call.
+    """
+    logger.info("Starting process_audio_stream function")
+    turn_start = time.perf_counter()
+    budget = request_deadline("process_audio_stream", x_request_timeout)
+    try:
+        audio_data = AudioData.model_validate_json(data)
+        chat_object, session_revision, merged_summaries = await load_chat_object(audio_data)
+        audio_filename, audio_content_type = upload_file_info(audio.filename, audio.content_type)
+        audio_content = await audio.read()
+        provider = audio_data.model.lower()
+        api_key = await resolve_api_key(audio_data.api_key, provider)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Held until the response has been sent, so the slot covers the whole turn
+    ticket = await admit_request("process_audio_stream", provider)
+
+    async def turn_events():
+        # Yields (event, payload, audio_bytes); audio_bytes is only set for audio events
+        pending = []
+        # The budget counts from the request's arrival, not from when streaming starts
+        remaining = None if budget is None else budget - (time.perf_counter() - turn_start)
+        with deadline_scope(remaining):
+            try:
+                learning_language = language_to_code(audio_data.tutoringLanguage)
+                transcription = await within_deadline(
+                    transcribe_audio(audio_content, learning_language, OPENAI_API_KEY, new_parameter=audio_data.accentignore, provider="openai",
+                                     filename=audio_filename, content_type=audio_content_type),
+                    "transcription")
+                logger.info(f"Transcription: {transcription}")
+                yield "transcription", {"text": transcription}, None
+
+                chat_history = [dict_to_message(msg.model_dump()) for msg in chat_object.chat_history]
+                chat_history.append(HumanMessage(content=transcription))
+                last_summary = chat_object.summary[-1] if chat_object.summary else ""
+
+                tutor_task = None
+                if tutor_enabled(audio_data):
+                    tutor_task = asyncio.create_task(run_tutor(
+                        audio_data.tutoringLanguage,
+                        audio_data.tutorsLanguage,
+                        chat_history,
+                        chat_object.tutors_comments,
+                        provider=provider,
+                        api_key=api_key))
+                    pending.append(tutor_task)
+
+                # Partner sentences are queued as (text, tts_task) the moment they are complete;
+                # None marks the end of the reply.
+                partner_segments = asyncio.Queue()
+                partner_reply = []
+
+                async def stream_partner():
+                    splitter = SentenceSplitter(learning_language)
+
+                    def enqueue(sentence):
+                        tts_task = asyncio.create_task(generate_audio(sentence, audio_data.partnersVoice, audio_data.audioFormat))
+                        pending.append(tts_task)
+                        partner_segments.put_nowait((sentence, tts_task))
+
+                    try:
+                        async for token in stream_partner_chat(
+                                audio_data.tutoringLanguage,
+                                chat_history,
+                                provider=provider,
+                                api_key=api_key,
+                                last_summary=last_summary):
+                            partner_reply.append(token)
+                            for sentence in splitter.feed(token):
+                                enqueue(sentence)
+                        for sentence in splitter.flush():
+                            enqueue(sentence)
+                    finally:
+                        partner_segments.put_nowait(None)
+
+                partner_task = asyncio.create_task(stream_partner())
+                pending.append(partner_task)
+
+                # The tutor speaks before the partner, so its decision gates the first segment.
+                # Partner TTS keeps running in the background meanwhile. A skipped tutor gates nothing.
+                tutor_feedback = await within_deadline(tutor_task, "tutor") if tutor_task else None
+                logger.info(f"Tutor feedback: {tutor_feedback}")
+                index = 0
+                if tutor_should_speak(tutor_feedback, audio_data):
+                    tutor_tasks = [
+                        asyncio.create_task(generate_audio(tutor_feedback["comments"], audio_data.tutorsVoice, audio_data.audioFormat)),
+                        asyncio.create_task(generate_audio(tutor_feedback["correction"], audio_data.tutorsVoice, audio_data.audioFormat)),
+                    ]
+                    pending.extend(tutor_tasks)
+                    for text, tts_task in zip((tutor_feedback["comments"], tutor_feedback["correction"]), tutor_tasks):
+                        audio_bytes = await within_deadline(tts_task, "tts")
+                        yield "audio", {"index": index, "source": "tutor", "text": text, "format": audio_data.audioFormat}, audio_bytes
+                        index += 1
+
+                while (segment := await within_deadline(partner_segments.get(), "partner")) is not None:
+                    text, tts_task = segment
+                    audio_bytes = await within_deadline(tts_task, "tts")
+                    yield "audio", {"index": index, "source": "partner", "text": text, "format": audio_data.audioFormat}, audio_bytes
+                    index += 1
+                await within_deadline(partner_task, "partner")
+
+                partner_message = AIMessage(content="".join(partner_reply))
+                updated_chat_history = chat_history + [partner_message]
+                updated_summary = None
+                if session_revision is None:
+                    updated_summary = await within_deadline(summarize_or_keep(
+                        audio_data.tutoringLanguage,
+                        updated_chat_history,
+                        last_summary,
+                        provider,
+                        api_key
+                    ), "summary")
+
+                turn_result = await finish_turn(
+                    audio_data, chat_object, session_revision,
+                    [chat_history[-1], partner_message], updated_summary,
+                    format_tutors_comment(tutor_feedback), merged_summaries)
+                TURN_SECONDS.observe(time.perf_counter() - turn_start, endpoint="process_audio_stream", provider=provider)
+                yield "done", turn_result, None
+
+            except DeadlineExceededError as e:
+                record_abandoned("process_audio_stream", "deadline")
+                yield "error", {"detail": str(e)}, None
+            except ProviderUnavailableError as e:
+                ERRORS.inc(stage="turn", provider=provider)
+                yield "error", {"detail": str(e), "retryAfter": e.retry_after}, None
+            except HTTPException as e:
+                # E.g. a stale session revision; the client re-seeds its session on 404/409
+                logger.info(f"Turn ended with {e.status_code}: {e.detail}")
+                yield "error", {"status": e.status_code, "detail": e.detail}, None
+            except Exception as e:
+                ERRORS.inc(stage="turn", provider=provider)
+                logger.error(f"An error occurred: {str(e)}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                yield "error", {"detail": str(e)}, None
+            finally:
+                for task in pending:
+                    if not task.done():
+                        task.cancel()
+
+    binary = wants_segment_stream(accept)
+
+    async def encoded_stream():
+        events = turn_events()
+        encoding_seconds = 0.0
+        finished = False
+        IN_FLIGHT.inc(endpoint="process_audio_stream")
+        try:
+            async for event, payload, audio_bytes in events:
+                encoding_start = time.perf_counter()
+                if binary:
+                    chunks = [json_frame(event, payload)]
+                    if audio_bytes is not None:
+                        chunks.extend([audio_frame_header(audio_bytes), audio_bytes])
+                else:
+                    if audio_bytes is not None:
+                        payload = {**payload, "audio_base64": base64.b64encode(audio_bytes).decode('utf-8')}
+                    chunks = [sse_event(event, payload)]
+                encoding_seconds += time.perf_counter() - encoding_start
+                for chunk in chunks:
+                    yield chunk
+            finished = True
+        finally:
+            # Starlette cancels the stream when the client disconnects; turn_events then
+            # cancels whatever is still pending
+            if not finished:
+                record_abandoned("process_audio_stream", "disconnect")
+            IN_FLIGHT.dec(endpoint="process_audio_stream")
+            STAGE_SECONDS.observe(encoding_seconds, stage="serialization", provider=provider, model="")
+            await events.aclose()
+
+    return AdmittedStreamingResponse(encoded_stream(), ticket,
+                                     media_type=SEGMENT_STREAM_MEDIA_TYPE if binary else "text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/generate_homework")
-async def generate_homework_endpoint(request_data: AudioData):
+async def generate_homework_endpoint(request_data: AudioData, request: Request,
+                                     x_request_timeout: Optional[str] = Header(None)):
     try:
         logger.info("Starting generate_homework function")
+        chat_object, session_revision, _ = await load_chat_object(request_data)
 
-        # Interweave chat history and tutor comments
-        interwoven_context = []
-        for i, msg in enumerate(request_data.chatObject.chat_history):
-            interwoven_context.append(f"{msg.type}: {msg.content}")
-            
-            if i < len(request_data.chatObject.tutors_comments):
-                interwoven_context.append("")  # Empty line
-                interwoven_context.append(f"Tutor: {request_data.chatObject.tutors_comments[i]}")
-                interwoven_context.append("")  # Empty line
+        if session_revision is not None:
+            # Use the homework pre-generated in the background if it covers the latest turn
+            pregenerated = (await session_store.get_artifacts(request_data.sessionId)).get("homework")
+            if pregenerated and pregenerated["revision"] == session_revision:
+                logger.info("Returning pre-generated homework")
+                return JSONResponse({
+                    "homework": pregenerated["homework"]
+                })
 
-        # Join the interwoven context
-        full_context = "\n".join(interwoven_context)
+        full_context = homework_context(chat_object)
 
-        # Select the appropriate API key based on the model
-        api_key = request_data.api_key
+        # Use the API key from request_data if it's not empty, otherwise use the server's key
         provider = request_data.model.lower()
-        
-        if not api_key.strip():
-            # Use the previous method to get the API key
-            if provider == "openai":
-                api_key = OPENAI_API_KEY
-            elif provider == "groq":
-                api_key = get_random_groq_api_key()
-            else:
-                raise ValueError(f"For this provider use your key: {provider}")
-            
+        try:
+            api_key = await resolve_api_key(request_data.api_key, provider)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         # Generate homework using the new agent function
-        homework = await generate_homework(
-            request_data.tutoringLanguage,
-            full_context,
-            provider=provider,
-            api_key=api_key
-        )
+        with deadline_scope(request_deadline("generate_homework", x_request_timeout)):
+            async with admitted("generate_homework", provider):
+                homework = await until_disconnected(request, "generate_homework", within_deadline(generate_homework(
+                    request_data.tutoringLanguage,
+                    full_context,
+                    provider=provider,
+                    api_key=api_key
+                ), "homework"))
 
         return JSONResponse({
             "homework": homework
         })
 
+    except DeadlineExceededError as e:
+        record_abandoned("generate_homework", "deadline")
+        raise HTTPException(status_code=504, detail=str(e))
+    except ProviderUnavailableError as e:
+        raise provider_unavailable(e)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate_chat_name")
-async def generate_chat_name_endpoint(request_data: dict):
+async def generate_chat_name_endpoint(request_data: dict, request: Request,
+                                      x_request_timeout: Optional[str] = Header(None)):
     try:
         logger.info("Starting generate_chat_name function")
         logger.info(f"Received request data: {request_data}")  # Add this line for debugging
@@ -386,6 +1218,18 @@ async def generate_chat_name_endpoint(request_data: dict):
         # Get the latest summary
         latest_summary = request_data.get('summary', [])[-1] if request_data.get('summary') else ""
 
+        # Session chats are named in the background after each summary
+        session_id = request_data.get('sessionId')
+        if session_id:
+            artifacts = await session_store.get_artifacts(session_id)
+            if "chat_name" in artifacts:
+                logger.info("Returning pre-generated chat name")
+                return JSONResponse({
+                    "chatName": artifacts["chat_name"]["name"]
+                })
+            if "summary" in artifacts:
+                latest_summary = artifacts["summary"]["text"]
+
         # Select the appropriate API key based on the model
         model = request_data.get('model', '').lower()
         if model == "openai":
@@ -393,21 +1237,30 @@ async def generate_chat_name_endpoint(request_data: dict):
             provider = "openai"
             logger.info("Using OpenAI API key")
         else:
-            api_key = get_random_groq_api_key()
+            api_key = await get_groq_api_key()
             provider = "groq"
             logger.info(f"Using Groq API key: {api_key[:5]}...")  # Log first 5 characters for security
 
         # Generate chat name using the new agent function
-        chat_name = await generate_chat_name(
-            latest_summary,
-            provider=provider,
-            api_key=api_key
-        )
+        with deadline_scope(request_deadline("generate_chat_name", x_request_timeout)):
+            async with admitted("generate_chat_name", provider):
+                chat_name = await until_disconnected(request, "generate_chat_name", within_deadline(generate_chat_name(
+                    latest_summary,
+                    provider=provider,
+                    api_key=api_key
+                ), "chat_name"))
 
         return JSONResponse({
             "chatName": chat_name
         })
 
+    except DeadlineExceededError as e:
+        record_abandoned("generate_chat_name", "deadline")
+        raise HTTPException(status_code=504, detail=str(e))
+    except ProviderUnavailableError as e:
+        raise provider_unavailable(e)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
@@ -417,23 +1270,23 @@ async def generate_chat_name_endpoint(request_data: dict):
 
 
 if __name__ == "__main__":
-    
-    async def run_server():
-        config = uvicorn.Config(app, host="0.0.0.0", port=8080)
-        server = uvicorn.Server(config)
-        await server.serve()
-
-    logger.info("Starting the FastAPI application")
+    logger.info(f"Starting the FastAPI application with {WORKERS} worker(s)")
     try:
-        asyncio.run(run_server())
+        # Worker processes import main:app themselves. They share sessions, background jobs,
+        # API-key budgets and the TTS cache through SQLite (or Redis, see shared_state.py).
+        # On SIGTERM each worker stops accepting connections and finishes in-flight turns
+        # for up to GRACEFUL_SHUTDOWN_TIMEOUT seconds.
+        uvicorn.run(
+            "main:app" if WORKERS > 1 else app,
+            host=HOST,
+            port=PORT,
+            workers=WORKERS,
+            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_TIMEOUT,
+        )
     except KeyboardInterrupt:
         logger.info("Application stopped by user (KeyboardInterrupt)")
-    except asyncio.exceptions.CancelledError:
-        logger.info("Application tasks cancelled")
     except Exception as e:
         logger.error(f"An unexpected error occurred: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
     finally:
-        logger.info("Performing cleanup tasks...")
-        # Add any cleanup tasks here if needed
         logger.info("Application shutdown complete")
@@ -0,0 +1,380 @@
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from starlette.datastructures import MutableHeaders
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Turn stages run from tens of milliseconds (cached TTS) to tens of seconds (slow LLM calls)
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+# A healthy event loop wakes up within a millisecond or two of when it should
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    Base class for a labelled metric family in the Prometheus text exposition format.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.extend(self._render_sample(labelvalues, value))
+        return lines
+
+    def _render_sample(self, labelvalues, value):
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self, **labels):
+        """
+        Returns the cumulative bucket counts, sum and count for one label set.
+        """
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            counts = list(state["counts"]) if state else [0] * len(self.buckets)
+            total, count = (state["sum"], state["count"]) if state else (0.0, 0)
+        buckets = {}
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            buckets[_format_value(bound)] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, labelvalues, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Holds the process's metrics and renders them for a Prometheus scrape.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns every registered metric in the Prometheus text exposition format.
+
+        Returns:
+        str: The exposition text.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+TURN_SECONDS = registry.register(Histogram(
+    "tutor_turn_seconds", "Total time to answer a conversation turn.", ["endpoint", "provider"]))
+STAGE_SECONDS = registry.register(Histogram(
+    "tutor_stage_seconds", "Time spent in one stage of a turn (transcription, each LLM task, each TTS segment, serialization).",
+    ["stage", "provider", "model"]))
+LLM_FIRST_TOKEN_SECONDS = registry.register(Histogram(
+    "tutor_llm_first_token_seconds", "Time to the first streamed token of an LLM call.", ["stage", "provider", "model"]))
+ERRORS = registry.register(Counter(
+    "tutor_errors_total", "Failed turns and failed stages.", ["stage", "provider"]))
+RETRIES = registry.register(Counter(
+    "tutor_retries_total", "Retried provider requests and background jobs.", ["component"]))
+PROVIDER_RESPONSES = registry.register(Counter(
+    "tutor_provider_responses_total", "Responses from provider APIs by status code (429s are rate limits).", ["host", "status"]))
+IN_FLIGHT = registry.register(Gauge(
+    "tutor_requests_in_flight", "Requests currently being processed.", ["endpoint"]))
+DEADLINE_EXCEEDED = registry.register(Counter(
+    "tutor_deadline_exceeded_total", "Requests that ran out of their time budget, by the stage running at the time.", ["stage"]))
+ABANDONED_TURNS = registry.register(Counter(
+    "tutor_abandoned_requests_total", "Requests abandoned before they finished (client disconnect or deadline).", ["endpoint", "reason"]))
+ABANDONED_WORK_SECONDS = registry.register(Counter(
+    "tutor_abandoned_work_seconds_total", "Stage time spent on requests that were then abandoned.", ["endpoint", "reason"]))
+CANCELLED_STAGE_SECONDS = registry.register(Counter(
+    "tutor_cancelled_stage_seconds_total", "Time spent in stages before they were cancelled.", ["stage", "provider"]))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    "tutor_event_loop_lag_seconds", "How late the event loop ran a timer scheduled by the loop monitor.", buckets=LOOP_LAG_BUCKETS))
+LOOP_STALLS = registry.register(Counter(
+    "tutor_event_loop_stalls_total", "Times the event loop was blocked beyond the stall threshold, by the route running at the time.", ["route"]))
+LOOP_STALL_SECONDS = registry.register(Counter(
+    "tutor_event_loop_stall_seconds_total", "Time the event loop spent blocked in stalls.", ["route"]))
+CIRCUIT_STATE = registry.register(Gauge(
+    "tutor_circuit_state", "Provider circuit breaker state: 0 closed, 1 half-open, 2 open.", ["provider"]))
+CIRCUIT_REJECTED = registry.register(Counter(
+    "tutor_circuit_rejected_total", "LLM calls refused because the provider's circuit breaker was open.", ["provider"]))
+LLM_TOKENS = registry.register(Counter(
+    "tutor_llm_tokens_total", "Tokens used by LLM calls, as reported by the provider.", ["task", "provider", "model", "kind"]))
+LLM_COST_USD = registry.register(Counter(
+    "tutor_llm_cost_usd_total", "Estimated cost of LLM calls in USD, from the model router's price table.", ["task", "provider", "model"]))
+HEDGED_CALLS = registry.register(Counter(
+    "tutor_hedged_calls_total", "Hedgeable LLM calls by outcome (not_hedged, primary_won, hedge_won, failover).", ["task", "outcome"]))
+HEDGE_WASTED_SECONDS = registry.register(Counter(
+    "tutor_hedge_wasted_seconds_total", "Time the losing request of a hedged call ran before it was cancelled.", ["task", "provider"]))
+HEDGE_WASTED_TOKENS = registry.register(Counter(
+    "tutor_hedge_wasted_tokens_total", "Estimated tokens spent on the losing request of hedged calls.", ["task", "provider", "kind"]))
+HEDGE_WASTED_COST_USD = registry.register(Counter(
+    "tutor_hedge_wasted_cost_usd_total", "Estimated cost in USD of the losing request of hedged calls, from the model router's price table.", ["task", "provider"]))
+ADMISSION_WAIT_SECONDS = registry.register(Histogram(
+    "tutor_admission_wait_seconds", "Time admitted requests waited for a concurrency slot.", ["endpoint"]))
+ADMISSION_REJECTED = registry.register(Counter(
+    "tutor_admission_rejected_total", "Requests shed with a 503 before doing any work.", ["endpoint", "reason"]))
+ADMISSION_QUEUED = registry.register(Gauge(
+    "tutor_admission_queued", "Requests waiting for a concurrency slot.", ["endpoint"]))
+ADMISSION_ACTIVE = registry.register(Gauge(
+    "tutor_admission_active", "Requests holding a concurrency slot.", ["endpoint"]))
+
+# Stage timings of the request being handled, collected for its Server-Timing header.
+# Tasks spawned by the request copy the context and so append to the same list.
+request_stage_timings = ContextVar("request_stage_timings", default=None)
+
+def observe_stage(stage, provider, model, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage, provider=provider or "", model=model or "")
+    timings = request_stage_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+@contextmanager
+def stage_timer(stage, provider="", model=""):
+    """
+    Times a block as one turn stage and counts it as an error if it raises.
+
+    Args:
+    stage (str): The stage name.
+    provider (str, optional): The provider serving the stage.
+    model (str, optional): The model serving the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        CANCELLED_STAGE_SECONDS.inc(time.perf_counter() - start, stage=stage, provider=provider or "")
+        raise
+    except Exception:
+        ERRORS.inc(stage=stage, provider=provider or "")
+        raise
+    finally:
+        observe_stage(stage, provider, model, time.perf_counter() - start)
+
+def record_request(request):
+    # Stainless-generated SDKs (openai, groq) number their retries in this header
+    retry_count = request.headers.get("x-stainless-retry-count")
+    if retry_count and retry_count != "0":
+        RETRIES.inc(component=request.url.host)
+
+def record_response(response):
+    if response.request.extensions.get("warm_up"):
+        return
+    PROVIDER_RESPONSES.inc(host=response.request.url.host, status=response.status_code)
+
+# httpx.AsyncClient requires coroutine event hooks
+async def arecord_request(request):
+    record_request(request)
+
+async def arecord_response(response):
+    record_response(response)
+
+def _model_labels(metadata, invocation_params):
+    metadata = metadata or {}
+    invocation_params = invocation_params or {}
+    provider = metadata.get("ls_provider") or invocation_params.get("_type", "")
+    model = metadata.get("ls_model_name") or invocation_params.get("model") or invocation_params.get("model_name", "")
+    return provider, model
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Records latency, time to first token and errors of the LLM calls made for one task.
+    """
+
+    run_inline = True
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, invocation_params=None, **kwargs):
+        provider, model = _model_labels(metadata, invocation_params)
+        self._runs[run_id] = [time.perf_counter(), provider, model, False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and not run[3]:
+            run[3] = True
+            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - run[0], stage=self.stage, provider=run[1], model=run[2])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            observe_stage(self.stage, run[1], run[2], time.perf_counter() - run[0])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if isinstance(error, asyncio.CancelledError):
+            # Cancelled because the turn was abandoned or out of time, not a provider failure
+            if run is not None:
+                CANCELLED_STAGE_SECONDS.inc(time.perf_counter() - run[0], stage=self.stage, provider=run[1])
+            return
+        ERRORS.inc(stage=self.stage, provider=run[1] if run else "")
+
+def record_abandoned(endpoint, reason):
+    """
+    Counts an abandoned request and the stage time already spent on it.
+
+    Args:
+    endpoint (str): The endpoint name.
+    reason (str): "disconnect" or "deadline".
+    """
+    ABANDONED_TURNS.inc(endpoint=endpoint, reason=reason)
+    timings = request_stage_timings.get()
+    if timings:
+        ABANDONED_WORK_SECONDS.inc(sum(seconds for _, seconds in timings), endpoint=endpoint, reason=reason)
+
+def format_server_timing(timings, total):
+    """
+    Formats stage timings as a Server-Timing header value.
+
+    Stages that ran more than once (TTS segments, tutor sub-calls) appear once per run.
+
+    Args:
+    timings (list): (stage, seconds) pairs in the order they finished.
+    total (float): The request's total duration in seconds.
+
+    Returns:
+    str: The header value, durations in milliseconds.
+    """
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that reports a request's stage timings in a Server-Timing header.
+
+    For regular responses every stage has finished when the headers go out. Streamed
+    responses send their headers first, so they only report the stages before the stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = request_stage_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", format_server_timing(timings, time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stage_timings.reset(token)
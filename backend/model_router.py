@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+from metrics import LLM_TOKENS, LLM_COST_USD
+from context_builder import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Optional JSON file overriding the routes and prices below (see model_routes.example.json).
+# It is re-read when it changes, checked at most every MODEL_ROUTES_CHECK_INTERVAL seconds.
+MODEL_ROUTES_PATH = os.getenv("MODEL_ROUTES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_routes.json"))
+MODEL_ROUTES_CHECK_INTERVAL = float(os.getenv("MODEL_ROUTES_CHECK_INTERVAL", "5"))
+# Latency samples kept per (task, provider, model) for /model_routes/stats
+ROUTE_LATENCY_SAMPLES = int(os.getenv("ROUTE_LATENCY_SAMPLES", "200"))
+
+CONVERSATION_MODELS = {
+    "groq": "llama3-70b-8192",
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-sonnet-20240620",
+}
+WRITING_MODELS = {
+    "groq": "llama3-70b-8192",
+    "openai": "gpt-4o-2024-08-06",
+    "anthropic": "claude-3-5-sonnet-20240620",
+}
+
+# Model per (task, provider). Task names match prompt_registry's.
+DEFAULT_ROUTES = {
+    **{task: CONVERSATION_MODELS for task in (
+        "partner", "tutor_comment", "intervention_level", "best_expression", "structured_tutor", "summary")},
+    **{task: WRITING_MODELS for task in ("grammar", "vocabulary", "chat_name")},
+}
+
+# USD per million (input, output) tokens, for cost reporting only. List prices at the time
+# of writing; override them in the routes file.
+DEFAULT_PRICES = {
+    "llama3-70b-8192": (0.59, 0.79),
+    "llama3-8b-8192": (0.05, 0.08),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+    "claude-3-5-sonnet-20240620": (3.00, 15.00),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+}
+
+class Route:
+    """
+    The model a task runs on for one provider, with its limits.
+    """
+
+    def __init__(self, model, max_tokens=None, timeout=None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+
+    def to_dict(self):
+        return {"model": self.model, "max_tokens": self.max_tokens, "timeout": self.timeout}
+
+def parse_route(value):
+    """
+    Parses a route from the routes file: a model name or {"model", "max_tokens", "timeout"}.
+
+    Raises:
+    ValueError: If the entry is malformed.
+    """
+    if isinstance(value, str):
+        return Route(value)
+    if not isinstance(value, dict) or not isinstance(value.get("model"), str):
+        raise ValueError(f"Route needs a model name: {value!r}")
+    unknown = set(value) - {"model", "max_tokens", "timeout"}
+    if unknown:
+        raise ValueError(f"Unknown route settings: {sorted(unknown)}")
+    max_tokens = value.get("max_tokens")
+    timeout = value.get("timeout")
+    return Route(value["model"], int(max_tokens) if max_tokens else None, float(timeout) if timeout else None)
+
+def token_usage(response):
+    """
+    Extracts (input_tokens, output_tokens) from an LLMResult; zeros if the provider didn't report usage.
+    """
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            if metadata.get("input_tokens") or metadata.get("output_tokens"):
+                return metadata.get("input_tokens") or 0, metadata.get("output_tokens") or 0
+    usage = (response.llm_output or {}).get("token_usage") or (response.llm_output or {}).get("usage") or {}
+    return (usage.get("prompt_tokens") or usage.get("input_tokens") or 0,
+            usage.get("completion_tokens") or usage.get("output_tokens") or 0)
+
+class CallUsage:
+    """
+    What the LLM calls of one request spent: the model they went to, the prompt tokens
+    sent (estimated locally, so known even if the request is cancelled) and the tokens
+    the provider reported.
+    """
+
+    def __init__(self):
+        self.model = None
+        self.prompt_tokens = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+# Set around a request (see hedging.py) to collect its CallUsage
+call_usage = ContextVar("call_usage", default=None)
+
+class RouteUsageCallback(BaseCallbackHandler):
+    """
+    Reports the latency, tokens and cost of one task's LLM calls to the router.
+    """
+
+    run_inline = True
+
+    def __init__(self, router, task):
+        self.router = router
+        self.task = task
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, invocation_params=None, **kwargs):
+        metadata = metadata or {}
+        invocation_params = invocation_params or {}
+        provider = metadata.get("ls_provider") or invocation_params.get("_type", "")
+        model = metadata.get("ls_model_name") or invocation_params.get("model") or invocation_params.get("model_name", "")
+        self._runs[run_id] = (time.perf_counter(), provider, model)
+        usage = call_usage.get()
+        if usage is not None:
+            usage.model = model
+            usage.prompt_tokens += sum(estimate_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+                                       for batch in messages for message in batch)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            input_tokens, output_tokens = token_usage(response)
+            self.router.record_usage(self.task, run[1], run[2], time.perf_counter() - run[0], input_tokens, output_tokens)
+            usage = call_usage.get()
+            if usage is not None:
+                usage.input_tokens += input_tokens
+                usage.output_tokens += output_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+class ModelRouter:
+    """
+    Decides which model serves each task on each provider, and reports what that costs.
+
+    Routes start from DEFAULT_ROUTES and are overridden per (task, provider) by the routes
+    file, so cheap tasks such as the intervention level or the chat name can run on a
+    small, fast model while the partner keeps the large one. The file is picked up when it
+    changes, or on reload(); a file that fails to parse is logged and the routes in use are
+    kept. The file is first read when a route or price is first needed, not at import.
+
+    Per (task, provider, model) the router counts calls, latency, tokens and estimated cost,
+    for tuning the mix.
+    """
+
+    def __init__(self, path=MODEL_ROUTES_PATH, check_interval=MODEL_ROUTES_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._routes = {task: {provider: Route(model) for provider, model in models.items()}
+                        for task, models in DEFAULT_ROUTES.items()}
+        self._prices = dict(DEFAULT_PRICES)
+        self._mtime = None
+        self._checked = 0.0
+        self.last_error = None
+        self.usage = {}
+        self._callbacks = {}
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        # First use reads the routes file, so importing the module does no file I/O
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.reload()
+
+    def reload(self):
+        """
+        Re-reads the routes file.
+
+        Returns:
+        dict: The path, whether a file was loaded, and the error if it was rejected.
+        """
+        with self._lock:
+            self._loaded = True
+            self._checked = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            routes = {task: {provider: Route(model) for provider, model in models.items()}
+                      for task, models in DEFAULT_ROUTES.items()}
+            prices = dict(DEFAULT_PRICES)
+            if mtime is not None:
+                try:
+                    with open(self.path) as f:
+                        config = json.load(f)
+                    for task, providers in config.get("routes", {}).items():
+                        for provider, value in providers.items():
+                            routes.setdefault(task, {})[provider] = parse_route(value)
+                    for model, price in config.get("prices", {}).items():
+                        prices[model] = (float(price["input"]), float(price["output"]))
+                except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+                    self._mtime = mtime
+                    self.last_error = f"{type(e).__name__}: {str(e)}"
+                    logger.error(f"Keeping the current model routes; {self.path} is invalid: {self.last_error}")
+                    return {"path": self.path, "loaded": False, "error": self.last_error}
+                logger.info(f"Loaded model routes from {self.path}")
+            self._routes = routes
+            self._prices = prices
+            self._mtime = mtime
+            self.last_error = None
+            return {"path": self.path, "loaded": mtime is not None, "error": None}
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        self._checked = time.monotonic()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self.reload()
+
+    def route(self, task, provider):
+        """
+        Returns the route for a task on a provider.
+
+        Args:
+        task (str): The task name.
+        provider (str): The provider name.
+
+        Returns:
+        Route: The model and its limits.
+
+        Raises:
+        ValueError: If the task has no route for the provider.
+        """
+        self._ensure_loaded()
+        self._maybe_reload()
+        route = self._routes.get(task, {}).get(provider)
+        if route is None:
+            raise ValueError(f"Unsupported provider: {provider}")
+        return route
+
+    def usage_callback(self, task):
+        """
+        Returns the callback that reports a task's calls to the router.
+        """
+        callback = self._callbacks.get(task)
+        if callback is None:
+            callback = self._callbacks[task] = RouteUsageCallback(self, task)
+        return callback
+
+    def cost(self, model, input_tokens, output_tokens):
+        """
+        Estimates what a call cost in USD from the price table; 0 for models without a price.
+        """
+        self._ensure_loaded()
+        input_price, output_price = self._prices.get(model, (0.0, 0.0))
+        return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def record_usage(self, task, provider, model, seconds, input_tokens, output_tokens):
+        cost = self.cost(model, input_tokens, output_tokens)
+        LLM_TOKENS.inc(input_tokens, task=task, provider=provider, model=model, kind="input")
+        LLM_TOKENS.inc(output_tokens, task=task, provider=provider, model=model, kind="output")
+        LLM_COST_USD.inc(cost, task=task, provider=provider, model=model)
+        with self._lock:
+            usage = self.usage.get((task, provider, model))
+            if usage is None:
+                usage = self.usage[(task, provider, model)] = {
+                    "calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+                    "latencies": deque(maxlen=ROUTE_LATENCY_SAMPLES),
+                }
+            usage["calls"] += 1
+            usage["input_tokens"] += input_tokens
+            usage["output_tokens"] += output_tokens
+            usage["cost_usd"] += cost
+            usage["latencies"].append(seconds)
+
+    def get_stats(self):
+        """
+        Returns the routes in use and, per task, provider and model, calls, latency, tokens and cost.
+
+        Returns:
+        dict: Routing table and usage statistics.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            usage = {}
+            for (task, provider, model), stats in self.usage.items():
+                latencies = sorted(stats["latencies"])
+                usage[f"{task}/{provider}/{model}"] = {
+                    **{name: value for name, value in stats.items() if name != "latencies"},
+                    "p50_seconds": latencies[len(latencies) // 2] if latencies else None,
+                    "p95_seconds": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+                    "cost_per_call_usd": stats["cost_usd"] / stats["calls"] if stats["calls"] else 0.0,
+                }
+            return {
+                "path": self.path,
+                "loaded": self._mtime is not None,
+                "error": self.last_error,
+                "routes": {task: {provider: route.to_dict() for provider, route in providers.items()}
+                           for task, providers in self._routes.items()},
+                "usage": usage,
+            }
+
+model_router = ModelRouter()
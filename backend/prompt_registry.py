@@ -0,0 +1,171 @@
+import os
+import logging
+import threading
+from functools import lru_cache
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from metrics import LLMMetricsCallback
+from model_router import model_router
+from prompts import *
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "512"))
+
+# Each builder returns the message list for a task. System messages hold only language-
+# dependent instructions with the per-turn values at the very end; the learner's words always
+# travel as template variables, never as template text, so braces in speech can't break them.
+PROMPT_BUILDERS = {
+    "partner": lambda tutoring_language, tutors_language: [
+        ("system", get_partner_prompt(tutoring_language)),
+        MessagesPlaceholder(variable_name="chat_history"),
+    ],
+    "tutor_comment": lambda tutoring_language, tutors_language: [
+        ("system", get_tutor_comment_prompt(tutoring_language, tutors_language)),
+        ("human", "{utterance}"),
+    ],
+    "intervention_level": lambda tutoring_language, tutors_language: [
+        ("human", get_intervention_level_prompt(tutoring_language)),
+    ],
+    "best_expression": lambda tutoring_language, tutors_language: [
+        ("system", get_best_expression_prompt(tutoring_language)),
+        ("human", "{utterance}"),
+    ],
+    "structured_tutor": lambda tutoring_language, tutors_language: [
+        ("system", get_structured_tutor_prompt(tutoring_language, tutors_language)),
+        ("human", "{utterance}"),
+    ],
+    "summary": lambda tutoring_language, tutors_language: [
+        ("system", get_summarizer_prompt(tutoring_language)),
+        ("human", "Please proceed:"),
+    ],
+    "grammar": lambda tutoring_language, tutors_language: [
+        ("system", get_grammar_prompt(tutoring_language)),
+        ("human", "Please proceed:"),
+    ],
+    "vocabulary": lambda tutoring_language, tutors_language: [
+        ("system", get_vocabulary_prompt(tutoring_language)),
+        ("human", "Please proceed:"),
+    ],
+    "chat_name": lambda tutoring_language, tutors_language: [
+        ("system", get_chat_name_prompt()),
+        ("human", "Please proceed:"),
+    ],
+}
+
+def cached_input_tokens(response):
+    """
+    Extracts prompt and cached prompt token counts from an LLMResult.
+
+    Reads LangChain's usage_metadata first (input_token_details.cache_read, reported for
+    OpenAI and Anthropic), then the raw OpenAI-style prompt_tokens_details in llm_output.
+
+    Args:
+    response (LLMResult): The result passed to on_llm_end.
+
+    Returns:
+    tuple: (input_tokens, cached_tokens); zeros if the provider didn't report usage.
+    """
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            if metadata.get("input_tokens"):
+                details = metadata.get("input_token_details") or {}
+                return metadata["input_tokens"], details.get("cache_read") or 0
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return usage.get("prompt_tokens") or 0, details.get("cached_tokens") or 0
+
+class PromptUsageCallback(BaseCallbackHandler):
+    """
+    Counts prompt tokens and provider-cached prompt tokens for one task.
+    """
+
+    run_inline = True
+
+    def __init__(self, registry, task):
+        self.registry = registry
+        self.task = task
+
+    def on_llm_end(self, response, **kwargs):
+        self.registry.record_usage(self.task, *cached_input_tokens(response))
+
+class PromptRegistry:
+    """
+    Compiled prompt templates, built once per (task, tutoring language, tutor's language).
+
+    Keeps the prompts.py builders and ChatPromptTemplate parsing off the request path and,
+    because every template puts the per-turn values last, keeps the prompt prefix identical
+    across turns of the same language pair. Providers with prompt caching then bill and serve
+    that prefix from cache; the cached share of prompt tokens is tracked per task.
+    """
+
+    def __init__(self, max_size=PROMPT_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._callbacks = {
+            task: [PromptUsageCallback(self, task), LLMMetricsCallback(task), model_router.usage_callback(task)]
+            for task in PROMPT_BUILDERS
+        }
+        self.usage = {}
+        self._get = lru_cache(maxsize=max_size)(self._build)
+
+    def _build(self, task, tutoring_language, tutors_language):
+        return ChatPromptTemplate.from_messages(PROMPT_BUILDERS[task](tutoring_language, tutors_language))
+
+    def get(self, task, tutoring_language="", tutors_language=""):
+        """
+        Returns the compiled template for a task and language pair.
+
+        Args:
+        task (str): The task name, one of PROMPT_BUILDERS.
+        tutoring_language (str, optional): The language being learned.
+        tutors_language (str, optional): The language the tutor explains in.
+
+        Returns:
+        ChatPromptTemplate: The template; per-turn values are passed when invoking it.
+
+        Raises:
+        KeyError: If the task is unknown.
+        """
+        if task not in PROMPT_BUILDERS:
+            raise KeyError(f"Unknown prompt task: {task}")
+        return self._get(task, tutoring_language, tutors_language)
+
+    def config(self, task):
+        """
+        Returns the runnable config that attributes a call's prompt tokens and latency to `task`.
+
+        Args:
+        task (str): The task name.
+
+        Returns:
+        dict: A config for ainvoke/astream.
+        """
+        return {"callbacks": self._callbacks[task], "run_name": task}
+
+    def record_usage(self, task, input_tokens, cached_tokens):
+        with self._lock:
+            usage = self.usage.setdefault(task, {"calls": 0, "input_tokens": 0, "cached_tokens": 0})
+            usage["calls"] += 1
+            usage["input_tokens"] += input_tokens
+            usage["cached_tokens"] += cached_tokens
+
+    def get_stats(self):
+        """
+        Returns per-task prompt token usage and the share served from the provider's cache.
+
+        Returns:
+        dict: Per-task calls, prompt tokens, cached tokens and cached ratio, plus template cache info.
+        """
+        with self._lock:
+            tasks = {
+                task: {
+                    **usage,
+                    "cached_ratio": usage["cached_tokens"] / usage["input_tokens"] if usage["input_tokens"] else 0.0,
+                }
+                for task, usage in self.usage.items()
+            }
+        info = self._get.cache_info()
+        return {"tasks": tasks, "templates": {"cached": info.currsize, "hits": info.hits, "misses": info.misses}}
+
+prompt_registry = PromptRegistry()
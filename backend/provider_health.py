@@ -0,0 +1,306 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+from key_scheduler import key_id
+from metrics import CIRCUIT_STATE, CIRCUIT_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Rolling window for per-provider/model latency and error stats
+HEALTH_WINDOW_SECONDS = float(os.getenv("HEALTH_WINDOW_SECONDS", "60"))
+# A provider's breaker opens after this many failed calls in a row...
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+# ...and stays open this long before letting a probe call through
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+# How long a key validation result is trusted; rejections are rechecked sooner
+KEY_VALIDATION_TTL = float(os.getenv("KEY_VALIDATION_TTL", "3600"))
+KEY_REJECTION_TTL = float(os.getenv("KEY_REJECTION_TTL", "300"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+# The providers whose half-open probe the current request holds. Set to a fresh set per
+# request by ProbeScopeMiddleware; the tasks a request spawns share it.
+request_probes = ContextVar("request_probes", default=None)
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class ProviderUnavailableError(Exception):
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is failing; not calling it for another {retry_after:.0f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+def is_provider_failure(error):
+    """
+    Decides whether an LLM error says the provider is unhealthy, rather than the request.
+
+    Timeouts, connection errors and 5xx responses count. Other 4xx responses (a bad key,
+    a rate-limited key, an invalid request) are the caller's problem and don't.
+
+    Args:
+    error (BaseException): The error raised by the SDK.
+
+    Returns:
+    bool: True if the error should count against the provider's circuit breaker.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    if status_code is not None:
+        return status_code >= 500
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+class CircuitBreaker:
+    """
+    Fails calls to a provider fast while it is down.
+
+    Closed: calls go through; `failure_threshold` consecutive failures open the breaker.
+    Open: calls are refused with ProviderUnavailableError for `open_seconds`.
+    Half-open: one request at a time probes the provider; its success closes the breaker,
+    its failure opens it again. Every call that request makes goes through (a turn needs
+    the partner and the tutor calls, and refusing the siblings would fail the probe turn
+    even with the provider back), while other requests are refused. Outside a request,
+    the probe is a single call. A probe that never reports back is replaced after
+    `open_seconds`.
+    """
+
+    def __init__(self, provider, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.stats = {"opened": 0, "rejected": 0}
+        CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[CLOSED], provider=provider)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f"Circuit for {self.provider}: {self.state} -> {state}")
+        self.state = state
+        CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[state], provider=self.provider)
+
+    def check(self, now, probes=None):
+        """
+        Lets a call through or refuses it.
+
+        Args:
+        now (float): The current monotonic time.
+        probes (set, optional): The calling request's probe set (see request_probes).
+
+        Raises:
+        ProviderUnavailableError: While the breaker is open, or half-open with a probe running.
+        """
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+            self.probe_started = None
+        if self.state == HALF_OPEN:
+            if probes is not None and self.provider in probes:
+                return
+            if self.probe_started is None or now - self.probe_started >= self.open_seconds:
+                self.probe_started = now
+                if probes is not None:
+                    probes.add(self.provider)
+                return
+        if self.state == CLOSED:
+            return
+        self.stats["rejected"] += 1
+        CIRCUIT_REJECTED.inc(provider=self.provider)
+        retry_after = self.open_seconds - (now - self.opened_at) if self.state == OPEN else self.open_seconds
+        raise ProviderUnavailableError(self.provider, max(1.0, retry_after))
+
+    def record(self, ok, now):
+        if ok:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+            return
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.stats["opened"] += 1
+            self.opened_at = now
+            self._set_state(OPEN)
+
+    def get_stats(self, now):
+        stats = {**self.stats, "state": self.state, "consecutive_failures": self.consecutive_failures}
+        if self.state == OPEN:
+            stats["retry_after"] = max(0.0, self.open_seconds - (now - self.opened_at))
+        return stats
+
+class ProviderHealthCallback(BaseCallbackHandler):
+    """
+    Reports the outcome and latency of every call a chat model makes to the health tracker.
+    """
+
+    run_inline = True
+
+    def __init__(self, health, provider, model):
+        self.health = health
+        self.provider = provider
+        self.model = model
+        self._starts = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            self.health.record(self.provider, self.model, time.perf_counter() - start, ok=True)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if start is None or isinstance(error, asyncio.CancelledError):
+            # Cancelled by us (deadline or disconnect), which says nothing about the provider
+            return
+        self.health.record(self.provider, self.model, time.perf_counter() - start,
+                           ok=not is_provider_failure(error))
+
+class ProviderHealth:
+    """
+    Tracks how each provider and model is doing and guards calls with circuit breakers.
+
+    Keeps the latency and outcome of each LLM call over a rolling window per
+    (provider, model), and one CircuitBreaker per provider that check() consults before a
+    call. Also caches API key validation results by key digest.
+    """
+
+    def __init__(self, window=HEALTH_WINDOW_SECONDS, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 open_seconds=CIRCUIT_OPEN_SECONDS, validation_ttl=KEY_VALIDATION_TTL,
+                 rejection_ttl=KEY_REJECTION_TTL):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.validation_ttl = validation_ttl
+        self.rejection_ttl = rejection_ttl
+        self._calls = {}
+        self._breakers = {}
+        self._validations = {}
+        self._lock = threading.Lock()
+        self.validation_stats = {"hits": 0, "misses": 0}
+
+    def _breaker(self, provider):
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = self._breakers[provider] = CircuitBreaker(provider, self.failure_threshold, self.open_seconds)
+        return breaker
+
+    def check(self, provider):
+        """
+        Raises if the provider's circuit breaker refuses calls right now.
+
+        Args:
+        provider (str): The provider name.
+
+        Raises:
+        ProviderUnavailableError: If the provider is failing.
+        """
+        with self._lock:
+            self._breaker(provider).check(time.monotonic(), request_probes.get())
+
+    def record(self, provider, model, seconds, ok):
+        """
+        Records the outcome of one call.
+
+        Args:
+        provider (str): The provider name.
+        model (str): The model name.
+        seconds (float): How long the call took.
+        ok (bool): False if the call failed because of the provider.
+        """
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls.setdefault((provider, model), deque())
+            calls.append((now, seconds, ok))
+            while calls and calls[0][0] < now - self.window:
+                calls.popleft()
+            self._breaker(provider).record(ok, now)
+
+    def callback_for(self, provider, model):
+        """
+        Returns the callback that reports a chat model's calls here.
+        """
+        return ProviderHealthCallback(self, provider, model)
+
+    def cached_validation(self, provider, api_key):
+        """
+        Returns a cached key validation result, or None if there is none or it expired.
+
+        Args:
+        provider (str): The provider name.
+        api_key (str): The API key.
+
+        Returns:
+        bool: Whether the key was valid, or None.
+        """
+        cache_key = (provider, key_id(api_key))
+        with self._lock:
+            entry = self._validations.get(cache_key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.validation_stats["hits"] += 1
+                return entry[0]
+            self._validations.pop(cache_key, None)
+            self.validation_stats["misses"] += 1
+            return None
+
+    def store_validation(self, provider, api_key, valid):
+        ttl = self.validation_ttl if valid else self.rejection_ttl
+        with self._lock:
+            self._validations[(provider, key_id(api_key))] = (valid, time.monotonic() + ttl)
+
+    def get_stats(self):
+        """
+        Returns breaker states, rolling per-model latency and error rates, and key validation cache counters.
+
+        Returns:
+        dict: Provider health statistics.
+        """
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for (provider, model), calls in self._calls.items():
+                recent = sorted(seconds for ts, seconds, _ in calls if ts >= now - self.window)
+                if not recent:
+                    continue
+                errors = sum(1 for ts, _, ok in calls if ts >= now - self.window and not ok)
+                models[f"{provider}/{model}"] = {
+                    "calls": len(recent),
+                    "errors": errors,
+                    "error_rate": errors / len(recent),
+                    "p50_seconds": recent[len(recent) // 2],
+                    "p95_seconds": recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+                }
+            return {
+                "window_seconds": self.window,
+                "circuits": {provider: breaker.get_stats(now) for provider, breaker in self._breakers.items()},
+                "models": models,
+                "key_validation": {**self.validation_stats, "cached": len(self._validations)},
+            }
+
+class ProbeScopeMiddleware:
+    """
+    ASGI middleware that gives each request its own probe set, so a request admitted as a
+    half-open probe can make all of its calls.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = request_probes.set(set())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_probes.reset(token)
+
+provider_health = ProviderHealth()
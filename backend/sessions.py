@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+# Sessions without a turn for this long are deleted with their artifacts; 0 keeps them forever
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(30 * 24 * 3600)))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "3600"))
+
+class SessionNotFoundError(KeyError):
+    pass
+
+class SessionConflictError(Exception):
+    pass
+
+class SessionStore:
+    """
+    Conversation state kept on the server, keyed by session id.
+
+    Lets a client send only the new audio plus its session id and revision each turn instead
+    of the whole chat object. Every save bumps the revision; a save against a stale revision
+    raises SessionConflictError instead of silently overwriting a concurrent turn.
+
+    Results computed in the background (summaries, chat names, homework) are stored as
+    artifacts next to the conversation rather than in it, so writing them never bumps the
+    revision out from under the client. An artifact for a session that has since been
+    deleted is dropped, not stored.
+
+    Sessions expire `ttl` seconds after their last turn. While started, the store sweeps
+    expired sessions and their artifacts every `sweep_interval` seconds; a client holding an
+    expired session id gets a 404 and starts a new session from its local copy.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL_SECONDS, sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._open_lock = threading.Lock()
+        self._sweeper = None
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                revision INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_artifacts (
+                session_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (session_id, kind)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        conn.commit()
+        return conn
+
+    @property
+    def _db(self):
+        # Opened on first use, so importing the app doesn't create or migrate the database
+        if self._conn is None:
+            with self._open_lock:
+                if self._conn is None:
+                    self._conn = self._open()
+        return self._conn
+
+    def _create(self, state):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (session_id, revision, state, updated_at) VALUES (?, 0, ?, ?)",
+                (session_id, json.dumps(state), time.time())
+            )
+            self._db.commit()
+        return session_id, 0
+
+    def _load(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT revision, state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            raise SessionNotFoundError(session_id)
+        return row[0], json.loads(row[1])
+
+    def _save(self, session_id, expected_revision, state):
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE sessions SET revision = revision + 1, state = ?, updated_at = ? "
+                "WHERE session_id = ? AND revision = ?",
+                (json.dumps(state), time.time(), session_id, expected_revision)
+            )
+            self._db.commit()
+        if cursor.rowcount == 0:
+            raise SessionConflictError(f"Session {session_id} is not at revision {expected_revision}")
+        return expected_revision + 1
+
+    def _delete(self, session_id):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM session_artifacts WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def _put_artifact(self, session_id, kind, value):
+        # The existence check is part of the insert, so a job finishing after the session
+        # was deleted can't leave an orphan row behind
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR REPLACE INTO session_artifacts (session_id, kind, value, updated_at) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = ?)",
+                (session_id, kind, json.dumps(value), time.time(), session_id)
+            )
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def _sweep(self):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+            self._db.execute(
+                "DELETE FROM session_artifacts WHERE session_id NOT IN (SELECT session_id FROM sessions)"
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def _get_artifacts(self, session_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT kind, value FROM session_artifacts WHERE session_id = ?", (session_id,)
+            ).fetchall()
+        return {kind: json.loads(value) for kind, value in rows}
+
+    def _ping(self):
+        with self._lock:
+            self._db.execute("SELECT 1").fetchone()
+
+    async def ping(self):
+        """
+        Checks that the session database answers.
+
+        Returns:
+        bool: True if a trivial query succeeds.
+        """
+        try:
+            await asyncio.to_thread(self._ping)
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Session database check failed: {str(e)}")
+            return False
+
+    async def sweep(self):
+        """
+        Deletes sessions whose last turn is older than the TTL, and artifacts without a session.
+
+        Returns:
+        int: The number of sessions deleted.
+        """
+        deleted = await asyncio.to_thread(self._sweep)
+        if deleted:
+            logger.info(f"Deleted {deleted} expired sessions")
+        return deleted
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except sqlite3.Error as e:
+                logger.warning(f"Session sweep failed: {str(e)}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def start(self):
+        """
+        Starts sweeping expired sessions, unless the TTL is 0. Call from the app's startup hook.
+        """
+        if self.ttl > 0:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        """
+        Stops the sweeper.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def create(self, state):
+        """
+        Stores a new conversation.
+
+        Args:
+        state (dict): The initial chat object.
+
+        Returns:
+        tuple: The new session id and its revision (0).
+        """
+        return await asyncio.to_thread(self._create, state)
+
+    async def load(self, session_id):
+        """
+        Loads a conversation.
+
+        Args:
+        session_id (str): The session id.
+
+        Returns:
+        tuple: The current revision and the stored chat object.
+
+        Raises:
+        SessionNotFoundError: If the session does not exist.
+        """
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def save(self, session_id, expected_revision, state):
+        """
+        Replaces a conversation's state if it is still at `expected_revision`.
+
+        Args:
+        session_id (str): The session id.
+        expected_revision (int): The revision the new state was built from.
+        state (dict): The updated chat object.
+
+        Returns:
+        int: The new revision.
+
+        Raises:
+        SessionConflictError: If the session was modified in the meantime or does not exist.
+        """
+        return await asyncio.to_thread(self._save, session_id, expected_revision, state)
+
+    async def delete(self, session_id):
+        await asyncio.to_thread(self._delete, session_id)
+
+    async def put_artifact(self, session_id, kind, value):
+        """
+        Stores a background result for a session, replacing any previous one of the same kind.
+
+        Args:
+        session_id (str): The session id.
+        kind (str): The artifact kind, e.g. "summary".
+        value (dict): The JSON-serializable result.
+
+        Returns:
+        bool: False if the session no longer exists, in which case nothing is stored.
+        """
+        return await asyncio.to_thread(self._put_artifact, session_id, kind, value)
+
+    async def get_artifacts(self, session_id):
+        """
+        Returns a session's background results.
+
+        Args:
+        session_id (str): The session id.
+
+        Returns:
+        dict: The artifacts keyed by kind.
+        """
+        return await asyncio.to_thread(self._get_artifacts, session_id)
+
+session_store = SessionStore()
@@ -0,0 +1,239 @@
+import os
+import uuid
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where worker processes keep the state they must agree on (API-key budgets, TTS cache
+# accounting). The default SQLite file works for any number of workers on one host; a
+# redis:// URL (requires the redis package) also shares it across hosts.
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "sqlite:///shared_state.db")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "tutor:")
+
+class SQLiteSharedState:
+    """
+    Counters, numeric hashes and sliding windows in a SQLite file shared by worker processes.
+
+    Each update runs in its own transaction, so concurrent workers never lose updates.
+    """
+
+    supports_blobs = False
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._open_lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Losing the last moments of rate-limit bookkeeping on power loss is fine
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                key TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (key, field)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS windows (
+                key TEXT NOT NULL,
+                ts REAL NOT NULL,
+                amount REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS windows_key_ts ON windows (key, ts)")
+        conn.commit()
+        return conn
+
+    @property
+    def _db(self):
+        # Connected on the first update or read rather than when the module is imported
+        if self._conn is None:
+            with self._open_lock:
+                if self._conn is None:
+                    self._conn = self._open()
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            self._db.commit()
+        return rows
+
+    def incr(self, key, field, amount=1):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO hashes (key, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (key, field) DO UPDATE SET value = value + excluded.value",
+                (key, field, amount)
+            )
+            value = self._db.execute(
+                "SELECT value FROM hashes WHERE key = ? AND field = ?", (key, field)
+            ).fetchone()[0]
+            self._db.commit()
+        return value
+
+    def hmax(self, key, field, value):
+        self._execute(
+            "INSERT INTO hashes (key, field, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (key, field) DO UPDATE SET value = MAX(value, excluded.value)",
+            (key, field, value)
+        )
+
+    def hset(self, key, mapping):
+        with self._lock:
+            for field, value in mapping.items():
+                if value is None:
+                    self._db.execute("DELETE FROM hashes WHERE key = ? AND field = ?", (key, field))
+                else:
+                    self._db.execute(
+                        "INSERT INTO hashes (key, field, value) VALUES (?, ?, ?) "
+                        "ON CONFLICT (key, field) DO UPDATE SET value = excluded.value",
+                        (key, field, value)
+                    )
+            self._db.commit()
+
+    def hgetall(self, key):
+        return dict(self._execute("SELECT field, value FROM hashes WHERE key = ?", (key,)))
+
+    def window_add(self, key, amount, now, window):
+        with self._lock:
+            self._db.execute("DELETE FROM windows WHERE key = ? AND ts < ?", (key, now - window))
+            self._db.execute("INSERT INTO windows (key, ts, amount) VALUES (?, ?, ?)", (key, now, amount))
+            self._db.commit()
+
+    def window_sum(self, key, since):
+        count, total = self._execute(
+            "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM windows WHERE key = ? AND ts >= ?", (key, since)
+        )[0]
+        return count, total
+
+    def snapshot(self, window_keys, since, hash_keys):
+        """
+        Reads several windows and hashes in one transaction.
+
+        Returns:
+        tuple: ([(count, total) per window key], [fields per hash key]).
+        """
+        with self._lock:
+            sums = [tuple(self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM windows WHERE key = ? AND ts >= ?", (key, since)
+            ).fetchone()) for key in window_keys]
+            hashes = [dict(self._db.execute("SELECT field, value FROM hashes WHERE key = ?", (key,)).fetchall())
+                      for key in hash_keys]
+            self._db.commit()
+        return sums, hashes
+
+class RedisSharedState:
+    """
+    The same operations on a Redis-compatible server, for workers spread over several hosts.
+
+    Also stores blobs with a TTL, which lets the TTS cache share synthesized audio across hosts.
+    """
+
+    supports_blobs = True
+
+    # Raises a hash field to at least ARGV[2], atomically
+    HMAX_SCRIPT = """
+        local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+        if current == nil or current < tonumber(ARGV[2]) then
+            redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        end
+    """
+
+    def __init__(self, url, prefix=REDIS_KEY_PREFIX):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_URL points at Redis but the redis package is not installed")
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._hmax = self._redis.register_script(self.HMAX_SCRIPT)
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def incr(self, key, field, amount=1):
+        return float(self._redis.hincrbyfloat(self._key(key), field, amount))
+
+    def hmax(self, key, field, value):
+        self._hmax(keys=[self._key(key)], args=[field, value])
+
+    def hset(self, key, mapping):
+        values = {field: value for field, value in mapping.items() if value is not None}
+        removed = [field for field, value in mapping.items() if value is None]
+        pipeline = self._redis.pipeline()
+        if values:
+            pipeline.hset(self._key(key), mapping=values)
+        if removed:
+            pipeline.hdel(self._key(key), *removed)
+        pipeline.execute()
+
+    def hgetall(self, key):
+        return {field.decode(): float(value) for field, value in self._redis.hgetall(self._key(key)).items()}
+
+    def window_add(self, key, amount, now, window):
+        # Members must be unique, so each carries a random id next to its amount
+        member = f"{uuid.uuid4().hex}:{amount}"
+        pipeline = self._redis.pipeline()
+        pipeline.zremrangebyscore(self._key(key), "-inf", now - window)
+        pipeline.zadd(self._key(key), {member: now})
+        pipeline.expire(self._key(key), int(window * 2) + 1)
+        pipeline.execute()
+
+    def window_sum(self, key, since):
+        members = self._redis.zrangebyscore(self._key(key), since, "+inf")
+        return len(members), sum(float(member.rsplit(b":", 1)[1]) for member in members)
+
+    def snapshot(self, window_keys, since, hash_keys):
+        """
+        Reads several windows and hashes in a single pipelined round trip.
+
+        Returns:
+        tuple: ([(count, total) per window key], [fields per hash key]).
+        """
+        pipeline = self._redis.pipeline(transaction=False)
+        for key in window_keys:
+            pipeline.zrangebyscore(self._key(key), since, "+inf")
+        for key in hash_keys:
+            pipeline.hgetall(self._key(key))
+        results = pipeline.execute()
+        sums = [(len(members), sum(float(member.rsplit(b":", 1)[1]) for member in members))
+                for members in results[:len(window_keys)]]
+        hashes = [{field.decode(): float(value) for field, value in fields.items()}
+                  for fields in results[len(window_keys):]]
+        return sums, hashes
+
+    def get_blob(self, key):
+        return self._redis.get(self._key(key))
+
+    def set_blob(self, key, value, ttl):
+        self._redis.set(self._key(key), value, ex=int(ttl))
+
+def create_shared_state(url=SHARED_STATE_URL):
+    """
+    Opens the shared-state backend named by a URL.
+
+    Args:
+    url (str): "sqlite:///path/to/file.db" or a redis://, rediss:// or unix:// URL.
+
+    Returns:
+    SQLiteSharedState or RedisSharedState: The backend.
+
+    Raises:
+    ValueError: If the URL scheme is not supported.
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteSharedState(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        logger.info("Using Redis for shared state")
+        return RedisSharedState(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+shared_state = create_shared_state()
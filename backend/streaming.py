@@ -0,0 +1,154 @@
+import json
+import struct
+import logging
+from tts_chunker import fit_to_length, SENTENCE_END_RES, CHAR_WEIGHTS, TTS_FIRST_CHUNK_CHARS, TTS_TARGET_CHUNK_CHARS
+
+logger = logging.getLogger(__name__)
+
+class SentenceSplitter:
+    """
+    Incrementally cuts a stream of LLM tokens into sentences.
+
+    Tokens are fed in as they arrive; every complete sentence is returned as soon as its
+    boundary is seen, so it can be sent to TTS while the rest of the reply is still generating.
+    Boundaries and clause breaks use tts_chunker's punctuation for the language, so streamed
+    and non-streamed replies are cut the same way. Sentences shorter than `min_chars` are held
+    back and merged with the next one to avoid spending a TTS round trip on fragments like
+    "Ja.". Text longer than the chunk size (smaller for the first segment, so audio starts
+    early) is cut at a clause mark or space without waiting for the sentence to end.
+    """
+
+    def __init__(self, language="en", min_chars=12, first_chunk_chars=TTS_FIRST_CHUNK_CHARS,
+                 target_chunk_chars=TTS_TARGET_CHUNK_CHARS):
+        weight = CHAR_WEIGHTS.get(language, 1.0)
+        self.language = language
+        self.sentence_end = SENTENCE_END_RES.get(language, SENTENCE_END_RES["default"])
+        self.min_chars = max(1, int(min_chars / weight))
+        self.first_limit = max(1, int(first_chunk_chars / weight))
+        self.target = max(1, int(target_chunk_chars / weight))
+        self.buffer = ""
+        self.emitted = 0
+
+    def _cut(self, text, final=False):
+        """
+        Breaks text at the current size limit. Unless final, the last piece is left out
+        because more tokens may still join it.
+
+        Returns:
+        tuple: (the stripped segments, how many characters of text they used)
+        """
+        limit = self.first_limit if not self.emitted else self.target
+        pieces = fit_to_length(text, limit, self.language)
+        if not final:
+            pieces = pieces[:-1]
+        segments = [piece.strip() for piece in pieces if piece.strip()]
+        self.emitted += len(segments)
+        return segments, sum(len(piece) for piece in pieces)
+
+    def feed(self, text):
+        """
+        Adds a chunk of text and returns the segments it completed.
+
+        Args:
+        text (str): The next chunk of streamed text.
+
+        Returns:
+        list: Complete sentences (or clauses of long ones), in order.
+        """
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in self.sentence_end.finditer(self.buffer):
+            if match.end() >= len(self.buffer):
+                # The next token may turn "3." into "3.5" or bring the closing quote
+                break
+            candidate = self.buffer[start:match.end()]
+            if len(candidate.strip()) < self.min_chars:
+                continue
+            sentences.extend(self._cut(candidate, final=True)[0])
+            start = match.end()
+        self.buffer = self.buffer[start:]
+
+        # A sentence that is still going but already too long is sent a clause at a time
+        segments, used = self._cut(self.buffer)
+        sentences.extend(segments)
+        self.buffer = self.buffer[used:]
+        return sentences
+
+    def flush(self):
+        """
+        Returns whatever text is left once the stream has ended.
+
+        Returns:
+        list: The trailing sentence, or an empty list if nothing is buffered.
+        """
+        remainder = self.buffer
+        self.buffer = ""
+        return self._cut(remainder, final=True)[0]
+
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Events frame.
+
+    Args:
+    event (str): The event name.
+    data (dict): The JSON-serializable payload.
+
+    Returns:
+    str: The encoded SSE frame.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Binary alternative to SSE/base64: a length-prefixed frame stream. Each frame is a one-byte
+# kind, a 4-byte big-endian payload length, then the payload. JSON frames carry events and
+# chat state; every "audio" JSON frame is followed by one AUDIO frame with the raw bytes.
+SEGMENT_STREAM_MEDIA_TYPE = "application/x-tutor-segments"
+FRAME_JSON = 1
+FRAME_AUDIO = 2
+
+AUDIO_FORMATS = {
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+}
+
+def wants_segment_stream(accept):
+    """
+    Checks whether the client negotiated the binary segment stream via its Accept header.
+
+    Args:
+    accept (str): The Accept header value, or None.
+
+    Returns:
+    bool: True if the binary frame format should be used.
+    """
+    return bool(accept) and SEGMENT_STREAM_MEDIA_TYPE in accept
+
+def json_frame(event, data):
+    """
+    Encodes an event as a JSON frame.
+
+    Args:
+    event (str): The event name, stored under "event" in the payload.
+    data (dict): The JSON-serializable payload.
+
+    Returns:
+    bytes: The encoded frame.
+    """
+    payload = json.dumps({"event": event, **data}, ensure_ascii=False).encode("utf-8")
+    return struct.pack(">BI", FRAME_JSON, len(payload)) + payload
+
+def audio_frame_header(audio):
+    """
+    Returns the header of an AUDIO frame.
+
+    The audio itself is sent as a separate chunk after the header so the bytes are never
+    copied into a combined buffer.
+
+    Args:
+    audio (bytes): The audio payload the header describes.
+
+    Returns:
+    bytes: The 5-byte frame header.
+    """
+    return struct.pack(">BI", FRAME_AUDIO, len(audio))
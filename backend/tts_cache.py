@@ -0,0 +1,264 @@
+import os
+import re
+import asyncio
+import socket
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_MEMORY_MB = float(os.getenv("TTS_CACHE_MEMORY_MB", "64"))
+TTS_CACHE_DISK_MB = float(os.getenv("TTS_CACHE_DISK_MB", "1024"))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+# Lifetime of entries in the shared tier (Redis only); Redis' own eviction policy caps its size
+TTS_CACHE_SHARED_TTL = float(os.getenv("TTS_CACHE_SHARED_TTL", str(7 * 24 * 3600)))
+
+def normalize_tts_text(text):
+    """
+    Normalizes text so trivially different inputs share a cache entry.
+
+    Unicode is NFC-normalized and runs of whitespace are collapsed. Case and punctuation are
+    kept, since both change how the text is spoken.
+
+    Args:
+    text (str): The text to normalize.
+
+    Returns:
+    str: The normalized text.
+    """
+    return re.sub(r'\s+', ' ', unicodedata.normalize("NFC", text)).strip()
+
+class TTSCache:
+    """
+    Content-addressed cache for synthesized speech.
+
+    Entries are keyed by sha256(model, voice, normalized text). Lookups go to an in-memory
+    LRU tier first, then to an on-disk tier; both evict least recently used entries once
+    their byte budget is exceeded. Concurrent requests for the same key share a single
+    in-flight synthesis call.
+
+    Worker processes on one host share the disk tier, and its size is tracked in the
+    shared-state backend so their combined writes stay within the budget. With a Redis
+    backend, a shared tier between memory and disk also serves audio synthesized on other hosts.
+    """
+
+    def __init__(self, memory_max_bytes, disk_dir, disk_max_bytes, state=shared_state,
+                 shared_ttl=TTS_CACHE_SHARED_TTL):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.state = state
+        self.shared_ttl = shared_ttl
+        # Disk usage is per host and directory, even when the backend is shared across hosts
+        self._disk_state_key = f"tts_cache:{socket.gethostname()}:{os.path.abspath(disk_dir)}"
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._inflight = {}
+        self.stats = {
+            "memory_hits": 0,
+            "shared_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "inflight_joins": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "errors": 0,
+        }
+
+    @staticmethod
+    def make_key(model, voice, text, audio_format="mp3"):
+        payload = "\0".join([model, voice, audio_format, normalize_tts_text(text)])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get_or_generate(self, model, voice, text, generate, audio_format="mp3"):
+        """
+        Returns cached audio for (model, voice, text), synthesizing it on a miss.
+
+        Args:
+        model (str): The TTS model name.
+        voice (str): The voice name.
+        text (str): The text to speak.
+        generate (callable): Zero-argument coroutine function that synthesizes the audio.
+        audio_format (str, optional): The output codec. Defaults to "mp3".
+
+        Returns:
+        bytes: The audio content.
+        """
+        key = self.make_key(model, voice, text, audio_format)
+
+        audio = self._memory_get(key)
+        if audio is not None:
+            self.stats["memory_hits"] += 1
+            return audio
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats["inflight_joins"] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # The request synthesizing it was abandoned; unless this one was too, take over
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await self.get_or_generate(model, voice, text, generate, audio_format)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            audio = await asyncio.to_thread(self._shared_get, key)
+            if audio is not None:
+                self.stats["shared_hits"] += 1
+            else:
+                audio = await asyncio.to_thread(self._disk_get, key)
+                if audio is not None:
+                    self.stats["disk_hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+                    audio = await generate()
+                    await asyncio.to_thread(self._disk_put, key, audio)
+                await asyncio.to_thread(self._shared_put, key, audio)
+            self._memory_put(key, audio)
+            future.set_result(audio)
+            return audio
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no other request joined
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _memory_get(self, key):
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+        return audio
+
+    def _memory_put(self, key, audio):
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            return
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.stats["memory_evictions"] += 1
+
+    def _shared_get(self, key):
+        if not self.state.supports_blobs:
+            return None
+        try:
+            return self.state.get_blob(f"tts:{key}")
+        except Exception as e:
+            logger.warning(f"Shared TTS cache read failed for {key}: {str(e)}")
+            return None
+
+    def _shared_put(self, key, audio):
+        if not self.state.supports_blobs:
+            return
+        try:
+            self.state.set_blob(f"tts:{key}", audio, self.shared_ttl)
+        except Exception as e:
+            logger.warning(f"Shared TTS cache write failed for {key}: {str(e)}")
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            # Bump mtime so disk eviction is least-recently-used rather than oldest-written
+            os.utime(path)
+            return audio
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"TTS cache read failed for {key}: {str(e)}")
+            return None
+
+    def _disk_put(self, key, audio):
+        if self.disk_max_bytes <= 0:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"TTS cache write failed for {key}: {str(e)}")
+            return
+
+        if "disk_bytes" not in self.state.hgetall(self._disk_state_key):
+            # First write since the shared state was created: measure what is already on disk
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+            self.state.hset(self._disk_state_key, {"disk_bytes": self._disk_bytes})
+        else:
+            self._disk_bytes = self.state.incr(self._disk_state_key, "disk_bytes", len(audio))
+        if self._disk_bytes > self.disk_max_bytes:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        # Evict down to 90% of the budget so we don't rescan on every write
+        target = self.disk_max_bytes * 0.9
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.stats["disk_evictions"] += 1
+            except OSError:
+                pass
+        self._disk_bytes = total
+        self.state.hset(self._disk_state_key, {"disk_bytes": total})
+
+    def get_stats(self):
+        """
+        Returns hit/miss counters and current tier sizes.
+
+        Returns:
+        dict: Cache statistics.
+        """
+        hits = self.stats["memory_hits"] + self.stats["shared_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "inflight": len(self._inflight),
+        }
+
+tts_cache = TTSCache(
+    memory_max_bytes=int(TTS_CACHE_MEMORY_MB * 1024 * 1024),
+    disk_dir=TTS_CACHE_DIR,
+    disk_max_bytes=int(TTS_CACHE_DISK_MB * 1024 * 1024),
+)
@@ -0,0 +1,207 @@
+import os
+import re
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sizes are in Latin-script characters; see CHAR_WEIGHTS for other scripts. The first chunk
+# is kept short so its audio is ready early; the rest are balanced against each other
+# because they are synthesized in parallel and the turn waits for the longest one.
+TTS_FIRST_CHUNK_CHARS = int(os.getenv("TTS_FIRST_CHUNK_CHARS", "80"))
+TTS_TARGET_CHUNK_CHARS = int(os.getenv("TTS_TARGET_CHUNK_CHARS", "200"))
+TTS_MAX_CHUNKS = int(os.getenv("TTS_MAX_CHUNKS", "6"))
+# A remainder shorter than this rides along with the first chunk instead of costing a call
+TTS_MIN_CHUNK_CHARS = int(os.getenv("TTS_MIN_CHUNK_CHARS", "30"))
+
+# Roughly how much speech one character carries compared to a Latin letter
+CHAR_WEIGHTS = {
+    "zh": 3.0,
+    "ja": 2.5,
+    "ko": 2.5,
+    "ar": 1.2,
+}
+
+# Closing quotes and brackets that belong to the sentence before them
+CLOSERS = "\"'»”’)]」』）"
+
+# Per language: (marks that end a sentence only when whitespace follows, marks that end
+# it on their own). Latin full stops need the whitespace so "3.5" and "z.B." mid-token
+# don't split; CJK, Devanagari and Arabic marks are not followed by a space.
+SENTENCE_MARKS = {
+    "default": (".!?…", ""),
+    "el": (".!;\u037e…", ""),  # Greek asks questions with ";" or its own U+037E
+    "ar": (".!…", "؟۔"),
+    "hi": (".!?…", "।॥"),
+    "zh": (".!?…", "。！？"),
+    "ja": (".!?…", "。！？．"),
+}
+# Where an over-long sentence may be broken, after the mark
+CLAUSE_MARKS = {
+    "default": ",;:—",
+    "el": ",:·—",
+    "ar": "،؛,:",
+    "zh": "，、；：,;:",
+    "ja": "、，；：,;:",
+}
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+def _sentence_end_re(spaced, unspaced):
+    closers = re.escape(CLOSERS)
+    parts = [f"[{re.escape(spaced)}]+[{closers}]*(?=\\s|$)"]
+    if unspaced:
+        parts.append(f"[{re.escape(unspaced)}]+[{closers}]*")
+    parts.append(r"\n+")
+    return re.compile("|".join(parts))
+
+SENTENCE_END_RES = {language: _sentence_end_re(*marks) for language, marks in SENTENCE_MARKS.items()}
+CLAUSE_RES = {language: re.compile(f"[{re.escape(marks)}]+") for language, marks in CLAUSE_MARKS.items()}
+
+def _split_after(text, pattern):
+    # Cuts after every match, keeping the text (and whitespace) intact
+    parts = []
+    start = 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            parts.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        parts.append(text[start:])
+    return parts
+
+def split_sentences(text, language="en"):
+    """
+    Splits text into sentences using the punctuation of its language.
+
+    Args:
+    text (str): The text.
+    language (str, optional): The ISO 639-1 code (see utils.language_to_code). Defaults to "en".
+
+    Returns:
+    list: The sentences, stripped, in order.
+    """
+    pattern = SENTENCE_END_RES.get(language, SENTENCE_END_RES["default"])
+    return [sentence.strip() for sentence in _split_after(text, pattern) if sentence.strip()]
+
+def _pack(parts, limit):
+    # Greedily joins consecutive parts while they fit within limit characters
+    packed = []
+    current = ""
+    for part in parts:
+        if current and len(current) + len(part) > limit:
+            packed.append(current)
+            current = ""
+        current += part
+    if current:
+        packed.append(current)
+    return packed
+
+def fit_to_length(text, limit, language, patterns=None):
+    """
+    Breaks a piece longer than `limit` characters at clause marks, then at spaces, and
+    cuts it evenly as a last resort.
+    """
+    if len(text) <= limit:
+        return [text]
+    if patterns is None:
+        patterns = [CLAUSE_RES.get(language, CLAUSE_RES["default"]), WHITESPACE_RE]
+    for index, pattern in enumerate(patterns):
+        parts = _split_after(text, pattern)
+        if len(parts) > 1:
+            return [piece for part in _pack(parts, limit) for piece in fit_to_length(part, limit, language, patterns[index:])]
+    # No break point at all, e.g. a long run of CJK text without commas
+    count = math.ceil(len(text) / limit)
+    size = math.ceil(len(text) / count)
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+def _balanced_groups(lengths, max_groups):
+    """
+    Splits a sequence into at most `max_groups` contiguous groups with the smallest
+    possible longest group, by binary search on that length.
+
+    Returns:
+    list: The group sizes, in order.
+    """
+    def group(limit):
+        sizes = []
+        current = None
+        for length in lengths:
+            if current is not None and current + length <= limit:
+                current += length
+                sizes[-1] += 1
+            else:
+                current = length
+                sizes.append(1)
+        return sizes
+
+    low = max(lengths)
+    high = sum(lengths)
+    while low < high:
+        middle = (low + high) // 2
+        if len(group(middle)) <= max_groups:
+            high = middle
+        else:
+            low = middle + 1
+    return group(low)
+
+def chunk_for_tts(text, language="en", first_chunk_chars=TTS_FIRST_CHUNK_CHARS,
+                  target_chunk_chars=TTS_TARGET_CHUNK_CHARS, max_chunks=TTS_MAX_CHUNKS,
+                  min_chunk_chars=TTS_MIN_CHUNK_CHARS):
+    """
+    Cuts a reply into the text segments that are synthesized in parallel.
+
+    Sentences are found with the language's own punctuation, and sentences longer than the
+    target size are broken at clause marks or spaces. The first chunk is kept to about
+    `first_chunk_chars` so the first audio is ready quickly. The rest is divided into
+    chunks of similar length, at most `max_chunks` in all, so that no single long chunk
+    holds up the turn. Sizes are weighted by CHAR_WEIGHTS for scripts that pack more speech
+    into each character.
+
+    Args:
+    text (str): The text to speak.
+    language (str, optional): The ISO 639-1 code of the text. Defaults to "en".
+    first_chunk_chars (int, optional): Target size of the first chunk.
+    target_chunk_chars (int, optional): Target size of the other chunks.
+    max_chunks (int, optional): Upper bound on the number of chunks.
+    min_chunk_chars (int, optional): Below this, the remainder joins the first chunk.
+
+    Returns:
+    list: The chunks, in reading order.
+    """
+    weight = CHAR_WEIGHTS.get(language, 1.0)
+    first_limit = max(1, int(first_chunk_chars / weight))
+    target = max(1, int(target_chunk_chars / weight))
+
+    # Pieces are raw slices of the text, whitespace included, so joining them back never
+    # adds a space the text didn't have (or drops one it did)
+    text = text.strip()
+    pattern = SENTENCE_END_RES.get(language, SENTENCE_END_RES["default"])
+    pieces = []
+    for sentence in _split_after(text, pattern):
+        for part in fit_to_length(sentence, target, language):
+            if pieces and not part.strip():
+                pieces[-1] += part
+            else:
+                pieces.append(part)
+    if not pieces:
+        return []
+
+    # The first chunk: whole pieces up to the first limit, or the head of the first piece
+    head = fit_to_length(pieces[0], first_limit, language)
+    first = [head[0]]
+    rest = head[1:] + pieces[1:]
+    while rest and len("".join(first + [rest[0]]).strip()) <= first_limit:
+        first.append(rest.pop(0))
+
+    rest_length = len("".join(rest).strip())
+    if not rest or max_chunks <= 1 or rest_length < min_chunk_chars / weight:
+        return ["".join(first + rest).strip()]
+
+    groups = min(max_chunks - 1, max(1, math.ceil(rest_length / target)))
+    chunks = ["".join(first).strip()]
+    start = 0
+    for size in _balanced_groups([len(piece) for piece in rest], groups):
+        chunks.append("".join(rest[start:start + size]).strip())
+        start += size
+    return chunks
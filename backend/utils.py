@@ -1,30 +1,98 @@
 # Import necessary libraries for audio processing, API interactions, and utility functions
-import io
-import requests
+import httpx
 from fastapi import HTTPException
-from openai import OpenAI
+from clients import client_registry, OPENAI_API_ROOTS
+from metrics import stage_timer
 import logging
 from pydantic import BaseModel
 from typing import List
-import tempfile
 import os
 
 # Set up logging for this module
 logger = logging.getLogger(__name__)
 
-def transcribe_audio(audio_content, language, api_key, new_parameter=None, provider="groq"):
+# Transcription HTTP settings. Requests ride the registry's shared keep-alive pool,
+# so many transcriptions can be in flight at once without re-opening TLS connections.
+TRANSCRIPTION_TIMEOUT = httpx.Timeout(
+    float(os.getenv("TRANSCRIPTION_TIMEOUT", "30")),
+    connect=float(os.getenv("TRANSCRIPTION_CONNECT_TIMEOUT", "5")),
+)
+
+TTS_MODEL = "tts-1"
+# Ceiling for one TTS call; within a turn the request deadline usually cuts it shorter
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "30"))
+
+TRANSCRIPTION_URLS = {
+    provider: f"{root}/audio/transcriptions" for provider, root in OPENAI_API_ROOTS.items()
+}
+
+TRANSCRIPTION_MODELS = {
+    "groq": "whisper-large-v3",
+    "openai": "whisper-1",
+}
+
+# Upload containers accepted by the Whisper endpoints. The providers detect the format from
+# the file extension, so the extension we forward must match the real container.
+UPLOAD_EXTENSIONS = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/webm": "webm",
+    "video/webm": "webm",
+    "audio/ogg": "ogg",
+    "audio/opus": "ogg",
+    "audio/mp4": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/m4a": "m4a",
+    "audio/aac": "m4a",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/flac": "flac",
+}
+
+def upload_file_info(filename, content_type):
+    """
+    Resolves the filename and content type to forward an uploaded recording with.
+
+    Args:
+    filename (str): The filename sent by the client, may be None.
+    content_type (str): The content type sent by the client, may include codec parameters
+        (e.g. "audio/webm;codecs=opus") or be None.
+
+    Returns:
+    tuple: The (filename, content_type) to send to the transcription provider.
+
+    Raises:
+    HTTPException: 415 if the container is not supported.
+    """
+    mime_type = (content_type or "").split(";")[0].strip().lower()
+    extension = UPLOAD_EXTENSIONS.get(mime_type)
+    if extension is None and filename and "." in filename:
+        # Fall back to the filename for clients that send application/octet-stream
+        extension = filename.rsplit(".", 1)[1].lower()
+        if extension not in set(UPLOAD_EXTENSIONS.values()):
+            extension = None
+    if extension is None:
+        raise HTTPException(status_code=415, detail=f"Unsupported audio type: {content_type or filename}")
+    return f"audio.{extension}", mime_type or "application/octet-stream"
+
+async def transcribe_audio(audio_content, language, api_key, new_parameter=None, provider="groq",
+                           filename="audio.wav", content_type="audio/wav"):
     """
     Transcribes audio content using either Groq or OpenAI API.
 
-    This function handles audio transcription by sending the audio content to the specified provider's API.
-    It supports both Groq and OpenAI as transcription providers and includes error handling and logging.
+    Both providers expose the same Whisper-compatible endpoint, so the audio is posted straight
+    from memory over the registry's shared async HTTP pool. The event loop is never blocked while the
+    provider works, and no temporary file is written.
 
     Args:
     audio_content (bytes): The audio content to transcribe.
-    language (str): The language of the audio.
+    language (str): The ISO 639-1 code of the audio's language.
     api_key (str): The API key for authentication.
     new_parameter (bool, optional): If True, includes the language in the transcription request. Defaults to None.
     provider (str, optional): The provider to use for transcription ('groq' or 'openai'). Defaults to "groq".
+    filename (str, optional): The upload filename; its extension tells the provider the container. Defaults to "audio.wav".
+    content_type (str, optional): The upload content type. Defaults to "audio/wav".
 
     Returns:
     str: The transcribed text.
@@ -33,87 +101,47 @@ def transcribe_audio(audio_content, language, api_key, new_parameter=None, provi
     HTTPException: If there's an error in the API call or if the API key is not provided.
     ValueError: If an unsupported provider is specified.
     """
-    if provider == "groq":
-        if not api_key:
-            raise HTTPException(status_code=500, detail="GROQ_API_KEY is not provided")
-
-        logger.debug(f"Using GROQ_API_KEY: {api_key[:5]}...")
-        logger.debug(f"New parameter value: {new_parameter}")
-
-        try:
-            # Set up the API request for Groq
-            url = "https://api.groq.com/openai/v1/audio/transcriptions"
-            headers = {
-                "Authorization": f"Bearer {api_key}"
-            }
-            files = {
-                "file": ("audio.wav", io.BytesIO(audio_content), "audio/wav")
-            }
-            data = {
-                "model": "whisper-large-v3",
-                "response_format": "text"
-            }
-            
-            # Include language in the request if new_parameter is True
-            if new_parameter:
-                data["language"] = language
-
-            # Send the request to Groq API
-            response = requests.post(url, headers=headers, files=files, data=data)
-            response.raise_for_status()
-            
-            # Extract and return the transcription
-            transcription_text = response.text.strip()
-            logger.info("Transcription extracted successfully using Groq")
-            return transcription_text
-        except requests.RequestException as e:
-            logger.error(f"Error in Groq API call: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Error in Groq API call: {str(e)}")
-    
-    elif provider == "openai":
-        if not api_key:
-            raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not provided")
-
-        logger.debug(f"Using OPENAI_API_KEY: {api_key[:5]}...")
-
-        try:
-            # Initialize OpenAI client
-            client = OpenAI(api_key=api_key)
-            
-            # Create a temporary file to store the audio content
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio_file:
-                temp_audio_file.write(audio_content)
-                temp_audio_file_path = temp_audio_file.name
-
-            # Open the temporary file and send it to OpenAI API
-            with open(temp_audio_file_path, "rb") as audio_file:
-                transcription_params = {
-                    "model": "whisper-1",
-                    "file": audio_file,
-                    "response_format": "text"
-                }
-                
-                # Include language in the request if new_parameter is True
-                if new_parameter:
-                    transcription_params["language"] = language_to_code(language)
-
-                # Get the transcription from OpenAI
-                transcription = client.audio.transcriptions.create(**transcription_params)
-
-            # Clean up the temporary file
-            os.unlink(temp_audio_file_path)
-
-            logger.info("Transcription extracted successfully using OpenAI")
-            return transcription
-        except Exception as e:
-            logger.error(f"Error in OpenAI API call: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Error in OpenAI API call: {str(e)}")
-    
-    else:
+    if provider not in TRANSCRIPTION_URLS:
         # Raise an error if an unsupported provider is specified
         raise ValueError(f"Unsupported provider: {provider}. Choose 'groq' or 'openai'.")
 
-def generate_tts(text, api_key, voice="onyx"):
+    if not api_key:
+        raise HTTPException(status_code=500, detail=f"{provider.upper()}_API_KEY is not provided")
+
+    logger.debug(f"Using {provider.upper()}_API_KEY: {api_key[:5]}...")
+    logger.debug(f"New parameter value: {new_parameter}")
+
+    headers = {
+        "Authorization": f"Bearer {api_key}"
+    }
+    files = {
+        "file": (filename, audio_content, content_type)
+    }
+    data = {
+        "model": TRANSCRIPTION_MODELS[provider],
+        "response_format": "text"
+    }
+
+    # Include language in the request if new_parameter is True
+    if new_parameter:
+        data["language"] = language
+
+    try:
+        client = client_registry.async_http_client
+        with stage_timer("transcription", provider, TRANSCRIPTION_MODELS[provider]):
+            response = await client.post(TRANSCRIPTION_URLS[provider], headers=headers, files=files, data=data,
+                                         timeout=TRANSCRIPTION_TIMEOUT)
+            response.raise_for_status()
+
+        # Extract and return the transcription
+        transcription_text = response.text.strip()
+        logger.info(f"Transcription extracted successfully using {provider}")
+        return transcription_text
+    except httpx.HTTPError as e:
+        logger.error(f"Error in {provider} transcription API call: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error in {provider} transcription API call: {str(e)}")
+
+def generate_tts(text, api_key, voice="onyx", response_format="mp3", timeout=None):
     """
     Generates text-to-speech audio using OpenAI's API.
 
@@ -124,6 +152,8 @@ def generate_tts(text, api_key, voice="onyx"):
     text (str): The text to convert to speech.
     api_key (str): The OpenAI API key for authentication.
     voice (str, optional): The voice to use for TTS. Defaults to "onyx".
+    response_format (str, optional): The output codec (mp3, opus or aac). Defaults to "mp3".
+    timeout (float, optional): Seconds left for the call; capped at TTS_TIMEOUT. Defaults to TTS_TIMEOUT.
 
     Returns:
     bytes: The generated audio content.
@@ -136,14 +166,18 @@ def generate_tts(text, api_key, voice="onyx"):
 
     logger.debug(f"Using OPENAI_API_KEY: {api_key[:5]}...")  # Log first 5 chars for security
     try:
-        # Initialize OpenAI client
-        client = OpenAI(api_key=api_key)
-        
+        # Reuse the long-lived client so the call rides an already open connection
+        client = client_registry.get_openai_client(api_key)
+
         # Make the API call to generate speech
+        # This runs in a worker thread that cancellation can't reach, so the SDK's own
+        # timeout is what stops it once the turn has run out of time
         response = client.audio.speech.create(
-            model="tts-1",
+            model=TTS_MODEL,
             voice=voice,
-            input=text
+            input=text,
+            response_format=response_format,
+            timeout=TTS_TIMEOUT if timeout is None else max(0.1, min(TTS_TIMEOUT, timeout))
         )
         logger.info(f"TTS audio generated successfully using voice: {voice}")
         return response.content
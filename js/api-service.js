@@ -34,16 +34,31 @@ function getApiKey(model) {
     return settingsManager.getSetting(`${lowerModel}ApiKey`) || '';
 }
 
-async function sendAudioToServer(audioBlob, formElements) {
+function uploadFilename(audioBlob) {
     /**
-     * Sends recorded audio to the server for processing.
-     * @param {Blob} audioBlob - The audio data to send.
+     * Names the upload after the blob's real container so the server can forward it as is.
+     * @param {Blob} audioBlob - The recording.
+     * @returns {string} The filename.
+     */
+    const extensions = {
+        'audio/webm': 'webm',
+        'audio/ogg': 'ogg',
+        'audio/mp4': 'm4a',
+        'audio/wav': 'wav'
+    };
+    const type = (audioBlob.type || '').split(';')[0];
+    return `recording.${extensions[type] || 'wav'}`;
+}
+
+function buildAudioData(formElements) {
+    /**
+     * Builds the per-turn request data from the form and the current chat.
+     * Chats backed by a server session send only their session id and revision.
      * @param {Object} formElements - Form elements containing user settings.
-     * @returns {Object} The processed result from the server.
+     * @returns {Object} The request data.
      */
-    // Get the current chat object
     const currentChat = tutorController.getCurrentChat();
-    
+
     const audioData = {
         tutoringLanguage: formElements.tutoringLanguageSelect.value,
         tutorsLanguage: formElements.tutorsLanguageSelect.value,
@@ -56,18 +71,149 @@ async function sendAudioToServer(audioBlob, formElements) {
         model: formElements.modelSelect.value,
         playbackSpeed: formElements.playbackSpeedSlider.value,
         pauseTime: formElements.pauseTimeSlider.value,
-        api_key: getApiKey(formElements.modelSelect.value)
+        api_key: getApiKey(formElements.modelSelect.value),
+        audioFormat: preferredAudioFormat()
     };
 
+    if (currentChat && currentChat.sessionId) {
+        audioData.chatObject = null;
+        audioData.sessionId = currentChat.sessionId;
+        audioData.revision = currentChat.revision;
+    }
+    return audioData;
+}
+
+async function createServerSession(chatObject) {
+    /**
+     * Starts a server-side session seeded with an existing chat.
+     * @param {Object} chatObject - The chat to seed the session with.
+     * @returns {Object} The new {sessionId, revision}.
+     */
+    const response = await fetch(`${API_URL}/sessions`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            chat_history: chatObject.chat_history || [],
+            tutors_comments: chatObject.tutors_comments || [],
+            summary: chatObject.summary || []
+        })
+    });
+
+    if (!response.ok) {
+        const errorText = await response.text();
+        throw new Error(`HTTP error! status: ${response.status}, message: ${errorText}`);
+    }
+    return await response.json();
+}
+
+const SEGMENT_STREAM_TYPE = 'application/x-tutor-segments';
+const FRAME_JSON = 1;
+const FRAME_AUDIO = 2;
+
+function preferredAudioFormat() {
+    /**
+     * Picks the TTS codec to request. Opus is roughly half the bytes of MP3 for speech,
+     * so it is used wherever the browser can decode it.
+     * @returns {string} 'mp3', 'opus' or 'aac'.
+     */
+    const setting = settingsManager.getSetting('audioFormat');
+    if (setting) {
+        return setting;
+    }
+    return new Audio().canPlayType('audio/ogg; codecs="opus"') ? 'opus' : 'mp3';
+}
+
+async function readSegmentStream(response, onEvent) {
+    /**
+     * Reads the binary segment stream: frames of [1-byte kind][4-byte big-endian length][payload].
+     * JSON frames are events; each "audio" event is followed by an audio frame with the raw bytes.
+     * @param {Response} response - The fetch response to read.
+     * @param {Function} onEvent - Called with (event, audioBytes) as frames complete; audioBytes is set for audio events.
+     */
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = new Uint8Array(0);
+    let pendingAudioEvent = null;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        const merged = new Uint8Array(buffer.length + value.length);
+        merged.set(buffer);
+        merged.set(value, buffer.length);
+        buffer = merged;
+
+        while (buffer.length >= 5) {
+            const view = new DataView(buffer.buffer, buffer.byteOffset, buffer.byteLength);
+            const kind = view.getUint8(0);
+            const length = view.getUint32(1);
+            if (buffer.length < 5 + length) break;
+
+            const payload = buffer.subarray(5, 5 + length);
+            buffer = buffer.slice(5 + length);
+
+            if (kind === FRAME_JSON) {
+                const event = JSON.parse(decoder.decode(payload));
+                if (event.event === 'audio') {
+                    pendingAudioEvent = event;
+                } else {
+                    onEvent(event, null);
+                }
+            } else if (kind === FRAME_AUDIO && pendingAudioEvent) {
+                onEvent(pendingAudioEvent, payload);
+                pendingAudioEvent = null;
+            }
+        }
+    }
+}
+
+// Aborting a turn's request makes the server cancel the turn's outstanding LLM and TTS calls
+let turnAbortController = null;
+
+function startTurnRequest() {
+    /**
+     * Returns the abort signal for a new turn request.
+     * @returns {AbortSignal} Aborted by abortTurnRequests().
+     */
+    if (!turnAbortController || turnAbortController.signal.aborted) {
+        turnAbortController = new AbortController();
+    }
+    return turnAbortController.signal;
+}
+
+function abortTurnRequests() {
+    /**
+     * Aborts every turn request in flight, e.g. when the tutor is stopped.
+     */
+    if (turnAbortController) {
+        turnAbortController.abort();
+        turnAbortController = null;
+    }
+}
+
+async function sendAudioToServer(audioBlob, formElements) {
+    /**
+     * Sends recorded audio to the server for processing.
+     * @param {Blob} audioBlob - The audio data to send.
+     * @param {Object} formElements - Form elements containing user settings.
+     * @returns {Object} The chat part of the response plus the audio segments, in playback order.
+     */
+    const audioData = buildAudioData(formElements);
+
     const formData = new FormData();
-    formData.append('audio', audioBlob, 'recording.wav');
+    formData.append('audio', audioBlob, uploadFilename(audioBlob));
     formData.append('data', JSON.stringify(audioData));
 
     try {
         console.time('serverProcessing');
         const response = await fetch(`${API_URL}/process_audio`, {
             method: 'POST',
-            body: formData
+            headers: { 'Accept': SEGMENT_STREAM_TYPE },
+            body: formData,
+            signal: startTurnRequest()
         });
 
         if (!response.ok) {
@@ -76,18 +222,84 @@ async function sendAudioToServer(audioBlob, formElements) {
             throw new Error(`HTTP error! status: ${response.status}, message: ${errorText}`);
         }
 
-        const result = await response.json();
+        let result = {};
+        const segments = [];
+        await readSegmentStream(response, (event, audioBytes) => {
+            if (event.event === 'audio') {
+                segments.push({ ...event, audio: audioBytes });
+            } else if (event.event === 'done') {
+                result = event;
+            }
+        });
         console.timeEnd('serverProcessing');
-        return {
-            audio_base64: result.audio_base64,
-            chatObject: result.chatObject
-        };
+        return { ...result, segments: segments };
     } catch (error) {
         console.error('Error sending audio to server:', error);
         throw error;
     }
 }
 
+async function streamAudioToServer(audioBlob, formElements, onAudioSegment) {
+    /**
+     * Sends recorded audio to the streaming endpoint and hands audio segments over as they arrive.
+     * @param {Blob} audioBlob - The audio data to send.
+     * @param {Object} formElements - Form elements containing user settings.
+     * @param {Function} onAudioSegment - Called with each {index, source, text, format, audio} segment, in playback order.
+     * @returns {Object} The chat part of the response ({chatObject}, or {sessionId, revision, delta}).
+     */
+    const audioData = buildAudioData(formElements);
+
+    const formData = new FormData();
+    formData.append('audio', audioBlob, uploadFilename(audioBlob));
+    formData.append('data', JSON.stringify(audioData));
+
+    try {
+        console.time('serverFirstAudio');
+        const response = await fetch(`${API_URL}/process_audio_stream`, {
+            method: 'POST',
+            headers: { 'Accept': SEGMENT_STREAM_TYPE },
+            body: formData,
+            signal: startTurnRequest()
+        });
+
+        if (!response.ok) {
+            const errorText = await response.text();
+            console.error('Server error response:', errorText);
+            throw new Error(`HTTP error! status: ${response.status}, message: ${errorText}`);
+        }
+
+        let turnResult = {};
+        let firstAudio = true;
+        let serverError = null;
+
+        await readSegmentStream(response, (event, audioBytes) => {
+            if (event.event === 'audio') {
+                if (firstAudio) {
+                    console.timeEnd('serverFirstAudio');
+                    firstAudio = false;
+                }
+                onAudioSegment({ ...event, audio: audioBytes });
+            } else if (event.event === 'done') {
+                turnResult = event;
+            } else if (event.event === 'error') {
+                serverError = event;
+            }
+        });
+
+        if (serverError) {
+            if (serverError.status) {
+                // Same shape as a failed response, so callers can react to the status
+                throw new Error(`HTTP error! status: ${serverError.status}, message: ${serverError.detail}`);
+            }
+            throw new Error(`Server error: ${serverError.detail}`);
+        }
+        return turnResult;
+    } catch (error) {
+        console.error('Error streaming audio to server:', error);
+        throw error;
+    }
+}
+
 async function sendHomeworkRequest(formElements) {
     /**
      * Sends a request to generate homework based on the current chat.
@@ -101,6 +313,8 @@ async function sendHomeworkRequest(formElements) {
         partnersVoice: formElements.partnersVoiceSelect.value,
         interventionLevel: formElements.interventionLevelSelect.value,
         chatObject: formElements.chatObject,
+        // Session chats can be answered from homework pre-generated on the server
+        sessionId: formElements.chatObject.sessionId || null,
         disableTutor: formElements.disableTutorCheckbox.checked,
         accentignore: formElements.accentIgnoreCheckbox.checked,
         model: formElements.modelSelect.value,
@@ -147,6 +361,7 @@ async function generateChatName(formElements) {
             chat_history: formElements.chatObject.chat_history,
             tutors_comments: formElements.chatObject.tutors_comments,
             summary: formElements.chatObject.summary,
+            sessionId: formElements.chatObject.sessionId || null,
             model:  formElements.modelSelect.value,
             tutoringLanguage: formElements.tutoringLanguageSelect.value,
             api_key: getApiKey(formElements.modelSelect.value)
@@ -177,4 +392,4 @@ async function generateChatName(formElements) {
     }
 }
 
-export { sendAudioToServer, sendHomeworkRequest, generateChatName };
+export { sendAudioToServer, streamAudioToServer, abortTurnRequests, createServerSession, sendHomeworkRequest, generateChatName };
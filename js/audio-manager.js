@@ -17,6 +17,8 @@ export class AudioManager {
         this.speechStartTime = null;
         this.silenceStartTime = null;
         this.onRecordingComplete = null;
+        // Upload the recorder's compressed container (WebM/Ogg Opus, M4A) instead of re-encoding to WAV
+        this.compressedUpload = true;
 
         // Constants
         this.SILENCE_THRESHOLD = 24;
@@ -180,6 +182,24 @@ export class AudioManager {
         }
     }
 
+    pickRecordingMimeType() {
+        /**
+         * Picks the first compressed container the browser can record.
+         * @returns {string} The MIME type, or '' to let the browser choose.
+         */
+        const candidates = ['audio/webm;codecs=opus', 'audio/ogg;codecs=opus', 'audio/mp4'];
+        return candidates.find(type => MediaRecorder.isTypeSupported(type)) || '';
+    }
+
+    recordedBlob() {
+        /**
+         * Wraps the recorded chunks in a blob labelled with the recorder's real container type.
+         * @returns {Blob} The recording.
+         */
+        const type = (this.mediaRecorder && this.mediaRecorder.mimeType) || 'audio/webm';
+        return new Blob(this.audioChunks, {type: type});
+    }
+
     startRecording() {
         /**
          * Starts recording audio.
@@ -187,7 +207,8 @@ export class AudioManager {
         console.log('Start recording function called');
         this.isRecording = true;
         this.audioChunks = [];
-        this.mediaRecorder = new MediaRecorder(this.stream);
+        const mimeType = this.pickRecordingMimeType();
+        this.mediaRecorder = new MediaRecorder(this.stream, mimeType ? { mimeType } : undefined);
         this.mediaRecorder.ondataavailable = event => {
             this.audioChunks.push(event.data);
         };
@@ -209,8 +230,7 @@ export class AudioManager {
             
             return new Promise((resolve) => {
                 this.mediaRecorder.onstop = () => {
-                    const audioBlob = new Blob(this.audioChunks, {type: 'audio/wav'});
-                    resolve({ discarded: false, audioBlob: audioBlob });
+                    resolve({ discarded: false, audioBlob: this.recordedBlob() });
                 };
             });
         }
@@ -254,6 +274,15 @@ export class AudioManager {
             return this.playDecodedAudio(audioBuffer, playbackSpeed);
         }
     
+        async playAudioBytes(audioBytes, playbackSpeed) {
+            // decodeAudioData detaches its input, so hand it a copy of just this segment
+            const arrayBuffer = audioBytes.slice().buffer;
+            const audioBuffer = await new Promise((resolve, reject) => {
+                this.audioContext.decodeAudioData(arrayBuffer, resolve, reject);
+            });
+            return this.playDecodedAudio(audioBuffer, playbackSpeed);
+        }
+    
         decodeAudioData(base64Audio) {
             return new Promise((resolve, reject) => {
                 const binaryString = atob(base64Audio);
@@ -293,6 +322,12 @@ export class AudioManager {
                 return null; // No speech detected
             }
     
+            if (this.compressedUpload) {
+                // Skip the decode/WAV re-encode; the transcriber copes with the short lead-in
+                const speechDuration = (Date.now() - this.speechStartTime) / 1000;
+                return speechDuration < this.MIN_VALID_DURATION ? null : audioBlob;
+            }
+    
             const audioBuffer = await this.blobToAudioBuffer(audioBlob);
             const recordingStartTime = this.currentSessionTimestamp;
             const trimStartTime = Math.max(0, this.speechStartTime - recordingStartTime - 300); // 300ms buffer
@@ -331,7 +366,7 @@ export class AudioManager {
             }
     
             this.isProcessing = true;
-            const audioBlob = new Blob(this.audioChunks, {type: 'audio/wav'});
+            const audioBlob = this.recordedBlob();
     
             try {
                 const trimmedBlob = await this.trimAudioFromSpeechStart(audioBlob);
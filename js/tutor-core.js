@@ -1,5 +1,6 @@
 import { AudioManager } from './audio-manager.js';
-import { sendAudioToServer, generateChatName } from './api-service.js';
+import { sendAudioToServer, streamAudioToServer, abortTurnRequests, createServerSession, generateChatName } from './api-service.js';
+import { settingsManager } from './settings-manager.js';
 
 const dbName = "TutorChatDB";
 const objectStoreName = "chatObjects";
@@ -126,7 +127,8 @@ class TutorController {
             const lastSummary = lastChat.summary[lastChat.summary.length - 1];
             const isEmptySummary = !lastSummary || lastSummary.trim() === '';
 
-            if (isEmptySummary) {
+            // Session summaries arrive a turn late, so let the server name session chats
+            if (isEmptySummary && !lastChat.sessionId) {
                 lastChat.name = "Empty Chat";
             } else {
                 try {
@@ -167,6 +169,8 @@ class TutorController {
     async stop() {
         this.isActive = false;
         await this.audioManager.stop();
+        // Closing the connection cancels the turn on the server too
+        abortTurnRequests();
         
         if (this.pendingProcessingPromise) {
             this.pendingProcessingPromise.cancel();
@@ -248,6 +252,18 @@ class TutorController {
                 throw new Error('No current chat found');
             }
 
+            // Session mode is the default: the turn returns without waiting for the summary
+            if (settingsManager.getSetting('serverSessions') !== false && !currentChat.sessionId) {
+                try {
+                    const session = await createServerSession(currentChat);
+                    currentChat.sessionId = session.sessionId;
+                    currentChat.revision = session.revision;
+                } catch (error) {
+                    // Fall back to sending the whole chat object this turn
+                    console.warn('Could not create a server session:', error);
+                }
+            }
+
             const formElementsWithChat = {
                 ...this.formElements,
                 chatObject: {
@@ -258,34 +274,76 @@ class TutorController {
                 }
             };
 
-            const result = await sendAudioToServer(audioData, formElementsWithChat);
+            const playbackSpeed = 0.9 + (parseFloat(this.formElements.playbackSpeedSlider.value) * 0.1);
+            let result;
+            if (settingsManager.getSetting('streamAudio') !== false) {
+                // Play each segment as soon as it arrives, queued behind the previous one
+                let playback = Promise.resolve();
+                result = await streamAudioToServer(audioData, formElementsWithChat, (segment) => {
+                    playback = playback.then(() => {
+                        if (segment.index === 0 && this.uiCallbacks.onAudioPlayStart) {
+                            this.uiCallbacks.onAudioPlayStart();
+                        }
+                        return this.audioManager.playAudioBytes(segment.audio, playbackSpeed);
+                    });
+                });
+                result.playback = playback;
+            } else {
+                result = await sendAudioToServer(audioData, formElementsWithChat);
+            }
+
+            let updatedChat = result.chatObject;
+            if (result.delta) {
+                // Session mode: the server only sends what this turn added
+                updatedChat = {
+                    ...currentChat,
+                    chat_history: [...currentChat.chat_history, ...result.delta.chat_history],
+                    tutors_comments: [...currentChat.tutors_comments, ...result.delta.tutors_comments],
+                    summary: [...currentChat.summary, ...result.delta.summary],
+                    sessionId: result.sessionId,
+                    revision: result.revision
+                };
+            }
 
-            if (result.chatObject) {
+            if (updatedChat) {
                 const index = this.chatObjects.findIndex(chat => chat.timestamp === this.currentChatTimestamp);
                 if (index !== -1) {
                     this.chatObjects[index] = {
-                        ...result.chatObject,
+                        ...updatedChat,
                         timestamp: this.currentChatTimestamp
                     };
                     await this.saveChatObjects();
                 }
                 
                 if (this.uiCallbacks.onAPIResponseReceived) {
-                    this.uiCallbacks.onAPIResponseReceived(result.chatObject);
+                    this.uiCallbacks.onAPIResponseReceived(updatedChat);
                 }
             }
             
-            if (result.audio_base64) {
+            if (result.playback) {
+                await result.playback;
+            } else if (result.segments && result.segments.length > 0) {
                 if (this.uiCallbacks.onAudioPlayStart) {
                     this.uiCallbacks.onAudioPlayStart();
                 }
-                const playbackSpeed = 0.9 + (parseFloat(this.formElements.playbackSpeedSlider.value) * 0.1);
-                await this.audioManager.playAudio(result.audio_base64, playbackSpeed);
+                for (const segment of result.segments) {
+                    await this.audioManager.playAudioBytes(segment.audio, playbackSpeed);
+                }
             }
             
             return { success: true };
         } catch (error) {
+            if (error.name === 'AbortError') {
+                // The tutor was stopped mid-turn; nothing to report
+                return { success: false, error: error.message };
+            }
             console.error('Error processing or playing audio:', error);
+            const currentChat = this.getCurrentChat();
+            if (currentChat && currentChat.sessionId && /status: (404|409)/.test(error.message)) {
+                // The server session is gone or out of sync; re-seed it from the local copy next turn
+                delete currentChat.sessionId;
+                delete currentChat.revision;
+            }
             if (this.uiCallbacks.onError) {
                 this.uiCallbacks.onError("Error processing or playing audio: " + error.message);
             }